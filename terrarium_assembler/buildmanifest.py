@@ -0,0 +1,226 @@
+"""
+    Build manifest for TA: where every file of out build came from
+    (FileSource and bin_files_sources tables) in SQLite.
+
+    python -m terrarium_assembler.buildmanifest export <manifest> <files.yaml> <bin-files.yaml>
+    python -m terrarium_assembler.buildmanifest convert <files.yaml> <bin-files.yaml> <manifest> [<files-after-minimization.yaml> <bin-files-after-minimization.yaml>]
+"""
+
+import os
+import sys
+import sqlite3
+import collections
+
+import yaml
+
+FileRow = collections.namedtuple('FileRow', 'relname source_type source source_path')
+
+SCHEMA = '''
+CREATE TABLE files (
+    relname TEXT PRIMARY KEY,
+    source_type TEXT NOT NULL,
+    source TEXT NOT NULL,
+    source_path TEXT NOT NULL,
+    removed INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX files_source_type ON files(source_type);
+CREATE INDEX files_source ON files(source);
+CREATE TABLE bin_sources (
+    relname TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    removed INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+BATCH = 10000
+
+
+def yaml_dumper():
+    return getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+
+class BuildManifest:
+    '''
+    Tables of build in SQLite database.
+
+    Rows are written while packing (batched), minimization marks rows as removed,
+    so «after minimization» view is just rows that are not removed.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA synchronous=OFF')
+        self.files_batch = []
+        self.bin_batch = []
+
+    def reset(self):
+        '''
+        Start new manifest (new packing).
+        '''
+        self.files_batch = []
+        self.bin_batch = []
+        self.db.executescript('''
+DROP TABLE IF EXISTS files;
+DROP TABLE IF EXISTS bin_sources;
+DROP TABLE IF EXISTS meta;
+''' + SCHEMA)
+        self.db.commit()
+
+    def exists(self):
+        row_ = self.db.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='files'").fetchone()
+        return row_ is not None
+
+    def set_meta(self, key, value):
+        self.db.execute('INSERT OR REPLACE INTO meta(key, value) VALUES (?, ?)', (key, str(value)))
+        self.db.commit()
+
+    def meta(self, key, default=None):
+        row_ = self.db.execute('SELECT value FROM meta WHERE key=?', (key,)).fetchone()
+        return row_[0] if row_ else default
+
+    def add_file(self, relname, source_type, source, source_path):
+        '''
+        Register file (later registration of the same relname wins).
+        '''
+        self.files_batch.append((relname, getattr(source_type, 'value', source_type), source, source_path))
+        if len(self.files_batch) >= BATCH:
+            self.flush()
+
+    def add_bin_source(self, relname, source):
+        self.bin_batch.append((relname, source))
+        if len(self.bin_batch) >= BATCH:
+            self.flush()
+
+    def flush(self):
+        if self.files_batch:
+            self.db.executemany('INSERT OR REPLACE INTO files(relname, source_type, source, source_path) VALUES (?, ?, ?, ?)',
+                                self.files_batch)
+            self.files_batch = []
+        if self.bin_batch:
+            self.db.executemany('INSERT OR REPLACE INTO bin_sources(relname, source) VALUES (?, ?)', self.bin_batch)
+            self.bin_batch = []
+        self.db.commit()
+
+    def remove(self, relnames):
+        '''
+        Mark files as removed by minimization.
+        '''
+        self.flush()
+        rows_ = [(r_,) for r_ in relnames]
+        self.db.executemany('UPDATE files SET removed=1 WHERE relname=?', rows_)
+        self.db.executemany('UPDATE bin_sources SET removed=1 WHERE relname=?', rows_)
+        self.db.commit()
+
+    def clear_removed(self):
+        self.flush()
+        self.db.execute('UPDATE files SET removed=0')
+        self.db.execute('UPDATE bin_sources SET removed=0')
+        self.db.commit()
+
+    def files(self, source_types=None):
+        '''
+        Files of build (FileRow), optionally only of given source types.
+        '''
+        self.flush()
+        sql_ = 'SELECT relname, source_type, source, source_path FROM files WHERE removed=0'
+        params_ = []
+        if source_types:
+            source_types = [getattr(st_, 'value', st_) for st_ in source_types]
+            sql_ += f" AND source_type IN ({','.join('?' * len(source_types))})"
+            params_ = source_types
+        for row_ in self.db.execute(sql_ + ' ORDER BY relname', params_):
+            yield FileRow(*row_)
+
+    def file(self, relname):
+        self.flush()
+        row_ = self.db.execute('SELECT relname, source_type, source, source_path FROM files WHERE relname=? AND removed=0',
+                               (relname,)).fetchone()
+        return FileRow(*row_) if row_ else None
+
+    def file_table(self):
+        '''
+        relname → FileRow, like FileSource dict.
+        '''
+        return {r_.relname: r_ for r_ in self.files()}
+
+    def bin_sources(self):
+        '''
+        relname → source of binary file, like bin_files_sources.
+        '''
+        self.flush()
+        return dict(self.db.execute('SELECT relname, source FROM bin_sources WHERE removed=0 ORDER BY relname'))
+
+    def export_yaml(self, files_path, bin_path):
+        '''
+        Human readable export.
+        '''
+        files_ = {r_.relname: {'source_type': r_.source_type, 'source': r_.source, 'source_path': r_.source_path}
+                  for r_ in self.files()}
+        with open(files_path, 'w', encoding='utf-8') as lf:
+            yaml.dump(files_, lf, Dumper=yaml_dumper(), allow_unicode=True)
+        with open(bin_path, 'w', encoding='utf-8') as lf:
+            yaml.dump(self.bin_sources(), lf, Dumper=yaml_dumper(), allow_unicode=True)
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+
+def yaml_file_rows(path):
+    '''
+    Rows of files table from YAML: old dumps of FileSource/FileInBuild objects or human export.
+    '''
+    with open(path, 'r', encoding='utf-8') as lf:
+        data_ = yaml.unsafe_load(lf) or {}
+    for relname_, fib_ in data_.items():
+        if isinstance(fib_, dict):
+            yield relname_, fib_['source_type'], fib_['source'], fib_['source_path']
+        else:
+            st_ = fib_.source_type
+            yield relname_, getattr(st_, 'value', st_), fib_.source, fib_.source_path
+
+
+def convert_yaml(files_yaml, bin_yaml, manifest_path, files_after_yaml=None, bin_after_yaml=None):
+    '''
+    Make manifest from YAML tables of old build trees.
+    '''
+    bm_ = BuildManifest(manifest_path)
+    bm_.reset()
+    for row_ in yaml_file_rows(files_yaml):
+        bm_.add_file(*row_)
+    with open(bin_yaml, 'r', encoding='utf-8') as lf:
+        for relname_, source_ in (yaml.unsafe_load(lf) or {}).items():
+            bm_.add_bin_source(relname_, source_)
+    bm_.flush()
+    if files_after_yaml and os.path.exists(files_after_yaml):
+        kept_ = set(r_[0] for r_ in yaml_file_rows(files_after_yaml))
+        bm_.remove([r_.relname for r_ in bm_.files() if r_.relname not in kept_])
+        bm_.set_meta('minimized', 1)
+    if bin_after_yaml and os.path.exists(bin_after_yaml):
+        with open(bin_after_yaml, 'r', encoding='utf-8') as lf:
+            kept_ = set((yaml.unsafe_load(lf) or {}).keys())
+        removed_ = [r_ for r_ in bm_.bin_sources() if r_ not in kept_]
+        bm_.db.executemany('UPDATE bin_sources SET removed=1 WHERE relname=?', [(r_,) for r_ in removed_])
+        bm_.db.commit()
+    bm_.close()
+
+
+def main():
+    if len(sys.argv) == 5 and sys.argv[1] == 'export':
+        bm_ = BuildManifest(sys.argv[2])
+        bm_.export_yaml(sys.argv[3], sys.argv[4])
+        return
+    if len(sys.argv) in [5, 7] and sys.argv[1] == 'convert':
+        convert_yaml(*sys.argv[2:])
+        return
+    print(__doc__)
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""
+    Resource-aware scheduler of build targets for TA (Nuitka utilities, custom builds):
+    targets are run concurrently within CPU and memory budgets, longest first.
+"""
+
+import os
+import sys
+import json
+import argparse
+import concurrent.futures
+import dataclasses as dc
+
+from .utils import mkdir_p
+from .stagerunner import run_logged
+
+
+def available_memory_gb():
+    '''
+    MemAvailable from /proc/meminfo, None if unknown.
+    '''
+    try:
+        with open('/proc/meminfo', 'r', encoding='utf-8') as lf:
+            for line_ in lf:
+                if line_.startswith('MemAvailable:'):
+                    return int(line_.split()[1]) / 1024 / 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+@dc.dataclass
+class BuildTarget:
+    '''
+    Build script (with arguments) and resources it takes.
+    Targets of lower group are finished before higher group starts.
+    '''
+    name: str
+    script: str
+    cpus: int = 1
+    memory_gb: float = 1.0
+    group: int = 0
+    args: tuple = ()
+
+
+class BuildScheduler:
+    '''
+    Runs targets on threads while their CPUs and memory fit into budgets
+    (target that does not fit at all is run alone). Targets are started longest first,
+    durations are taken from previous runs («history_path»), unknown ones are considered longest.
+    Output of every target is streamed into «logs_dir/<name>.log».
+    '''
+
+    def __init__(self, cpus, memory_gb, history_path, logs_dir, cwd=None):
+        self.cpus = max(1, cpus)
+        self.memory_gb = memory_gb
+        self.history_path = history_path
+        self.logs_dir = logs_dir
+        self.cwd = cwd
+        self.history = {}
+        if history_path and os.path.exists(history_path):
+            try:
+                with open(history_path, 'r', encoding='utf-8') as lf:
+                    self.history = json.load(lf)
+            except Exception as ex_:
+                print(f"Broken build durations history {history_path}, ignoring it: {ex_}")
+
+    def order(self, targets):
+        return sorted(targets, key=lambda t_: (t_.group, -self.history.get(t_.name, float('inf'))))
+
+    def log_path(self, target):
+        return os.path.join(self.logs_dir, f'{target.name}.log')
+
+    def build(self, target):
+        print(f"Building {target.name} ({target.cpus} CPU, {target.memory_gb} GB)")
+        return run_logged(['./' + target.script] + list(target.args), self.log_path(target),
+                          cwd=self.cwd, prefix=f'[{target.name}] ')
+
+    def run(self, targets):
+        '''
+        Build all targets, returns name → result of run_logged.
+        '''
+        pending_ = self.order(targets)
+        running_ = {}
+        results_ = {}
+        free_cpus = self.cpus
+        free_mem = self.memory_gb
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(pending_))) as pool_:
+            while pending_ or running_:
+                started_ = True
+                while started_ and pending_:
+                    started_ = False
+                    group_ = pending_[0].group
+                    if any(r_.group < group_ for r_ in running_.values()):
+                        break
+                    for t_ in pending_:
+                        if t_.group != group_:
+                            break
+                        fits_ = t_.cpus <= free_cpus and (free_mem is None or t_.memory_gb <= free_mem)
+                        if fits_ or not running_:
+                            pending_.remove(t_)
+                            running_[pool_.submit(self.build, t_)] = t_
+                            free_cpus -= t_.cpus
+                            if free_mem is not None:
+                                free_mem -= t_.memory_gb
+                            started_ = True
+                            break
+                done_, _ = concurrent.futures.wait(running_, return_when=concurrent.futures.FIRST_COMPLETED)
+                for f_ in done_:
+                    t_ = running_.pop(f_)
+                    free_cpus += t_.cpus
+                    if free_mem is not None:
+                        free_mem += t_.memory_gb
+                    try:
+                        results_[t_.name] = f_.result()
+                    except Exception as ex_:
+                        # f.e. script is missing, other targets are still built
+                        results_[t_.name] = {'exit_code': -1, 'wall': 0, 'error': repr(ex_)}
+                    status_ = 'ok' if results_[t_.name]['exit_code'] == 0 else 'FAILED'
+                    print(f"Build {t_.name}: {status_} in {results_[t_.name]['wall']}s")
+                    if results_[t_.name]['exit_code'] == 0:
+                        self.history[t_.name] = results_[t_.name]['wall']
+        self.save()
+        return results_
+
+    def save(self):
+        if not self.history_path:
+            return
+        mkdir_p(os.path.dirname(self.history_path) or '.')
+        tmp_ = self.history_path + '.tmp'
+        with open(tmp_, 'w', encoding='utf-8') as lf:
+            json.dump(self.history, lf, indent=1, sort_keys=True)
+        os.replace(tmp_, self.history_path)
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Run build scripts concurrently within CPU and memory budgets')
+    ap.add_argument('--cpus', type=int, default=os.cpu_count(), help='CPU budget')
+    ap.add_argument('--memory-gb', type=float, default=None, help='Memory budget (default — 80%% of available)')
+    ap.add_argument('--history', type=str, default=None, help='JSON with durations of previous runs')
+    ap.add_argument('--logs-dir', type=str, default='reports', help='Folder for logs of targets')
+    ap.add_argument('--script', type=str, default=None,
+                    help='Run this script for every target, target is its argument (name is basename of it)')
+    ap.add_argument('--target-cpus', type=int, default=1, help='CPUs of every target for «--script»')
+    ap.add_argument('--target-memory-gb', type=float, default=1.0, help='Memory of every target for «--script»')
+    ap.add_argument('targets', nargs='*', help='name:script[:cpus[:memory_gb]] or arguments for «--script»')
+    args = ap.parse_args()
+
+    targets_ = []
+    for t_ in args.targets:
+        if args.script:
+            name_ = os.path.splitext(os.path.basename(t_))[0]
+            targets_.append(BuildTarget(name_, args.script, args.target_cpus, args.target_memory_gb, args=(t_,)))
+            continue
+        name_, script_, *res_ = t_.split(':')
+        targets_.append(BuildTarget(name_, script_, int(res_[0]) if res_ else 1, float(res_[1]) if len(res_) > 1 else 1.0))
+    if not targets_:
+        return
+    memory_gb_ = args.memory_gb
+    if memory_gb_ is None:
+        available_ = available_memory_gb()
+        memory_gb_ = round(available_ * 0.8, 1) if available_ else None
+    results_ = BuildScheduler(args.cpus, memory_gb_, args.history, args.logs_dir).run(targets_)
+    failed_ = [name_ for name_, res_ in results_.items() if res_['exit_code'] != 0]
+    if failed_:
+        print(f'Build of {", ".join(failed_)} failed', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+    Deduplication of identical files in «out» for TA:
+    hardlinks, reflinks (XFS/btrfs) or relative symlinks.
+"""
+
+import os
+import stat
+import fcntl
+import errno
+
+from .utils import map_ordered
+from .folderhash import content_digest
+
+DEDUP_MODES = ['none', 'hardlink', 'reflink', 'symlink']
+# ioctl FICLONE = _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+# tiny files are not worth it
+MIN_SIZE = 1024
+
+
+def reflink(src, dst):
+    with open(src, 'rb') as s_, open(dst, 'wb') as d_:
+        fcntl.ioctl(d_.fileno(), FICLONE, s_.fileno())
+
+
+class Deduplicator:
+    '''
+    Groups files by (size, mode), then by content hash,
+    and replaces all but first (by name) file of group by link to it.
+
+    Relnames stay in build tables (FileInBuild) — only what is stored under relname changes.
+    '''
+
+    def __init__(self, root, mode='hardlink', jobs=1, min_size=MIN_SIZE):
+        if mode not in DEDUP_MODES:
+            raise ValueError(f'Unknown dedup mode «{mode}», known are {DEDUP_MODES}')
+        self.root = root
+        self.mode = mode
+        self.jobs = jobs
+        self.min_size = min_size
+        self.links = {}
+        self.saved = 0
+        self.reflink_failed = False
+
+    def groups(self, relnames):
+        '''
+        Lists of relnames with identical content and mode.
+        '''
+        by_size_ = {}
+        for rel_ in relnames:
+            path_ = os.path.join(self.root, rel_)
+            try:
+                st_ = os.lstat(path_)
+            except OSError:
+                continue
+            if not stat.S_ISREG(st_.st_mode) or st_.st_size < self.min_size:
+                continue
+            by_size_.setdefault((st_.st_size, stat.S_IMODE(st_.st_mode)), []).append((rel_, st_.st_ino))
+
+        candidates_ = []
+        for key_, files_ in by_size_.items():
+            # files already hardlinked to each other are not candidates
+            if len(set(ino_ for _, ino_ in files_)) > 1:
+                candidates_.extend((key_, rel_, ino_) for rel_, ino_ in files_)
+
+        def digest(item_):
+            key_, rel_, ino_ = item_
+            return content_digest(os.path.join(self.root, rel_))
+
+        digests_ = map_ordered(digest, candidates_, self.jobs)
+        groups_ = {}
+        for (key_, rel_, ino_), digest_ in zip(candidates_, digests_):
+            groups_.setdefault(key_ + (digest_,), []).append((rel_, ino_))
+        return [sorted(g_) for g_ in groups_.values() if len(set(ino_ for _, ino_ in g_)) > 1]
+
+    def link(self, canonical, rel):
+        src_ = os.path.join(self.root, canonical)
+        dst_ = os.path.join(self.root, rel)
+        tmp_ = dst_ + '.ta-dedup'
+        mode_ = self.mode
+        if mode_ == 'reflink' and not self.reflink_failed:
+            try:
+                reflink(src_, tmp_)
+                os.chmod(tmp_, stat.S_IMODE(os.lstat(src_).st_mode))
+            except OSError as ex_:
+                if os.path.lexists(tmp_):
+                    os.unlink(tmp_)
+                if ex_.errno not in [errno.EOPNOTSUPP, errno.EXDEV, errno.EINVAL, errno.ENOTTY]:
+                    raise
+                print(f"Reflinks are not supported in {self.root}, using hardlinks")
+                self.reflink_failed = True
+        if mode_ == 'hardlink' or (mode_ == 'reflink' and self.reflink_failed):
+            os.link(src_, tmp_)
+        elif mode_ == 'symlink':
+            os.symlink(os.path.relpath(src_, os.path.dirname(dst_)), tmp_)
+        os.replace(tmp_, dst_)
+
+    def run(self, relnames):
+        '''
+        Deduplicate files with given relnames. Returns {duplicate relname: canonical relname}.
+        '''
+        if self.mode == 'none':
+            return self.links
+        for group_ in self.groups(relnames):
+            canonical_, canonical_ino = group_[0]
+            size_ = os.lstat(os.path.join(self.root, canonical_)).st_size
+            for rel_, ino_ in group_[1:]:
+                if ino_ == canonical_ino:
+                    continue
+                self.link(canonical_, rel_)
+                self.links[rel_] = canonical_
+                self.saved += size_
+        return self.links
@@ -0,0 +1,204 @@
+"""
+    Delta packages for TA: release manifests of «out» (kept in «changelogs»)
+    and self-applying update from previous release to the current one.
+"""
+
+import os
+import json
+import gzip
+import stat
+import errno
+import shutil
+import hashlib
+
+from .utils import map_ordered, mkdir_p
+from .minimize import TreeIndex
+
+RELEASE_FILE = 'ta-release.txt'
+DELTA_INFO = 'ta-delta.json'
+DELTA_SCRIPT = 'ta-apply-delta.sh'
+MANIFEST_SUFFIX = '.manifest.json.gz'
+# per-release and per-label files are not part of manifest
+SKIP_FILES = [RELEASE_FILE, 'isodistr.txt']
+
+
+def file_sha256(path):
+    h_ = hashlib.sha256()
+    with open(path, 'rb') as lf:
+        for chunk_ in iter(lambda: lf.read(1024*1024), b''):
+            h_.update(chunk_)
+    return h_.hexdigest()
+
+
+def release_manifest(root, jobs=1, rel2source=None):
+    '''
+    relative path → [sha256 (or «link:target» for symlinks), mode, size, source] of files of tree.
+    SHA256 is used (not blake2 as in caches) so delta can be verified by «sha256sum» on target.
+    '''
+    index_ = TreeIndex(root)
+    rels_ = sorted(rel_ for rel_, e_ in index_.entries.items() if e_.kind in 'fl' and rel_ not in SKIP_FILES)
+    rel2source = rel2source or {}
+
+    def describe(rel_):
+        e_ = index_.entries[rel_]
+        if e_.kind == 'l':
+            return ['link:' + e_.target, 0o777, 0]
+        path_ = os.path.join(index_.root, rel_)
+        return [file_sha256(path_), stat.S_IMODE(os.lstat(path_).st_mode), e_.size]
+
+    rows_ = map_ordered(describe, rels_, jobs)
+    return {rel_: row_ + [rel2source.get(rel_)] for rel_, row_ in zip(rels_, rows_)}
+
+
+def save_manifest(path, version, files):
+    mkdir_p(os.path.dirname(path) or '.')
+    tmp_ = path + '.tmp'
+    with gzip.open(tmp_, 'wt', encoding='utf-8') as lf:
+        json.dump({'version': version, 'files': files}, lf)
+    os.replace(tmp_, path)
+
+
+def load_manifest(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as lf:
+        return json.load(lf)
+
+
+def previous_manifest(changelog_dir):
+    '''
+    Path to manifest of the last release, None if there were no releases with manifests.
+    '''
+    if not os.path.isdir(changelog_dir):
+        return None
+    paths_ = [os.path.join(changelog_dir, f_) for f_ in os.listdir(changelog_dir) if f_.endswith(MANIFEST_SUFFIX)]
+    paths_ = [p_ for p_ in paths_ if os.path.isfile(p_) and not os.path.islink(p_)]
+    if not paths_:
+        return None
+    return max(paths_, key=os.path.getmtime)
+
+
+def diff_manifests(old, new):
+    '''
+    (added, changed, removed) relative paths; file is changed if content, link target or mode differ.
+    '''
+    added_ = sorted(rel_ for rel_ in new if rel_ not in old)
+    removed_ = sorted(rel_ for rel_ in old if rel_ not in new)
+    changed_ = sorted(rel_ for rel_, row_ in new.items() if rel_ in old and old[rel_][:2] != row_[:2])
+    return added_, changed_, removed_
+
+
+class DeltaPackage:
+    '''
+    Staging dir of delta between two release manifests: «payload» with added and changed files
+    (hardlinks to «out»), «removed.txt», «replaced.txt», «SHA256SUMS» of payload, «ta-delta.json»
+    and script, that checks installed release and applies delta to it.
+    '''
+
+    def __init__(self, root, old, new):
+        self.root = os.path.abspath(root)
+        self.old = old
+        self.new = new
+        self.added, self.changed, self.removed = diff_manifests(old['files'], new['files'])
+
+    def payload_size(self):
+        files_ = self.new['files']
+        return sum(files_[rel_][2] for rel_ in self.added + self.changed)
+
+    def by_source(self):
+        '''
+        source → number of added/changed/removed files, for report.
+        '''
+        res_ = {}
+        for kind_, rels_, files_ in [('added', self.added, self.new['files']),
+                                     ('changed', self.changed, self.new['files']),
+                                     ('removed', self.removed, self.old['files'])]:
+            for rel_ in rels_:
+                r_ = res_.setdefault(files_[rel_][3] or '?', {})
+                r_[kind_] = r_.get(kind_, 0) + 1
+        return res_
+
+    def summary(self):
+        return {
+            'from': self.old['version'],
+            'to': self.new['version'],
+            'added': len(self.added),
+            'changed': len(self.changed),
+            'removed': len(self.removed),
+            'payload_mb': round(self.payload_size()/1024/1024, 1),
+        }
+
+    def stage(self, delta_dir, install_dir):
+        if os.path.lexists(delta_dir):
+            shutil.rmtree(delta_dir)
+        payload_ = os.path.join(delta_dir, 'payload')
+        mkdir_p(payload_)
+        files_ = self.new['files']
+        sums_ = []
+        for rel_ in self.added + self.changed:
+            src_ = os.path.join(self.root, rel_)
+            dst_ = os.path.join(payload_, rel_)
+            mkdir_p(os.path.dirname(dst_))
+            digest_ = files_[rel_][0]
+            if digest_.startswith('link:'):
+                os.symlink(digest_[len('link:'):], dst_)
+                continue
+            try:
+                os.link(src_, dst_)
+            except OSError as ex_:
+                if ex_.errno not in [errno.EXDEV, errno.EPERM, errno.EMLINK]:
+                    raise
+                shutil.copy2(src_, dst_)
+            sums_.append(f'{digest_}  {rel_}\n')
+
+        with open(os.path.join(delta_dir, 'SHA256SUMS'), 'w', encoding='utf-8') as lf:
+            lf.writelines(sums_)
+        with open(os.path.join(delta_dir, 'removed.txt'), 'w', encoding='utf-8') as lf:
+            lf.writelines(f'{rel_}\n' for rel_ in self.removed)
+        with open(os.path.join(delta_dir, 'replaced.txt'), 'w', encoding='utf-8') as lf:
+            lf.writelines(f'{rel_}\n' for rel_ in self.added + self.changed)
+        with open(os.path.join(delta_dir, DELTA_INFO), 'w', encoding='utf-8') as lf:
+            json.dump(dict(self.summary(), files={rel_: files_[rel_][:2] for rel_ in self.added + self.changed},
+                           removed=self.removed), lf, indent=1)
+
+        script_ = os.path.join(delta_dir, DELTA_SCRIPT)
+        with open(script_, 'w', encoding='utf-8') as lf:
+            lf.write(f'''#!/bin/bash
+# Update of {install_dir} from release {self.old['version']} to {self.new['version']}
+set -e
+TARGET="${{1:-{install_dir}}}"
+DELTA_DIR="$(cd "$(dirname "$0")" && pwd)"
+cd "$DELTA_DIR"
+
+installed_="$(cat "$TARGET/{RELEASE_FILE}" 2>/dev/null || true)"
+if [ "$installed_" = "{self.new['version']}" ]; then
+    echo "Release {self.new['version']} is already installed in $TARGET"
+    exit 0
+fi
+if [ "$installed_" != "{self.old['version']}" ]; then
+    echo "This update is for release {self.old['version']}, but in $TARGET is «$installed_», use full installer" >&2
+    exit 1
+fi
+
+if [ -s SHA256SUMS ]; then
+    (cd payload && sha256sum --quiet --strict -c "$DELTA_DIR/SHA256SUMS")
+fi
+while IFS= read -r f_; do
+    rm -f "$TARGET/$f_"
+    rmdir -p --ignore-fail-on-non-empty "$(dirname "$TARGET/$f_")" 2>/dev/null || true
+done < removed.txt
+# old files are unlinked, not overwritten: cp would write through symlink of old release
+# into file it points to, and writing over running binary fails with «Text file busy»
+while IFS= read -r f_; do
+    rm -f "$TARGET/$f_"
+done < replaced.txt
+cp -a payload/. "$TARGET/"
+if [ -s SHA256SUMS ]; then
+    (cd "$TARGET" && sha256sum --quiet --strict -c "$DELTA_DIR/SHA256SUMS")
+fi
+echo "{self.new['version']}" > "$TARGET/{RELEASE_FILE}"
+echo "$TARGET updated: {self.old['version']} → {self.new['version']}"
+if [ -x "$TARGET/install-me" ]; then
+    "$TARGET/install-me"
+fi
+''')
+        os.chmod(script_, 0o755)
+        return delta_dir
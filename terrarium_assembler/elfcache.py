@@ -0,0 +1,119 @@
+"""
+    Content-addressed cache of patched ELF files for TA.
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from tempfile import mkstemp
+
+from .utils import file_digest, mkdir_p
+
+
+class PatchedElfCache:
+    '''
+    Persistent store of patched ELF files.
+
+    Key is (hash of source file, rpath, patcher identity),
+    so unchanged libraries are patched only once between builds.
+    Size is bounded, least recently used entries are evicted on save.
+    '''
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self.index_path = os.path.join(path, 'index.json')
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.index = {}
+        mkdir_p(path)
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, 'r', encoding='utf-8') as lf:
+                    self.index = json.load(lf)
+            except Exception as ex_:
+                print(f"Broken index of patched ELF cache, starting from scratch: {ex_}")
+                self.index = {}
+
+    def key(self, source, rpath, patcher_id):
+        key_str = '\0'.join([file_digest(source), rpath or '', patcher_id or ''])
+        return hashlib.sha256(key_str.encode('utf-8')).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def get(self, key, dst):
+        '''
+        Put cached file to «dst». Returns False on miss.
+        '''
+        path_ = self.entry_path(key)
+        with self.lock:
+            if key not in self.index or not os.path.exists(path_):
+                self.index.pop(key, None)
+                self.misses += 1
+                return False
+            self.index[key]['used'] = time.time()
+            self.hits += 1
+        if os.path.exists(dst):
+            os.unlink(dst)
+        try:
+            os.link(path_, dst)
+        except OSError:
+            shutil.copy2(path_, dst)
+        return True
+
+    def put(self, key, src):
+        path_ = self.entry_path(key)
+        dir_ = os.path.dirname(path_)
+        mkdir_p(dir_)
+        fd_, tmp_ = mkstemp(dir=dir_)
+        os.close(fd_)
+        shutil.copy2(src, tmp_)
+        os.replace(tmp_, path_)
+        with self.lock:
+            self.index[key] = {'size': os.path.getsize(path_), 'used': time.time()}
+
+    def size(self):
+        return sum(e_['size'] for e_ in self.index.values())
+
+    def evict(self):
+        '''
+        Drop least recently used entries until cache fits max_size.
+        '''
+        evicted_ = 0
+        total_ = self.size()
+        for key_, e_ in sorted(self.index.items(), key=lambda it_: it_[1]['used']):
+            if total_ <= self.max_size:
+                break
+            try:
+                os.unlink(self.entry_path(key_))
+            except FileNotFoundError:
+                pass
+            total_ -= e_['size']
+            del self.index[key_]
+            evicted_ += 1
+        return evicted_
+
+    def save(self, report_path=None):
+        with self.lock:
+            evicted_ = self.evict()
+            tmp_ = self.index_path + '.tmp'
+            with open(tmp_, 'w', encoding='utf-8') as lf:
+                json.dump(self.index, lf)
+            os.replace(tmp_, self.index_path)
+
+        report_ = f'''Patched ELF cache {self.path}
+hits: {self.hits}
+misses: {self.misses}
+evicted: {evicted_}
+entries: {len(self.index)}
+size: {self.size()/1024/1024:.1f} Mb (max {self.max_size/1024/1024:.1f} Mb)
+'''
+        print(report_)
+        if report_path:
+            with open(report_path, 'w', encoding='utf-8') as lf:
+                lf.write(report_)
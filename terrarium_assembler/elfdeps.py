@@ -0,0 +1,241 @@
+"""
+    ELF dependencies (DT_NEEDED/RUNPATH) for TA minimization,
+    parsed in pure Python over mmap, without ldd.
+"""
+
+import os
+import mmap
+import json
+import struct
+import hashlib
+import posixpath
+
+PT_LOAD = 1
+PT_DYNAMIC = 2
+PT_INTERP = 3
+DT_NULL = 0
+DT_NEEDED = 1
+DT_STRTAB = 5
+DT_SONAME = 14
+DT_RPATH = 15
+DT_RUNPATH = 29
+
+
+def elf_dynamic(path):
+    '''
+    {'needed': [...], 'runpath': ..., 'rpath': ..., 'soname': ..., 'interp': ...} of ELF file,
+    None if it is not ELF (or is broken).
+    '''
+    with open(path, 'rb') as lf:
+        if os.fstat(lf.fileno()).st_size < 64 or lf.read(4) != b'\x7fELF':
+            return None
+        with mmap.mmap(lf.fileno(), 0, access=mmap.ACCESS_READ) as mm_:
+            try:
+                return parse_elf(mm_)
+            except (struct.error, ValueError, IndexError):
+                return None
+
+
+def parse_elf(mm):
+    class_, data_ = mm[4], mm[5]
+    if class_ not in (1, 2) or data_ not in (1, 2):
+        return None
+    end_ = '<' if data_ == 1 else '>'
+    if class_ == 2:
+        e_phoff, = struct.unpack_from(end_ + 'Q', mm, 32)
+        e_phentsize, e_phnum = struct.unpack_from(end_ + 'HH', mm, 54)
+        ph_ = struct.Struct(end_ + 'IIQQQQQQ')
+        dyn_ = struct.Struct(end_ + 'qQ')
+    else:
+        e_phoff, = struct.unpack_from(end_ + 'I', mm, 28)
+        e_phentsize, e_phnum = struct.unpack_from(end_ + 'HH', mm, 42)
+        ph_ = struct.Struct(end_ + 'IIIIIIII')
+        dyn_ = struct.Struct(end_ + 'iI')
+
+    loads_ = []
+    dynamic_ = None
+    interp_ = None
+    for i_ in range(e_phnum):
+        fields_ = ph_.unpack_from(mm, e_phoff + i_ * e_phentsize)
+        if class_ == 2:
+            p_type, _, p_offset, p_vaddr, _, p_filesz, _, _ = fields_
+        else:
+            p_type, p_offset, p_vaddr, _, p_filesz, _, _, _ = fields_
+        if p_type == PT_LOAD:
+            loads_.append((p_vaddr, p_offset, p_filesz))
+        elif p_type == PT_DYNAMIC:
+            dynamic_ = (p_offset, p_filesz)
+        elif p_type == PT_INTERP:
+            interp_ = mm[p_offset:p_offset + p_filesz].rstrip(b'\0').decode('utf-8', errors='surrogateescape')
+
+    res_ = {'needed': [], 'runpath': None, 'rpath': None, 'soname': None, 'interp': interp_}
+    if not dynamic_:
+        return res_
+
+    entries_ = []
+    strtab_ = None
+    off_, size_ = dynamic_
+    for pos_ in range(off_, off_ + size_ - dyn_.size + 1, dyn_.size):
+        tag_, val_ = dyn_.unpack_from(mm, pos_)
+        if tag_ == DT_NULL:
+            break
+        if tag_ == DT_STRTAB:
+            strtab_ = val_
+        entries_.append((tag_, val_))
+    if strtab_ is None:
+        return res_
+
+    stroff_ = None
+    for vaddr_, offset_, filesz_ in loads_:
+        if vaddr_ <= strtab_ < vaddr_ + filesz_:
+            stroff_ = strtab_ - vaddr_ + offset_
+            break
+    if stroff_ is None:
+        return res_
+
+    def string(val):
+        start_ = stroff_ + val
+        return mm[start_:mm.find(b'\0', start_)].decode('utf-8', errors='surrogateescape')
+
+    for tag_, val_ in entries_:
+        if tag_ == DT_NEEDED:
+            res_['needed'].append(string(val_))
+        elif tag_ == DT_RUNPATH:
+            res_['runpath'] = string(val_)
+        elif tag_ == DT_RPATH:
+            res_['rpath'] = string(val_)
+        elif tag_ == DT_SONAME:
+            res_['soname'] = string(val_)
+    return res_
+
+
+class ElfDeps:
+    '''
+    Dynamic sections of ELF files, cached by content hash
+    (and content hash by size/mtime/inode), so repeated runs do not parse anything.
+    '''
+
+    def __init__(self, cache_path=None):
+        self.cache_path = cache_path
+        self.stat_index = {}
+        self.deps = {}
+        self.used = set()
+        self.parsed = 0
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'r', encoding='utf-8') as lf:
+                    data_ = json.load(lf)
+                self.stat_index = data_.get('stat', {})
+                self.deps = data_.get('deps', {})
+            except Exception as ex_:
+                print(f"Broken ELF dependencies cache {cache_path}, ignoring it: {ex_}")
+
+    def digest(self, path):
+        st_ = os.stat(path)
+        key_ = [st_.st_size, st_.st_mtime_ns, st_.st_ino]
+        old_ = self.stat_index.get(path)
+        if old_ and old_[:3] == key_:
+            return old_[3]
+        h_ = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as lf:
+            for chunk_ in iter(lambda: lf.read(1024*1024), b''):
+                h_.update(chunk_)
+        self.stat_index[path] = key_ + [h_.hexdigest()]
+        return h_.hexdigest()
+
+    def get(self, path):
+        with open(path, 'rb') as lf:
+            if lf.read(4) != b'\x7fELF':
+                return None
+        digest_ = self.digest(path)
+        self.used.add(path)
+        if digest_ not in self.deps:
+            self.deps[digest_] = elf_dynamic(path)
+            self.parsed += 1
+        return self.deps[digest_]
+
+    def save(self):
+        if not self.cache_path:
+            return
+        tmp_ = self.cache_path + '.tmp'
+        with open(tmp_, 'w', encoding='utf-8') as lf:
+            stat_ = {p_: v_ for p_, v_ in self.stat_index.items() if p_ in self.used}
+            digests_ = set(v_[3] for v_ in stat_.values())
+            json.dump({'stat': stat_, 'deps': {d_: v_ for d_, v_ in self.deps.items() if d_ in digests_}}, lf)
+        os.replace(tmp_, self.cache_path)
+
+
+def elf_closure(index, seeds, deps, search_dirs=('lib64', 'pbin'), aliases=()):
+    '''
+    Transitive closure of DT_NEEDED over tree index (minimize.TreeIndex),
+    starting from seeds (relative paths). Libraries are searched in RUNPATH/RPATH
+    ($ORIGIN is location of binary in tree) and then in search_dirs of tree.
+    Absolute paths under aliases (install dir) are mapped to tree.
+    Returns set of resolved relative paths of ELF files.
+    '''
+    prefixes_ = [index.root] + [a_.rstrip('/') for a_ in aliases]
+
+    def to_tree(path):
+        if not path.startswith('/'):
+            return path
+        for p_ in prefixes_:
+            if path == p_ or path.startswith(p_ + '/'):
+                return path[len(p_):].lstrip('/')
+        return None
+
+    def resolved(rel):
+        res_ = index.resolve(rel)
+        if res_ and res_[0] == 'in' and res_[1]:
+            e_ = index.entries.get(res_[1])
+            if e_ and e_.kind == 'f':
+                return res_[1]
+        return None
+
+    closure_ = set()
+    todo_ = []
+    for s_ in seeds:
+        r_ = resolved(s_)
+        if r_ and r_ not in closure_:
+            closure_.add(r_)
+            todo_.append(r_)
+
+    while todo_:
+        rel_ = todo_.pop()
+        dyn_ = deps.get(os.path.join(index.root, rel_))
+        if not dyn_:
+            continue
+        origin_ = posixpath.dirname(rel_)
+        dirs_ = []
+        for rp_ in (dyn_['runpath'] or dyn_['rpath'] or '').split(':'):
+            if not rp_:
+                continue
+            rp_ = rp_.replace('${ORIGIN}', '$ORIGIN')
+            if rp_.startswith('$ORIGIN'):
+                rp_ = posixpath.normpath(posixpath.join(origin_, rp_[len('$ORIGIN'):].lstrip('/')))
+            else:
+                rp_ = to_tree(rp_)
+            if rp_ is not None and not rp_.startswith('..'):
+                dirs_.append(rp_)
+        dirs_ += list(search_dirs)
+
+        found_ = []
+        for name_ in dyn_['needed']:
+            if '/' in name_:
+                cands_ = [to_tree(name_)]
+            else:
+                cands_ = [posixpath.join(d_, name_) if d_ not in ['', '.'] else name_ for d_ in dirs_]
+            for c_ in cands_:
+                r_ = resolved(c_) if c_ else None
+                if r_:
+                    found_.append(r_)
+                    break
+        if dyn_['interp']:
+            r_ = to_tree(dyn_['interp'])
+            r_ = resolved(r_) if r_ else None
+            if r_:
+                found_.append(r_)
+        for r_ in found_:
+            if r_ not in closure_:
+                closure_.add(r_)
+                todo_.append(r_)
+    return closure_
@@ -0,0 +1,198 @@
+"""
+    Low overhead collection of files, opened by tests, with fanotify (instead of strace).
+    Needs CAP_SYS_ADMIN, so run it by sudo; command is run with privileges of the sudo user.
+
+    sudo -E python -m terrarium_assembler.fanotrace --root out [--alias /opt/product=out] --output used.yaml -- <command> ...
+"""
+
+import os
+import sys
+import pwd
+import time
+import errno
+import ctypes
+import select
+import signal
+import struct
+import argparse
+import subprocess
+
+import yaml
+
+FAN_CLOEXEC = 0x01
+FAN_NONBLOCK = 0x02
+FAN_CLASS_NOTIF = 0x00
+FAN_UNLIMITED_QUEUE = 0x10
+FAN_MARK_ADD = 0x01
+FAN_MARK_MOUNT = 0x10
+FAN_MARK_FILESYSTEM = 0x100
+FAN_OPEN = 0x20
+FAN_ONDIR = 0x40000000
+FAN_Q_OVERFLOW = 0x4000
+FAN_NOFD = -1
+AT_FDCWD = -100
+
+# struct fanotify_event_metadata: event_len, vers, reserved, metadata_len, mask, fd, pid
+EVENT = struct.Struct('=IBBHQii')
+
+
+class FanotifyTracer:
+    '''
+    Set of opened files under roots, as paths relative to their root.
+
+    Whole filesystems of roots are marked (so opens through bind mounts of containers are seen too),
+    paths are filtered by prefixes. Alias is other path of root (f.e. install dir in test box).
+    '''
+
+    def __init__(self, roots, aliases=None):
+        self.roots = [os.path.abspath(r_) for r_ in roots]
+        # alias has the same layout as its root, so paths are relative to any of them
+        self.prefixes = self.roots + [os.path.abspath(a_) for a_ in (aliases or {})]
+        self.used = set()
+        self.overflow = False
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.libc.fanotify_init.argtypes = [ctypes.c_uint, ctypes.c_uint]
+        self.libc.fanotify_mark.argtypes = [ctypes.c_int, ctypes.c_uint, ctypes.c_uint64, ctypes.c_int, ctypes.c_char_p]
+        self.fd = -1
+
+    def start(self):
+        flags_ = FAN_CLOEXEC | FAN_NONBLOCK | FAN_CLASS_NOTIF | FAN_UNLIMITED_QUEUE
+        self.fd = self.libc.fanotify_init(flags_, os.O_RDONLY | os.O_LARGEFILE | os.O_CLOEXEC)
+        if self.fd < 0:
+            err_ = ctypes.get_errno()
+            raise OSError(err_, f'fanotify_init: {os.strerror(err_)} (root privileges are needed)')
+        for root_ in self.roots:
+            broot_ = os.fsencode(root_)
+            marked_ = False
+            for mark_ in [FAN_MARK_FILESYSTEM, FAN_MARK_MOUNT]:
+                if self.libc.fanotify_mark(self.fd, FAN_MARK_ADD | mark_, FAN_OPEN | FAN_ONDIR, AT_FDCWD, broot_) == 0:
+                    marked_ = True
+                    break
+            if not marked_:
+                err_ = ctypes.get_errno()
+                raise OSError(err_, f'fanotify_mark {root_}: {os.strerror(err_)}')
+
+    def relpath(self, path):
+        for prefix_ in self.prefixes:
+            if path.startswith(prefix_ + os.path.sep):
+                return os.path.relpath(path, prefix_)
+        return None
+
+    def drain(self):
+        '''
+        Read all pending events.
+        '''
+        while True:
+            try:
+                buf_ = os.read(self.fd, 256*1024)
+            except BlockingIOError:
+                return
+            except OSError as ex_:
+                if ex_.errno == errno.EINTR:
+                    continue
+                raise
+            if not buf_:
+                return
+            pos_ = 0
+            while pos_ + EVENT.size <= len(buf_):
+                event_len, _, _, _, mask_, fd_, pid_ = EVENT.unpack_from(buf_, pos_)
+                pos_ += event_len
+                if mask_ & FAN_Q_OVERFLOW:
+                    self.overflow = True
+                if fd_ == FAN_NOFD or fd_ < 0:
+                    continue
+                try:
+                    path_ = os.readlink(f'/proc/self/fd/{fd_}')
+                except OSError:
+                    path_ = None
+                os.close(fd_)
+                if path_ and pid_ != os.getpid():
+                    rel_ = self.relpath(path_)
+                    if rel_:
+                        self.used.add(rel_)
+
+    def wait(self, proc=None, stop=None):
+        '''
+        Collect events until command finishes (or stop() is true).
+        '''
+        while True:
+            r_, _, _ = select.select([self.fd], [], [], 0.2)
+            if r_:
+                self.drain()
+            if proc is not None and proc.poll() is not None:
+                break
+            if stop is not None and stop():
+                break
+        self.drain()
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def sudo_user_kwargs():
+    '''
+    Run command as user, who called sudo.
+    '''
+    if os.geteuid() != 0 or 'SUDO_UID' not in os.environ:
+        return {}
+    uid_ = int(os.environ['SUDO_UID'])
+    gid_ = int(os.environ.get('SUDO_GID', uid_))
+    name_ = pwd.getpwuid(uid_).pw_name
+    return {'user': uid_, 'group': gid_, 'extra_groups': os.getgrouplist(name_, gid_)}
+
+
+def save_used_files(path, used, append=False):
+    '''
+    Write sorted list of relative paths (the format of tmp/used-files.yaml).
+    '''
+    used_ = set(used)
+    if append and os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as lf:
+            used_.update(yaml.safe_load(lf) or [])
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as lf:
+        lf.write(yaml.dump(sorted(used_)))
+    kw_ = sudo_user_kwargs()
+    if kw_:
+        os.chown(path, kw_['user'], kw_['group'])
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Collect files opened under roots while command runs')
+    ap.add_argument('--root', type=str, action='append', required=True, help='Folder to watch (paths are relative to it)')
+    ap.add_argument('--alias', type=str, action='append', default=[], help='OTHER=ROOT, other path of the same files')
+    ap.add_argument('--output', type=str, required=True, help='YAML list of used files')
+    ap.add_argument('--append', default=False, action='store_true', help='Merge with existing output')
+    ap.add_argument('command', type=str, nargs=argparse.REMAINDER)
+    args = ap.parse_args()
+
+    command_ = args.command[1:] if args.command and args.command[0] == '--' else args.command
+    aliases_ = dict(a_.split('=', 1) for a_ in args.alias)
+    tracer_ = FanotifyTracer(args.root, aliases_)
+    tracer_.start()
+
+    start_ = time.time()
+    rc_ = 0
+    try:
+        if command_:
+            proc_ = subprocess.Popen(command_, **sudo_user_kwargs())
+            tracer_.wait(proc=proc_)
+            rc_ = proc_.returncode
+        else:
+            stopped_ = []
+            for sig_ in [signal.SIGINT, signal.SIGTERM]:
+                signal.signal(sig_, lambda *_: stopped_.append(True))
+            tracer_.wait(stop=lambda: stopped_)
+    finally:
+        tracer_.close()
+    save_used_files(args.output, tracer_.used, args.append)
+    print(f'{len(tracer_.used)} used files in {time.time()-start_:.1f}s → {args.output}', file=sys.stderr)
+    if tracer_.overflow:
+        print('fanotify queue overflow, some files could be missed', file=sys.stderr)
+    sys.exit(rc_)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""
+    File type service for TA: cheap ELF/extension classification,
+    libmagic only for ambiguous files, persistent cache.
+"""
+
+import os
+import stat
+import json
+import struct
+import threading
+
+# Extensions that are never ELF, when we only want to know ELF or not.
+NOT_ELF_EXTENSIONS = set('''
+.py .pyc .pyi .pxd .pyx .txt .md .rst .html .htm .css .js .json .xml .yml .yaml .toml .ini .cfg .conf
+.h .hpp .c .cc .cpp .f90 .pc .cmake .la .a .mo .po .pot .png .jpg .jpeg .gif .svg .ico .bmp .tif .tiff
+.ttf .otf .pfb .afm .gz .bz2 .xz .zst .zip .tar .whl .egg .pdf .ps .dat .csv .tcl .sh .pl .pm .rb .qm .qml
+.desktop .policy .service .rules .typelib .gir .mime .cache .hwdb
+'''.split())
+
+ELF_TYPES = {
+    1: 'relocatable',
+    2: 'executable',
+    4: 'core file',
+}
+
+PT_INTERP = 3
+
+
+def elf_description(path, size):
+    '''
+    libmagic-like prefix of description for ELF by its header.
+    Returns None if it is not ELF, '' if it is ambiguous (pie executable or shared object).
+    '''
+    with open(path, 'rb') as lf:
+        head_ = lf.read(64)
+        if len(head_) < 52 or head_[:4] != b'\x7fELF':
+            return None
+        class_, data_ = head_[4], head_[5]
+        if class_ not in (1, 2) or data_ not in (1, 2):
+            return None
+        end_ = '<' if data_ == 1 else '>'
+        bits_ = 32 if class_ == 1 else 64
+        prefix_ = f"ELF {bits_}-bit {'LSB' if data_ == 1 else 'MSB'}"
+        e_type = struct.unpack(end_ + 'H', head_[16:18])[0]
+        if e_type in ELF_TYPES:
+            return f'{prefix_} {ELF_TYPES[e_type]}'
+        if e_type != 3:
+            return ''
+        # ET_DYN without interpreter is shared object for sure.
+        if class_ == 2:
+            e_phoff, = struct.unpack(end_ + 'Q', head_[32:40])
+            e_phentsize, e_phnum = struct.unpack(end_ + 'HH', head_[54:58])
+        else:
+            e_phoff, = struct.unpack(end_ + 'I', head_[28:32])
+            e_phentsize, e_phnum = struct.unpack(end_ + 'HH', head_[42:46])
+        if not e_phnum or e_phoff + e_phentsize * e_phnum > size:
+            return ''
+        lf.seek(e_phoff)
+        phs_ = lf.read(e_phentsize * e_phnum)
+        for i_ in range(e_phnum):
+            p_type, = struct.unpack(end_ + 'I', phs_[i_*e_phentsize:i_*e_phentsize+4])
+            if p_type == PT_INTERP:
+                return ''
+        return f'{prefix_} shared object'
+
+
+class FileTypes:
+    '''
+    File types (libmagic-like descriptions, contract of «fucking_magic»).
+
+    ELF files are classified by header, libmagic is used only for ambiguous ones
+    (one magic.Magic handle per worker thread). Results are cached by (inode, size, mtime)
+    and persisted between runs.
+    '''
+
+    def __init__(self, cache_path=None, max_entries=1000000):
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.cache = None
+        self.used = set()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.libmagic_calls = 0
+
+    def load(self):
+        with self.lock:
+            if self.cache is not None:
+                return
+            cache_ = {}
+            if self.cache_path and os.path.exists(self.cache_path):
+                try:
+                    with open(self.cache_path, 'r', encoding='utf-8') as lf:
+                        cache_ = json.load(lf)
+                except Exception as ex_:
+                    print(f"Broken file type cache {self.cache_path}, ignoring it: {ex_}")
+            self.cache = cache_
+
+    def magic_handle(self):
+        m_ = getattr(self.local, 'magic', None)
+        if m_ is None:
+            import magic
+            m_ = self.local.magic = magic.Magic()
+        return m_
+
+    def describe(self, path, elf_only=False):
+        '''
+        Description of file type, '' for missing or not regular files.
+        With elf_only all non-ELF regular files are just 'data',
+        when caller wants to know only ELF or not (and symlinks).
+        '''
+        if not os.path.isfile(path):
+            return ''
+        st_ = os.lstat(path)
+        if stat.S_ISLNK(st_.st_mode):
+            return 'symbolic link to ' + os.readlink(path)
+        if st_.st_size == 0:
+            return 'empty'
+        if elf_only and os.path.splitext(path)[1].lower() in NOT_ELF_EXTENSIONS:
+            return 'data'
+
+        if self.cache is None:
+            self.load()
+        key_ = f'{st_.st_ino}:{st_.st_size}:{st_.st_mtime_ns}'
+        m_ = self.cache.get(key_)
+        if m_ is not None:
+            self.used.add(key_)
+            return m_
+
+        m_ = elf_description(path, st_.st_size)
+        if m_ is None and elf_only:
+            return 'data'
+        if not m_:
+            m_ = self.magic_handle().from_file(path)
+            self.libmagic_calls += 1
+        with self.lock:
+            self.cache[key_] = m_
+            self.used.add(key_)
+        return m_
+
+    def save(self):
+        if not self.cache_path or self.cache is None:
+            return
+        with self.lock:
+            cache_ = self.cache
+            if len(cache_) > self.max_entries:
+                cache_ = {k_: v_ for k_, v_ in cache_.items() if k_ in self.used}
+            tmp_ = self.cache_path + '.tmp'
+            with open(tmp_, 'w', encoding='utf-8') as lf:
+                json.dump(cache_, lf)
+            os.replace(tmp_, self.cache_path)
+        print(f"File types: {len(self.used)} files, {self.libmagic_calls} libmagic calls")
@@ -0,0 +1,193 @@
+"""
+    Fast folder fingerprints for TA (instead of «md5deep -r | sort | md5sum»).
+
+    python -m terrarium_assembler.folderhash [--stat] [--index-dir DIR] [--jobs N] [--exclude NAME] <folder>
+"""
+
+import os
+import sys
+import json
+import time
+import stat
+import hashlib
+import argparse
+import threading
+import concurrent.futures
+
+DIGEST_SIZE = 16
+BUFSIZE = 1024*1024
+# Files changed so recently can be changed again within the same mtime tick, do not trust their stat.
+RACY_NS = 2 * 10**9
+
+
+def content_digest(path):
+    h_ = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    with open(path, 'rb') as lf:
+        while True:
+            buf_ = lf.read(BUFSIZE)
+            if not buf_:
+                break
+            h_.update(buf_)
+    return h_.hexdigest()
+
+
+def walk_files(folder, exclude=()):
+    '''
+    (relative path, DirEntry) for all files and symlinks in folder, by os.scandir.
+    Subfolders with names from «exclude» are skipped.
+    '''
+    stack_ = [folder]
+    while stack_:
+        dir_ = stack_.pop()
+        try:
+            entries_ = list(os.scandir(dir_))
+        except OSError:
+            continue
+        for e_ in entries_:
+            if e_.is_dir(follow_symlinks=False):
+                if e_.name not in exclude:
+                    stack_.append(e_.path)
+            else:
+                yield os.path.relpath(e_.path, folder), e_
+
+
+class FolderHasher:
+    '''
+    Digest of folder content: sorted (relative path, file digest) pairs.
+
+    Files are hashed by pool of threads (hashlib releases GIL on big buffers).
+    In stat mode digests are reused from persisted index
+    (path, size, mtime_ns, inode) → digest, so unchanged files are never read.
+    '''
+
+    def __init__(self, index_dir=None, jobs=0, use_stat=True, exclude=()):
+        self.index_dir = index_dir
+        self.exclude = set(exclude)
+        self.jobs = jobs or min(8, os.cpu_count() or 1)
+        self.use_stat = use_stat and bool(index_dir)
+        self.lock = threading.Lock()
+        self.hashed = 0
+        self.reused = 0
+
+    def index_path(self, folder):
+        key_ = hashlib.blake2b(os.path.abspath(folder).encode('utf-8', errors='surrogateescape'),
+                               digest_size=8).hexdigest()
+        return os.path.join(self.index_dir, key_ + '.json')
+
+    def load_index(self, folder):
+        path_ = self.index_path(folder)
+        if not os.path.exists(path_):
+            return {}
+        try:
+            with open(path_, 'r', encoding='utf-8') as lf:
+                data_ = json.load(lf)
+            if data_.get('folder') == os.path.abspath(folder):
+                return data_.get('files', {})
+        except Exception:
+            pass
+        return {}
+
+    def save_index(self, folder, files, started_ns):
+        os.makedirs(self.index_dir, exist_ok=True)
+        files_ = {rel_: v_ for rel_, v_ in files.items() if v_[1] < started_ns - RACY_NS}
+        path_ = self.index_path(folder)
+        tmp_ = f'{path_}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_, 'w', encoding='utf-8') as lf:
+            json.dump({'folder': os.path.abspath(folder), 'files': files_}, lf)
+        os.replace(tmp_, path_)
+
+    def file_digests(self, folder):
+        '''
+        relative path → digest for all files of folder.
+        '''
+        started_ns = time.time_ns()
+        index_ = self.load_index(folder) if self.use_stat else {}
+        digests_ = {}
+        new_index_ = {}
+        to_hash_ = []
+        for rel_, e_ in walk_files(folder, self.exclude):
+            st_ = e_.stat(follow_symlinks=False)
+            if stat.S_ISLNK(st_.st_mode):
+                digests_[rel_] = 'link:' + os.readlink(e_.path)
+                continue
+            if not stat.S_ISREG(st_.st_mode):
+                continue
+            key_ = [st_.st_size, st_.st_mtime_ns, st_.st_ino]
+            old_ = index_.get(rel_)
+            if old_ and old_[:3] == key_:
+                digests_[rel_] = old_[3]
+                new_index_[rel_] = old_
+                self.reused += 1
+                continue
+            to_hash_.append((rel_, e_.path, key_))
+
+        def hash_one(item_):
+            rel_, path_, key_ = item_
+            try:
+                return rel_, key_, content_digest(path_)
+            except OSError:
+                return rel_, None, 'unreadable'
+
+        if self.jobs > 1 and len(to_hash_) > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) as pool_:
+                results_ = list(pool_.map(hash_one, to_hash_))
+        else:
+            results_ = [hash_one(it_) for it_ in to_hash_]
+        for rel_, key_, digest_ in results_:
+            digests_[rel_] = digest_
+            if key_:
+                new_index_[rel_] = key_ + [digest_]
+        self.hashed += len(to_hash_)
+
+        if self.use_stat and (to_hash_ or len(new_index_) != len(index_)):
+            self.save_index(folder, new_index_, started_ns)
+        return digests_
+
+    def digest(self, path):
+        '''
+        Digest of folder (or single file). Missing path has digest «missing».
+        '''
+        if not os.path.lexists(path):
+            return 'missing'
+        if not os.path.isdir(path):
+            if os.path.islink(path):
+                return 'link:' + os.readlink(path)
+            return content_digest(path)
+        h_ = hashlib.blake2b(digest_size=DIGEST_SIZE)
+        for rel_, digest_ in sorted(self.file_digests(path).items()):
+            h_.update(rel_.encode('utf-8', errors='surrogateescape'))
+            h_.update(b'\0')
+            h_.update(digest_.encode('utf-8'))
+            h_.update(b'\n')
+        return h_.hexdigest()
+
+
+def folder_digest(path, index_dir=None, jobs=0):
+    '''
+    Digest of folder content, with stat shortcuts if index_dir is given.
+    '''
+    return FolderHasher(index_dir, jobs).digest(path)
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Print fingerprint of folder content')
+    ap.add_argument('--stat', default=False, action='store_true',
+                    help='Reuse digests of files with the same size/mtime/inode from index')
+    ap.add_argument('--index-dir', type=str, default='tmp/folderhash', help='Folder for stat indexes')
+    ap.add_argument('--jobs', type=int, default=0, help='Number of hashing threads (0 — auto)')
+    ap.add_argument('--exclude', type=str, action='append', default=[],
+                    help='Skip subfolders with this name (f.e. __pycache__), can be repeated')
+    ap.add_argument('--verbose', default=False, action='store_true')
+    ap.add_argument('folder', type=str)
+    args = ap.parse_args()
+
+    start_ = time.time()
+    fh_ = FolderHasher(args.index_dir, args.jobs, use_stat=args.stat, exclude=args.exclude)
+    print(fh_.digest(args.folder))
+    if args.verbose:
+        print(f"{args.folder}: hashed {fh_.hashed}, reused {fh_.reused} in {time.time()-start_:.2f}s",
+              file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
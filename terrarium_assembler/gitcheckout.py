@@ -0,0 +1,183 @@
+"""
+    Checkout engine for TA: projects are cloned concurrently from local mirrors
+    (bare repositories in «in/bin»), so repeated checkouts are fetches, not fresh clones.
+    Also pool for commands in all project folders (git sync, folder command).
+"""
+
+import os
+import time
+import shutil
+import hashlib
+import subprocess
+import concurrent.futures
+
+from prettytable import PrettyTable
+
+from .utils import mkdir_p, giturl2folder
+
+
+class GitError(Exception):
+    pass
+
+
+def mirror_name(git_url):
+    '''
+    Name of mirror: folder name of project and hash of url (projects from different hosts may have same name).
+    '''
+    return f'{giturl2folder(git_url)}-{hashlib.md5(git_url.encode("utf-8")).hexdigest()[:8]}.git'
+
+
+def uses_lfs(path):
+    attrs_ = os.path.join(path, '.gitattributes')
+    if not os.path.exists(attrs_):
+        return False
+    with open(attrs_, 'r', encoding='utf-8', errors='replace') as lf:
+        return 'filter=lfs' in lf.read()
+
+
+class GitCheckout:
+    '''
+    Clone projects (git_url, git_branch, path) on pool of threads:
+    * update (or create) bare mirror of url in «mirrors_dir»;
+    * local clone from mirror (objects are hardlinked), origin is set back to real url;
+    * LFS objects are pulled by one batched «git lfs pull» (smudge on clone is skipped),
+      LFS storage is shared between checkouts.
+    Local urls (spec «cache») are cloned directly.
+    '''
+
+    def __init__(self, mirrors_dir, jobs=8, logs_dir=None, lfs_transfers=8):
+        self.mirrors_dir = os.path.abspath(mirrors_dir)
+        self.lfs_dir = os.path.join(self.mirrors_dir, 'lfs')
+        self.jobs = max(1, jobs)
+        self.logs_dir = logs_dir
+        self.lfs_transfers = lfs_transfers
+        mkdir_p(self.mirrors_dir)
+
+    def git(self, args, log, cwd=None, env=None):
+        cmd_ = ['git'] + args
+        res_ = subprocess.run(cmd_, cwd=cwd, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        log.append(f"$ {' '.join(cmd_)}\n{res_.stdout.decode('utf-8', errors='replace')}")
+        if res_.returncode != 0:
+            raise GitError(f"«{' '.join(cmd_)}» failed with code {res_.returncode}")
+
+    def mirror(self, git_url, log):
+        '''
+        Path to up to date mirror of url.
+        '''
+        mirror_ = os.path.join(self.mirrors_dir, mirror_name(git_url))
+        if os.path.exists(os.path.join(mirror_, 'HEAD')):
+            self.git(['remote', 'set-url', 'origin', git_url], log, cwd=mirror_)
+            self.git(['remote', 'update', '--prune'], log, cwd=mirror_)
+        else:
+            if os.path.lexists(mirror_):
+                shutil.rmtree(mirror_)
+            self.git(['clone', '--mirror', git_url, mirror_], log)
+        return mirror_
+
+    def checkout(self, git_url, git_branch, path):
+        '''
+        Clone one project into «path» (via «path.new»), returns dict with timings and status.
+        '''
+        log_ = []
+        res_ = {'url': git_url, 'branch': git_branch, 'path': path}
+        start_ = time.time()
+        try:
+            source_ = git_url
+            if not os.path.isdir(git_url):
+                source_ = self.mirror(git_url, log_)
+            res_['fetch'] = round(time.time() - start_, 1)
+
+            t_ = time.time()
+            newpath_ = path + '.new'
+            if os.path.lexists(newpath_):
+                shutil.rmtree(newpath_)
+            env_ = dict(os.environ, GIT_LFS_SKIP_SMUDGE='1')
+            self.git(['--git-dir=/dev/null', 'clone', '--branch', git_branch, source_, newpath_], log_, env=env_)
+            self.git(['remote', 'set-url', 'origin', git_url], log_, cwd=newpath_)
+            self.git(['config', 'core.fileMode', 'false'], log_, cwd=newpath_)
+            self.git(['config', 'core.autocrlf', 'input'], log_, cwd=newpath_)
+            res_['clone'] = round(time.time() - t_, 1)
+
+            t_ = time.time()
+            if uses_lfs(newpath_):
+                lfs_storage_ = os.path.join(self.lfs_dir, mirror_name(git_url))
+                mkdir_p(lfs_storage_)
+                self.git(['lfs', 'install', '--local'], log_, cwd=newpath_)
+                self.git(['config', 'lfs.storage', lfs_storage_], log_, cwd=newpath_)
+                self.git(['config', 'lfs.concurrenttransfers', str(self.lfs_transfers)], log_, cwd=newpath_)
+                self.git(['lfs', 'pull'], log_, cwd=newpath_)
+                res_['lfs'] = round(time.time() - t_, 1)
+
+            if os.path.lexists(path):
+                shutil.rmtree(path)
+            os.rename(newpath_, path)
+            res_['status'] = 'ok'
+        except Exception as ex_:
+            res_['status'] = 'failed'
+            res_['error'] = str(ex_)
+        res_['wall'] = round(time.time() - start_, 1)
+        if self.logs_dir:
+            mkdir_p(self.logs_dir)
+            with open(os.path.join(self.logs_dir, f'checkout-{giturl2folder(git_url)}.log'), 'w', encoding='utf-8') as lf:
+                lf.write('\n'.join(log_))
+        if res_['status'] != 'ok':
+            print(f"Checkout of {git_url} ({git_branch}) failed: {res_['error']}\n" + '\n'.join(log_[-1:]))
+        else:
+            print(f"Checked out {git_url} ({git_branch}) in {res_['wall']}s")
+        return res_
+
+    def run(self, projects):
+        '''
+        Checkout all (git_url, git_branch, path) projects, returns list of results.
+        '''
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) as pool_:
+            return list(pool_.map(lambda p_: self.checkout(*p_), projects))
+
+
+class RepoPool:
+    '''
+    Commands in many repositories on pool of threads, every subprocess gets «cwd»
+    (no os.chdir of TA process). Output is collected per repository and printed grouped,
+    then summary table of status and duration.
+    '''
+
+    def __init__(self, jobs=8):
+        self.jobs = max(1, jobs)
+
+    def sh(self, cmd, cwd, log):
+        '''
+        Run shell command in «cwd», output goes to log, returns (exit code, output).
+        Commands are run concurrently, so git must not ask for passwords.
+        '''
+        env_ = dict(os.environ, GIT_TERMINAL_PROMPT='0')
+        res_ = subprocess.run(cmd, shell=True, cwd=cwd, env=env_, stdin=subprocess.DEVNULL,
+                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        out_ = res_.stdout.decode('utf-8', errors='replace')
+        log.append(f'$ {cmd}\n{out_}'.rstrip())
+        return res_.returncode, out_
+
+    def one(self, func, path):
+        log_ = []
+        start_ = time.time()
+        try:
+            status_ = func(self, path, log_) or 'ok'
+        except Exception as ex_:
+            status_ = f'failed: {ex_}'
+        return {'path': path, 'status': status_, 'wall': round(time.time() - start_, 1), 'output': '\n'.join(log_)}
+
+    def run(self, func, paths, title=''):
+        '''
+        func(pool, path, log) → status («ok» if None) for every path, prints grouped output and summary.
+        '''
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) as pool_:
+            results_ = list(pool_.map(lambda p_: self.one(func, p_), paths))
+        for r_ in results_:
+            print('*'*10 + f" {title} {r_['path']}")
+            if r_['output']:
+                print(r_['output'])
+        table_ = PrettyTable(['Project', 'Status', 'Seconds'])
+        table_.align = 'l'
+        for r_ in results_:
+            table_.add_row([r_['path'], r_['status'], r_['wall']])
+        print(table_)
+        return results_
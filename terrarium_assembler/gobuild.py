@@ -0,0 +1,63 @@
+"""
+    Go build caches for TA: persistent GOCACHE/GOMODCACHE in «in/bin»,
+    build cache is trimmed to size limit (oldest entries first).
+"""
+
+import os
+import sys
+import argparse
+
+
+def dir_files(path):
+    '''
+    (mtime, size, path) of all files under path.
+    '''
+    res_ = []
+    for dir_, _, files_ in os.walk(path):
+        for f_ in files_:
+            p_ = os.path.join(dir_, f_)
+            try:
+                st_ = os.lstat(p_)
+            except OSError:
+                continue
+            res_.append((st_.st_mtime, st_.st_size, p_))
+    return res_
+
+
+def trim_cache(path, max_bytes):
+    '''
+    Remove least recently used files of Go build cache until it fits max_bytes
+    (go updates mtime of used entries, and entries missing in cache are just rebuilt).
+    Returns (size before, size after).
+    '''
+    files_ = dir_files(path)
+    total_ = before_ = sum(size_ for _, size_, _ in files_)
+    if total_ <= max_bytes:
+        return before_, total_
+    for _, size_, p_ in sorted(files_):
+        # README and trim.txt are markers of cache dir itself
+        if os.path.dirname(p_) == path:
+            continue
+        try:
+            os.unlink(p_)
+        except OSError:
+            continue
+        total_ -= size_
+        if total_ <= max_bytes:
+            break
+    return before_, total_
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Trim Go build cache to size limit')
+    ap.add_argument('--max-gb', type=float, required=True, help='Size limit of cache')
+    ap.add_argument('cache', type=str, help='GOCACHE folder')
+    args = ap.parse_args()
+    if not os.path.isdir(args.cache):
+        return
+    before_, after_ = trim_cache(args.cache, int(args.max_gb * 1024**3))
+    print(f"Go cache {args.cache}: {before_/1024**3:.2f} GB → {after_/1024**3:.2f} GB", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+    Minimization engine for TA: one in-memory index of «out» tree
+    (no repeated resolve()/rglob() over the tree).
+"""
+
+import os
+import stat
+import collections
+
+from .utils import map_ordered
+
+TreeEntry = collections.namedtuple('TreeEntry', 'kind ino size target')
+# max symlinks in one chain, as in kernel
+MAX_HOPS = 40
+
+
+class TreeIndex:
+    '''
+    relative path → TreeEntry(kind 'f'/'d'/'l'/'o', inode, size, symlink target),
+    built by one scandir pass, symlinks are not followed.
+    '''
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.entries = {}
+        stack_ = [('', self.root)]
+        while stack_:
+            rel_dir, dir_ = stack_.pop()
+            try:
+                it_ = list(os.scandir(dir_))
+            except OSError:
+                continue
+            for e_ in it_:
+                rel_ = rel_dir + '/' + e_.name if rel_dir else e_.name
+                st_ = e_.stat(follow_symlinks=False)
+                if stat.S_ISLNK(st_.st_mode):
+                    self.entries[rel_] = TreeEntry('l', st_.st_ino, 0, os.readlink(e_.path))
+                elif stat.S_ISDIR(st_.st_mode):
+                    self.entries[rel_] = TreeEntry('d', st_.st_ino, 0, None)
+                    stack_.append((rel_, e_.path))
+                elif stat.S_ISREG(st_.st_mode):
+                    self.entries[rel_] = TreeEntry('f', st_.st_ino, st_.st_size, None)
+                else:
+                    self.entries[rel_] = TreeEntry('o', st_.st_ino, 0, None)
+
+    def resolve(self, rel, missing=frozenset(), chain=None):
+        '''
+        Follow symlinks in all components of path inside the index.
+        Returns ('in', relative path), ('out', absolute path) for paths leaving the tree,
+        or None if path does not exist (entries from «missing» are considered deleted).
+        Symlinks passed on the way are added to «chain».
+        '''
+        todo_ = list(reversed(rel.split('/')))
+        path_ = ''
+        hops_ = 0
+        while todo_:
+            name_ = todo_.pop()
+            if name_ in ['', '.']:
+                continue
+            if name_ == '..':
+                if not path_:
+                    return 'out', os.path.normpath(os.path.join(self.root, '..', *reversed(todo_)))
+                path_ = path_.rpartition('/')[0]
+                continue
+            cand_ = path_ + '/' + name_ if path_ else name_
+            e_ = self.entries.get(cand_)
+            if e_ is None or cand_ in missing:
+                return None
+            if e_.kind == 'l':
+                hops_ += 1
+                if hops_ > MAX_HOPS:
+                    return None
+                if chain is not None:
+                    chain.add(cand_)
+                target_ = e_.target
+                if target_.startswith('/'):
+                    if target_ == self.root or target_.startswith(self.root + '/'):
+                        path_ = ''
+                        target_ = target_[len(self.root):]
+                    else:
+                        return 'out', os.path.normpath(os.path.join(target_, *reversed(todo_)))
+                todo_.extend(reversed(target_.split('/')))
+                continue
+            path_ = cand_
+        return 'in', path_
+
+    def exists(self, rel, missing=frozenset()):
+        res_ = self.resolve(rel, missing)
+        if res_ is None:
+            return False
+        where_, path_ = res_
+        if where_ == 'out':
+            return os.path.exists(path_)
+        return True
+
+
+class Minimizer:
+    '''
+    Plan of removing unused files: used files are resolved through symlink chains on index,
+    files not reachable (and not needed by bin_regexps) are deleted, then symlinks that became broken.
+    '''
+
+    def __init__(self, root, jobs=1):
+        self.index = TreeIndex(root)
+        self.jobs = jobs
+        self.used = set()
+        self.used_links = set()
+        self.removed_relnames = []
+        self.deleted = []
+        self.broken_links = []
+
+    def reach(self, used_files):
+        '''
+        Resolved relative paths of used files (and symlinks on their way).
+        '''
+        for uf_ in used_files:
+            res_ = self.index.resolve(uf_, chain=self.used_links)
+            if res_ and res_[0] == 'in' and res_[1]:
+                self.used.add(res_[1])
+        return self.used
+
+    def plan(self, relnames, is_needed):
+        '''
+        Which relnames of build table are removed and which files are deleted.
+        '''
+        for rel_ in relnames:
+            if is_needed(rel_) or rel_ in self.used:
+                continue
+            self.removed_relnames.append(rel_)
+            e_ = self.index.entries.get(rel_)
+            if e_ and e_.kind != 'l':
+                self.deleted.append(rel_)
+        deleted_ = frozenset(self.deleted)
+        self.broken_links = [rel_ for rel_, e_ in self.index.entries.items()
+                             if e_.kind == 'l' and not self.index.exists(rel_, deleted_)]
+        return self.removed_relnames
+
+    def saved_by_source(self, rel2source):
+        '''
+        Dry-run report: source → [number of files, bytes] that will be deleted, biggest first.
+        '''
+        report_ = {}
+        for rel_ in self.deleted:
+            source_ = rel2source.get(rel_, '?')
+            r_ = report_.setdefault(source_, [0, 0])
+            r_[0] += 1
+            r_[1] += self.index.entries[rel_].size
+        return dict(sorted(report_.items(), key=lambda kv: -kv[1][1]))
+
+    def apply(self, batch=1000):
+        '''
+        Delete planned files and broken links by batches on pool of threads.
+        '''
+        root_ = self.index.root
+
+        def unlink_batch(rels_):
+            for rel_ in rels_:
+                try:
+                    os.unlink(os.path.join(root_, rel_))
+                except FileNotFoundError:
+                    pass
+            return len(rels_)
+
+        paths_ = self.deleted + self.broken_links
+        batches_ = [paths_[i_:i_ + batch] for i_ in range(0, len(paths_), batch)]
+        return sum(map_ordered(unlink_batch, batches_, self.jobs))
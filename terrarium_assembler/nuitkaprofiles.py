@@ -117,6 +117,9 @@ class NuitkaProfile:
     block_packages: list = None # disable packages
     flags: list = ('show-progress', 'show-scons')  # base flags
     inherit: str = ''
+    shared_packages: list = None # packages compiled once as modules and reused by all builds
+    module_flags: list = None # flags for compilation of shared packages
+    multidist: bool = False # build all utilities by one Nuitka compilation with several «--main»
 
     def get_base_flags(self):
         '''
@@ -143,6 +146,44 @@ class NuitkaProfile:
 
         return flags
 
+    def get_shared_packages(self):
+        '''
+        Shared packages as (name, packages to include instead of following them), using inheritance.
+        '''
+        shared = []
+        if self.inherited:
+            shared = self.inherited.get_shared_packages()
+
+        for it_ in self.shared_packages or []:
+            if isinstance(it_, str):
+                shared.append((it_, []))
+            else:
+                shared.append((it_['name'], list(it_.get('include_packages') or [])))
+        return shared
+
+    def get_module_flags(self):
+        '''
+        Flags for compilation of shared packages, using inheritance.
+        '''
+        flags = []
+        if self.inherited:
+            flags = self.inherited.get_module_flags()
+        for it_ in self.module_flags or []:
+            flags.append(f'--{it_}')
+        return flags
+
+    def get_shared_flags(self):
+        '''
+        Flags for standalone builds: shared packages are not followed (their modules are copied to dist),
+        but what they import should be included.
+        '''
+        flags = []
+        for name_, includes_ in self.get_shared_packages():
+            flags.append('--nofollow-import-to=' + name_)
+            for it_ in includes_:
+                flags.append('--include-package=' + it_)
+        return flags
+
 
     def get_flags(self, out_dir, target_):
         '''
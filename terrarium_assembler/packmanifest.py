@@ -0,0 +1,102 @@
+"""
+    Manifest of packed files for incremental packing in TA.
+"""
+
+import os
+import json
+
+from .utils import file_digest
+
+
+def source_digest(path):
+    '''
+    Digest of file content (or of link target for symlinks).
+    '''
+    if os.path.islink(path):
+        return 'link:' + os.readlink(path)
+    return file_digest(path)
+
+
+class PackManifest:
+    '''
+    What was put into out by last packing:
+    relpath → source, source size/mtime/hash and transform applied.
+
+    Entry is unchanged if source, transform and stat are the same,
+    or stat differs but content hash is the same
+    (f.e. Nuitka rebuilt the whole dist, but only one file really changed).
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.old = {}
+        self.new = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as lf:
+                    self.old = json.load(lf)
+            except Exception as ex_:
+                print(f"Broken pack manifest {path}, ignoring it: {ex_}")
+                self.old = {}
+
+    def entry(self, op, transform):
+        '''
+        Manifest entry for planned operation.
+        '''
+        st_ = os.lstat(op.path) if os.path.lexists(op.path) else None
+        return {
+            'source': op.source,
+            'path': op.path,
+            'kind': op.kind,
+            'transform': transform,
+            'size': st_.st_size if st_ else -1,
+            'mtime_ns': st_.st_mtime_ns if st_ else -1,
+            'hash': None,
+        }
+
+    def fill_hash(self, entry):
+        '''
+        Hash of source for entry of applied operation, so next packing
+        can keep the file if source is touched (new mtime), but not changed.
+        '''
+        if entry['hash'] is None and entry['size'] >= 0 and os.path.lexists(entry['path']):
+            entry['hash'] = source_digest(entry['path'])
+        return entry
+
+    def unchanged(self, relname, entry, dst):
+        '''
+        Can we keep «dst» from previous packing? Fills entry hash if it was needed.
+        '''
+        old_ = self.old.get(relname)
+        if not old_ or not os.path.lexists(dst):
+            return False
+        # dedup could replace file by symlink to other copy, that could be changed since
+        if os.path.islink(dst) and not os.path.islink(entry['path']):
+            return False
+        for k_ in ['source', 'path', 'kind', 'transform']:
+            if old_.get(k_) != entry[k_]:
+                return False
+        if old_['size'] == entry['size'] and old_['mtime_ns'] == entry['mtime_ns']:
+            entry['hash'] = old_.get('hash')
+            return True
+        if old_['size'] != entry['size'] or entry['size'] < 0:
+            return False
+        entry['hash'] = source_digest(entry['path'])
+        return old_.get('hash') == entry['hash']
+
+    def record(self, relname, entry):
+        self.new[relname] = self.fill_hash(entry)
+
+    def stale(self):
+        '''
+        Files from previous packing, which are not in current plan.
+        Only files of pack operations are tracked: templates, terra pythons and «lib64/libc.so»
+        are rewritten by every packing and never removed as stale.
+        '''
+        return sorted(set(self.old) - set(self.new))
+
+    def save(self):
+        tmp_ = self.path + '.tmp'
+        with open(tmp_, 'w', encoding='utf-8') as lf:
+            json.dump(self.new, lf, indent=1, sort_keys=True)
+        os.replace(tmp_, self.path)
@@ -0,0 +1,98 @@
+"""
+    Packaging scheduler for TA: rpm/deb/iso artifacts of all labels are built concurrently.
+"""
+
+import os
+import time
+import shutil
+import hashlib
+import subprocess
+import concurrent.futures
+
+from .utils import mkdir_p
+from .stagerunner import run_logged
+
+BUFSIZE = 4*1024*1024
+
+
+def hardlink_tree(src, dst):
+    '''
+    Copy of tree «src» as hardlinks (cheap per-label staging of out).
+    Hardlinks are impossible between filesystems (f.e. «out» is symlink to other disk),
+    then tree is just copied.
+    '''
+    if os.path.lexists(dst):
+        shutil.rmtree(dst)
+    mkdir_p(os.path.dirname(dst))
+    if subprocess.call(['cp', '-al', src, dst], stderr=subprocess.DEVNULL) == 0:
+        return
+    print(f"Cannot hardlink {src} to {dst}, copying")
+    if os.path.lexists(dst):
+        shutil.rmtree(dst)
+    subprocess.check_call(['cp', '-a', src, dst])
+
+
+def stream_with_md5(cmd, path, log_path):
+    '''
+    Run command, that writes artifact to stdout, into file «path»,
+    computing MD5 on the way (no second read of multi-GB file).
+    Returns dict with exit code, size and md5.
+    '''
+    mkdir_p(os.path.dirname(log_path) or '.')
+    md5_ = hashlib.md5()
+    size_ = 0
+    with open(log_path, 'w', encoding='utf-8') as log_, open(path, 'wb') as lf:
+        proc_ = subprocess.Popen(cmd, shell=isinstance(cmd, str), stdout=subprocess.PIPE, stderr=log_)
+        while True:
+            buf_ = proc_.stdout.read(BUFSIZE)
+            if not buf_:
+                break
+            md5_.update(buf_)
+            lf.write(buf_)
+            size_ += len(buf_)
+        proc_.stdout.close()
+        proc_.wait()
+    return {'exit_code': proc_.returncode, 'size': size_, 'md5': md5_.hexdigest(), 'log': log_path}
+
+
+class PackagingScheduler:
+    '''
+    Artifacts (name → function returning dict with «exit_code») are built on pool of threads,
+    so packaging time is bounded by the slowest artifact, not by their sum.
+    '''
+
+    def __init__(self, jobs, logs_dir):
+        self.jobs = max(1, jobs)
+        self.logs_dir = logs_dir
+        self.artifacts = {}
+
+    def add(self, name, func):
+        self.artifacts[name] = func
+
+    def log_path(self, name):
+        return os.path.join(self.logs_dir, f'package-{name}.log')
+
+    def run_cmd(self, name, cmd):
+        return run_logged(cmd, self.log_path(name), prefix=f'[{name}] ' if self.jobs > 1 else '')
+
+    def build(self, name):
+        start_ = time.time()
+        try:
+            res_ = self.artifacts[name]() or {}
+        except Exception as ex_:
+            print(f"Artifact {name} failed: {ex_!r}")
+            res_ = {'exit_code': 1, 'error': repr(ex_)}
+        res_['wall'] = round(time.time() - start_, 1)
+        return res_
+
+    def run(self):
+        '''
+        Build all artifacts, returns name → result.
+        '''
+        names_ = list(self.artifacts)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.jobs, len(names_) or 1)) as pool_:
+            results_ = dict(zip(names_, pool_.map(self.build, names_)))
+        for name_, res_ in results_.items():
+            status_ = 'ok' if res_.get('exit_code') == 0 else f"FAILED ({res_.get('exit_code')})"
+            print(f"Artifact {name_}: {status_} in {res_['wall']}s")
+        return results_
@@ -0,0 +1,198 @@
+"""
+    Combined matching of many regexps for TA (bin_regexps etc).
+"""
+
+import re
+import sys
+import time
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+# Patterns with backreferences can not be renumbered inside one alternation.
+REX_BACKREF = re.compile(r'\\[1-9]|\(\?P=')
+
+
+def literal_parts(pattern):
+    '''
+    Split regexp (with «$» at the end) to literal prefix and, for «.*literal$» patterns, literal suffix.
+    '''
+    try:
+        ops_ = list(sre_parse.parse(pattern))
+    except Exception:
+        return '', None
+    prefix_ = ''
+    for op_, av_ in ops_:
+        if str(op_) != 'LITERAL':
+            break
+        prefix_ += chr(av_)
+
+    suffix_ = None
+    if len(ops_) >= 2 and str(ops_[0][0]) == 'MAX_REPEAT' and str(ops_[-1][0]) == 'AT' and str(ops_[-1][1]) == 'AT_END':
+        min_, max_, body_ = ops_[0][1]
+        body_ = list(body_)
+        if min_ == 0 and max_ == sre_parse.MAXREPEAT and len(body_) == 1 and str(body_[0][0]) == 'ANY':
+            middle_ = ops_[1:-1]
+            if all(str(op_) == 'LITERAL' for op_, _ in middle_):
+                suffix_ = ''.join(chr(av_) for _, av_ in middle_)
+    return prefix_, suffix_
+
+
+class RegexSet:
+    '''
+    List of compiled regexps, matched together.
+
+    Like sequential loop over the list, tells index of the first matched pattern, but
+      * patterns with literal prefix are found by prefix lookups;
+      * «.*literal» patterns are found by suffix lookups;
+      * others are matched by one combined alternation;
+      * patterns that can not live inside alternation (backreferences,
+        inline global flags, etc) are residual and checked one by one.
+    '''
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self.residual = []
+        self.prefixes = {}   # len -> prefix -> [indexes]
+        self.suffixes = {}   # len -> suffix -> [indexes]
+        alts_ = []
+        for i_, re_ in enumerate(self.patterns):
+            ok_ = not re_.flags & ~re.UNICODE and not REX_BACKREF.search(re_.pattern)
+            if not ok_:
+                self.residual.append(i_)
+                continue
+            prefix_, suffix_ = literal_parts(re_.pattern)
+            if suffix_:
+                self.suffixes.setdefault(len(suffix_), {}).setdefault(suffix_, []).append(i_)
+                continue
+            if len(prefix_) >= 2:
+                self.prefixes.setdefault(len(prefix_), {}).setdefault(prefix_, []).append(i_)
+                continue
+            alt_ = f'(?P<_p{i_}>{re_.pattern})'
+            try:
+                re.compile(alt_)
+                alts_.append((i_, alt_))
+            except re.error:
+                self.residual.append(i_)
+
+        self.combined = None
+        if alts_:
+            try:
+                self.combined = re.compile('|'.join(alt_ for _, alt_ in alts_))
+            except re.error:
+                # f.e. same named group in several patterns
+                self.residual = sorted(self.residual + [i_ for i_, _ in alts_])
+        self.prefixes = sorted(self.prefixes.items())
+        self.suffixes = sorted(self.suffixes.items())
+
+    def match_index(self, f):
+        '''
+        Index of the first pattern matching f, or None.
+        '''
+        idx_ = None
+        if self.combined:
+            m_ = self.combined.match(f)
+            if m_:
+                idx_ = int(m_.lastgroup[2:])
+        for len_, dict_ in self.suffixes:
+            for i_ in dict_.get(f[-len_:], ()):
+                if idx_ is None or i_ < idx_:
+                    idx_ = i_
+                break
+        for len_, dict_ in self.prefixes:
+            for i_ in dict_.get(f[:len_], ()):
+                if idx_ is not None and i_ > idx_:
+                    break
+                if self.patterns[i_].match(f):
+                    idx_ = i_
+                    break
+        for i_ in self.residual:
+            if idx_ is not None and i_ > idx_:
+                break
+            if self.patterns[i_].match(f):
+                return i_
+        return idx_
+
+    def match(self, f):
+        '''
+        First pattern matching f, or None.
+        '''
+        idx_ = self.match_index(f)
+        if idx_ is None:
+            return None
+        return self.patterns[idx_]
+
+    def match_index_loop(self, f):
+        '''
+        Reference sequential matching, for benchmarks and checks.
+        '''
+        for i_, re_ in enumerate(self.patterns):
+            if re_.match(f):
+                return i_
+        return None
+
+
+def bench_bin_regexps(br, files, repeat=3):
+    '''
+    Compare combined matchers of BinRegexps with sequential loops over patterns.
+    '''
+    sets_ = {
+        'just_copy': br.just_copy_set,
+        'need_patch': br.need_patch_set,
+        'need_exclude': br.need_exclude_set,
+        'ignore': br.ignore_set,
+    }
+    for name_, rs_ in sets_.items():
+        for f in files:
+            assert rs_.match_index(f) == rs_.match_index_loop(f), f'Mismatch for «{f}» in {name_}'
+
+        times_ = {}
+        for method_ in ['match_index_loop', 'match_index']:
+            best_ = None
+            for _ in range(repeat):
+                fn_ = getattr(rs_, method_)
+                start_ = time.perf_counter()
+                for f in files:
+                    fn_(f)
+                took_ = time.perf_counter() - start_
+                if best_ is None or took_ < best_:
+                    best_ = took_
+            times_[method_] = best_
+        speedup_ = times_['match_index_loop'] / max(times_['match_index'], 1e-9)
+        print(f"{name_:12} patterns: {len(rs_.patterns):5} (residual {len(rs_.residual)}) "
+              f"loop: {times_['match_index_loop']:.3f}s combined: {times_['match_index']:.3f}s x{speedup_:.1f}")
+
+
+def main():
+    '''
+    python -m terrarium_assembler.regexset <spec.yml> <file-list>
+
+    File list is one path per line, or tmp/file-package-list-from-rpm.txt.
+    '''
+    from .utils import yaml_load
+    from .ta import BinRegexps, ROW_SPLIT
+    spec, _ = yaml_load(sys.argv[1])
+    need_patch = just_copy = need_exclude = None
+    if 'bin_regexps' in spec:
+        br_ = spec.bin_regexps
+        need_patch = br_.get('need_patch')
+        just_copy = br_.get('just_copy')
+        need_exclude = br_.get('need_exclude')
+    br = BinRegexps(need_patch=need_patch, just_copy=just_copy, need_exclude=need_exclude, debug=False)
+
+    files = []
+    with open(sys.argv[2], 'r', encoding='utf-8') as lf:
+        for line in lf:
+            line = line.strip('\n')
+            if ROW_SPLIT in line:
+                line = line.split(ROW_SPLIT)[-1]
+            if line.strip():
+                files.append(line.strip())
+    print(f"{len(files)} files")
+    bench_bin_regexps(br, files)
+
+
+if __name__ == '__main__':
+    main()
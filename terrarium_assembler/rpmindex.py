@@ -0,0 +1,223 @@
+"""
+    Compact on-disk index «file → RPM package» for TA.
+
+    python -m terrarium_assembler.rpmindex build <file-package-list.txt> <index>
+    python -m terrarium_assembler.rpmindex query <index> <path> ...
+"""
+
+import os
+import sys
+import json
+import mmap
+import struct
+from array import array
+
+ROW_SPLIT = ' ||| '
+MAGIC = b'TARPMIX2'
+# magic, number of packages, number of rows, offsets of: packages json, paths blob, path offsets, path packages, file order
+HEADER = struct.Struct('<8sQQQQQQQ')
+
+
+def encode_path(path):
+    return path.encode('utf-8', errors='surrogateescape')
+
+
+def decode_path(bpath):
+    return bpath.decode('utf-8', errors='surrogateescape')
+
+
+def pad8(lf):
+    pos_ = lf.tell()
+    if pos_ % 8:
+        lf.write(b'\0' * (8 - pos_ % 8))
+    return lf.tell()
+
+
+def plain_row(*terms):
+    return terms
+
+
+def build_rpm_index(txt_path, index_path):
+    '''
+    Convert «rpm -qa» file list (name ||| version ||| release ||| buildtime ||| buildhost ||| filename)
+    to index: interned packages, table of (path, package id) sorted by path
+    and positions of rows in that table in order of file list.
+    All owners of path are kept, owners of same path are in order of file list.
+    '''
+    packages_ = []
+    package2id = {}
+    rows_ = []
+    with open(txt_path, 'r', encoding='utf-8', errors='surrogateescape') as lf:
+        for line in lf:
+            terms_ = line.rstrip('\n').split(ROW_SPLIT)
+            if len(terms_) != 6:
+                continue
+            pkg_ = tuple(terms_[:5])
+            id_ = package2id.get(pkg_)
+            if id_ is None:
+                id_ = package2id[pkg_] = len(packages_)
+                packages_.append(pkg_)
+            rows_.append((encode_path(terms_[5]), id_))
+
+    # sort is stable, so owners of path stay in order of file list
+    order_ = sorted(range(len(rows_)), key=lambda i_: rows_[i_][0])
+    fileorder_ = array('I', bytes(4*len(rows_)))
+    for pos_, i_ in enumerate(order_):
+        fileorder_[i_] = pos_
+
+    offsets_ = array('Q', [0])
+    pkgids_ = array('I')
+    for i_ in order_:
+        bpath_, id_ = rows_[i_]
+        offsets_.append(offsets_[-1] + len(bpath_))
+        pkgids_.append(id_)
+
+    tmp_ = index_path + '.tmp'
+    with open(tmp_, 'wb') as lf:
+        lf.write(b'\0' * HEADER.size)
+        packages_off = pad8(lf)
+        lf.write(json.dumps(packages_, ensure_ascii=False).encode('utf-8', errors='surrogateescape'))
+        paths_off = pad8(lf)
+        for i_ in order_:
+            lf.write(rows_[i_][0])
+        offsets_off = pad8(lf)
+        lf.write(offsets_.tobytes())
+        pkgids_off = pad8(lf)
+        lf.write(pkgids_.tobytes())
+        fileorder_off = pad8(lf)
+        lf.write(fileorder_.tobytes())
+        lf.seek(0)
+        lf.write(HEADER.pack(MAGIC, len(packages_), len(rows_), packages_off, paths_off, offsets_off, pkgids_off, fileorder_off))
+    os.replace(tmp_, index_path)
+    return len(packages_), len(rows_)
+
+
+class RpmFileIndex:
+    '''
+    Read-only mmap view of index, built by build_rpm_index.
+    Lookups path → package are binary searches in sorted path table
+    (if file belongs to several packages, last one wins, as it was with dict),
+    package rows are made by row_factory(name, version, release, buildtime, buildhost, filename).
+    '''
+
+    def __init__(self, path, row_factory=plain_row):
+        self.path = path
+        self.row_factory = row_factory
+        with open(path, 'rb') as lf:
+            self.mm = mmap.mmap(lf.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic_, self.n_packages, self.n_paths,
+         packages_off, self.paths_off, offsets_off, pkgids_off, fileorder_off) = HEADER.unpack_from(self.mm, 0)
+        if magic_ != MAGIC:
+            self.mm.close()
+            raise ValueError(f'{path} is not RPM file index')
+        self.packages = [tuple(p_) for p_ in json.loads(self.mm[packages_off:self.paths_off].rstrip(b'\0').decode('utf-8', errors='surrogateescape'))]
+        self.offsets = memoryview(self.mm)[offsets_off:offsets_off + 8*(self.n_paths + 1)].cast('Q')
+        self.pkgids = memoryview(self.mm)[pkgids_off:pkgids_off + 4*self.n_paths].cast('I')
+        self.fileorder = memoryview(self.mm)[fileorder_off:fileorder_off + 4*self.n_paths].cast('I')
+
+    def close(self):
+        self.offsets.release()
+        self.pkgids.release()
+        self.fileorder.release()
+        self.mm.close()
+
+    def __len__(self):
+        return self.n_paths
+
+    def bpath(self, i):
+        return self.mm[self.paths_off + self.offsets[i]:self.paths_off + self.offsets[i+1]]
+
+    def bisect(self, key, right=False):
+        lo_, hi_ = 0, self.n_paths
+        while lo_ < hi_:
+            mid_ = (lo_ + hi_) // 2
+            bpath_ = self.bpath(mid_)
+            if bpath_ < key or (right and bpath_ == key):
+                lo_ = mid_ + 1
+            else:
+                hi_ = mid_
+        return lo_
+
+    def owners_range(self, path):
+        '''
+        Range of rows of path in sorted table (empty if path is unknown).
+        '''
+        key_ = encode_path(path)
+        return range(self.bisect(key_), self.bisect(key_, right=True))
+
+    def find(self, path):
+        '''
+        Index of last owner of path in sorted table or -1.
+        '''
+        range_ = self.owners_range(path)
+        return range_[-1] if range_ else -1
+
+    def row(self, i):
+        return self.row_factory(*self.packages[self.pkgids[i]], decode_path(self.bpath(i)))
+
+    def get(self, path, default=None):
+        '''
+        Package row for path. Files from /lib64 are also found as /usr/lib64.
+        '''
+        i_ = self.find(path)
+        if i_ < 0 and path.startswith('/usr/lib64/'):
+            i_ = self.find(path[len('/usr'):])
+        if i_ < 0:
+            return default
+        return self.row(i_)
+
+    def owners(self, path):
+        '''
+        Package rows of all owners of path, in order of file list.
+        '''
+        return [self.row(i_) for i_ in self.owners_range(path)]
+
+    def __contains__(self, path):
+        return self.get(path) is not None
+
+    def __getitem__(self, path):
+        row_ = self.get(path)
+        if row_ is None:
+            raise KeyError(path)
+        return row_
+
+    def paths(self):
+        '''
+        Unique paths, sorted.
+        '''
+        prev_ = None
+        for i_ in range(self.n_paths):
+            bpath_ = self.bpath(i_)
+            if bpath_ != prev_:
+                yield decode_path(bpath_)
+            prev_ = bpath_
+
+    def rows(self, packages=None):
+        '''
+        All rows (every owner of every path) in order of file list,
+        or only rows of packages with given names.
+        '''
+        ids_ = None
+        if packages is not None:
+            ids_ = set(i_ for i_, p_ in enumerate(self.packages) if p_[0] in packages)
+        for i_ in self.fileorder:
+            if ids_ is None or self.pkgids[i_] in ids_:
+                yield self.row(i_)
+
+
+def main():
+    if len(sys.argv) >= 4 and sys.argv[1] == 'build':
+        n_packages, n_paths = build_rpm_index(sys.argv[2], sys.argv[3])
+        print(f'{sys.argv[3]}: {n_packages} packages, {n_paths} rows')
+        return
+    if len(sys.argv) >= 4 and sys.argv[1] == 'query':
+        index_ = RpmFileIndex(sys.argv[2])
+        for path_ in sys.argv[3:]:
+            print(path_, index_.get(path_))
+        return
+    print(__doc__)
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+"""
+    Graph of TA stages keyed by stage numbers,
+    central «is stage up to date» checks.
+"""
+
+import os
+import json
+import time
+import hashlib
+
+from .utils import fname2num, mkdir_p, file_digest
+from .folderhash import FolderHasher
+
+
+def spec_digest(fragments):
+    '''
+    Digest of spec fragments (any yaml-like values).
+    '''
+    str_ = json.dumps(fragments, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.blake2b(str_.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class StageGraph:
+    '''
+    Stages as nodes keyed by their numbers.
+
+    Node declares (see StageTask) input folders/files, spec fragments and outputs.
+    Stage is up to date if its script, spec fragments, content of inputs and outputs are the same
+    as after its last successful run. Undeclared stages are always run.
+
+    Pseudo resources like «@container» have identity (f.e. container ID)
+    and stamps of stages, that changed them (installed packages into container).
+    Stage sees stamps only of producers with lower numbers,
+    so stages 03 and 06 both installing RPMs do not invalidate each other.
+    '''
+
+    def __init__(self, stages_names):
+        self.nodes = {}
+        for s_ in stages_names:
+            self.nodes[fname2num(s_)] = s_
+        self.state_dir = None
+        self.resources = {}
+        self.identities = {}
+        self.stamps = {}
+        self.force = False
+        self.hasher = FolderHasher()
+
+    def resolve_steps(self, steps):
+        '''
+        Stage names for steps like «0-7,41,50-59».
+        '''
+        names_ = []
+        for step_ in steps.split(','):
+            step_ = step_.strip()
+            if not step_:
+                continue
+            try:
+                if '-' in step_:
+                    sfrom, sto = [int(x_) for x_ in step_.split('-')]
+                    nums_ = [n_ for n_ in sorted(self.nodes) if sfrom <= n_ <= sto]
+                    if not nums_:
+                        raise ValueError(f'No stages in interval «{step_}»')
+                else:
+                    nums_ = [int(step_)]
+            except ValueError as ex_:
+                raise ValueError(f'Bad step «{step_}»: {ex_}')
+            for n_ in nums_:
+                if n_ not in self.nodes:
+                    raise ValueError(f'Unknown stage number {n_}, known are {sorted(self.nodes)}')
+                names_.append(self.nodes[n_])
+        return names_
+
+    def select(self, filter_):
+        return [s_ for _, s_ in sorted(self.nodes.items()) if filter_(s_)]
+
+    def load(self, state_dir, resources, index_dir=None, jobs=0):
+        '''
+        Read saved states. Resources: pseudo resource name → function, returning its identity.
+        Folders are fingerprinted by content, with stat index in index_dir.
+        '''
+        self.state_dir = state_dir
+        self.resources = resources
+        self.hasher = FolderHasher(index_dir, jobs)
+        mkdir_p(state_dir)
+        self.stamps = self.read_json('resources.json') or {}
+
+    def read_json(self, name):
+        path_ = os.path.join(self.state_dir, name)
+        if not os.path.exists(path_):
+            return None
+        try:
+            with open(path_, 'r', encoding='utf-8') as lf:
+                return json.load(lf)
+        except Exception as ex_:
+            print(f"Broken stage state {path_}, ignoring it: {ex_}")
+            return None
+
+    def write_json(self, name, data):
+        path_ = os.path.join(self.state_dir, name)
+        with open(path_ + '.tmp', 'w', encoding='utf-8') as lf:
+            json.dump(data, lf, indent=1, sort_keys=True)
+        os.replace(path_ + '.tmp', path_)
+
+    def identity(self, res):
+        if res not in self.identities:
+            func_ = self.resources.get(res)
+            self.identities[res] = func_() if func_ else ''
+        return self.identities[res]
+
+    def resource_state(self, res, task, as_input):
+        if not as_input:
+            return self.identity(res)
+        stamps_ = self.stamps.get(res, {})
+        seen_ = {s_: v_ for s_, v_ in stamps_.items() if (fname2num(s_) or 0) < task.num}
+        return self.identity(res) + ':' + spec_digest(seen_)
+
+    def fingerprint(self, task):
+        fp_ = {
+            'script': file_digest(task.script) if task.script and os.path.exists(task.script) else '',
+            'spec': spec_digest(task.spec),
+        }
+        for kind_, paths_ in [('in', task.inputs), ('out', task.outputs)]:
+            for p_ in paths_:
+                if p_.startswith('@'):
+                    fp_[f'{kind_}:{p_}'] = self.resource_state(p_, task, kind_ == 'in')
+                else:
+                    fp_[f'{kind_}:{p_}'] = self.hasher.digest(p_)
+        return fp_
+
+    def state_name(self, task):
+        return task.name + '.json'
+
+    def uptodate(self, task):
+        '''
+        None if task should be run, else reason why it is skipped.
+        '''
+        if not task.declared() or self.force or not self.state_dir:
+            return None
+        old_ = self.read_json(self.state_name(task))
+        if not old_:
+            task.result['reason'] = 'never run'
+            return None
+        start_ = time.time()
+        new_ = self.fingerprint(task)
+        changed_ = sorted(k_ for k_ in set(old_) | set(new_) if old_.get(k_) != new_.get(k_))
+        if changed_:
+            task.result['reason'] = 'changed ' + ', '.join(changed_)
+            return None
+        return f'up to date, checked in {time.time() - start_:.2f}s'
+
+    def touched_resources(self, task):
+        '''
+        Pseudo resources that task could change. Undeclared script stage could change any.
+        '''
+        if task.outputs is None:
+            return [] if task.func else list(self.resources)
+        return [p_ for p_ in task.outputs if p_.startswith('@')]
+
+    def stamp(self, task):
+        for res_ in self.touched_resources(task):
+            self.identities.pop(res_, None)
+            self.stamps.setdefault(res_, {})[task.name] = time.time_ns()
+            self.write_json('resources.json', self.stamps)
+
+    def record(self, task):
+        '''
+        Save state of successfully finished task.
+        '''
+        if not self.state_dir:
+            return
+        self.stamp(task)
+        if task.declared():
+            self.write_json(self.state_name(task), self.fingerprint(task))
+
+    def forget(self, task):
+        '''
+        Failed task should be run next time.
+        '''
+        if not self.state_dir:
+            return
+        path_ = os.path.join(self.state_dir, self.state_name(task))
+        if os.path.exists(path_):
+            os.unlink(path_)
+        # resources could be changed partially
+        self.stamp(task)
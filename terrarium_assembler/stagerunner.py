@@ -0,0 +1,248 @@
+"""
+    Stage runner for TA: runs generated stage scripts as tasks
+    with declared inputs/outputs, logs and JSON run report.
+"""
+
+import os
+import sys
+import json
+import time
+import datetime
+import resource
+import subprocess
+import dataclasses as dc
+import concurrent.futures
+from typing import List, Optional, Callable
+
+from .utils import mkdir_p
+
+
+@dc.dataclass
+class StageTask:
+    '''
+    Stage as a task for the runner.
+    '''
+    name: str                 # stage method name, like stage_41_download_go
+    num: int                  # stage number
+    script: str = ''          # generated shell script
+    func: Optional[Callable] = None   # in-process stage (Python code of TA)
+    inputs: Optional[List[str]] = None   # None — not declared, stage is a barrier
+    outputs: Optional[List[str]] = None
+    spec: Optional[list] = None       # spec fragments stage depends on
+    deps: List[str] = dc.field(default_factory=list)
+    result: dict = dc.field(default_factory=dict)
+
+    def declared(self):
+        return self.inputs is not None and self.outputs is not None
+
+
+def paths_overlap(a, b):
+    '''
+    Same path or one is inside other. Pseudo resources like «@container» are compared by name.
+    '''
+    if a.startswith('@') or b.startswith('@'):
+        return a == b
+    a = os.path.normpath(a)
+    b = os.path.normpath(b)
+    return a == b or a.startswith(b + os.path.sep) or b.startswith(a + os.path.sep)
+
+
+def lists_overlap(la, lb):
+    return any(paths_overlap(a, b) for a in la for b in lb)
+
+
+def depends(later, earlier):
+    '''
+    Should «later» task wait for «earlier» one.
+    '''
+    if not later.declared() or not earlier.declared():
+        return True
+    if lists_overlap(earlier.outputs, later.inputs + later.outputs):
+        return True
+    if lists_overlap(later.outputs, earlier.inputs):
+        return True
+    return False
+
+
+def timestamp():
+    return datetime.datetime.now().isoformat(timespec='milliseconds')
+
+
+def run_logged(cmd, log_path, cwd=None, env=None, prefix=''):
+    '''
+    Run command, stream its output with timestamps into log (and with prefix to stdout).
+    Returns dict with exit code, wall and CPU times.
+    '''
+    mkdir_p(os.path.dirname(log_path) or '.')
+    start_ = time.time()
+    res_ = {'start': timestamp(), 'log': log_path}
+    with open(log_path, 'w', encoding='utf-8') as lf:
+        proc_ = subprocess.Popen(cmd, cwd=cwd, env=env, shell=isinstance(cmd, str),
+                                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        for line_ in iter(proc_.stdout.readline, b''):
+            line_ = line_.decode('utf-8', errors='replace').rstrip('\n')
+            lf.write(f'[{datetime.datetime.now().strftime("%H:%M:%S.%f")[:-3]}] {line_}\n')
+            lf.flush()
+            print(prefix + line_, flush=True)
+        proc_.stdout.close()
+        # wait4 gives resource usage of this very child, even when other stages are running.
+        _, status_, rusage_ = os.wait4(proc_.pid, 0)
+        proc_.returncode = os.waitstatus_to_exitcode(status_)
+    res_.update({
+        'end': timestamp(),
+        'exit_code': proc_.returncode,
+        'wall': round(time.time() - start_, 3),
+        'cpu_user': round(rusage_.ru_utime, 3),
+        'cpu_sys': round(rusage_.ru_stime, 3),
+        'max_rss_mb': round(rusage_.ru_maxrss / 1024, 1),
+    })
+    return res_
+
+
+class StageRunner:
+    '''
+    Runs selected stages respecting dependencies between them,
+    independent script stages are run concurrently (up to «jobs»).
+    Undeclared in-process stages are run in the main thread, alone,
+    declared ones — on the pool with script stages, but not with each other (they share cwd).
+    '''
+
+    def __init__(self, jobs, cwd, report_path, logs_dir, graph=None):
+        self.jobs = max(1, jobs)
+        self.graph = graph
+        self.cwd = cwd
+        self.report_path = report_path
+        self.logs_dir = logs_dir
+        self.tasks = []
+
+    def add(self, task):
+        task.deps = [t_.name for t_ in self.tasks if depends(task, t_)]
+        self.tasks.append(task)
+
+    def run_script(self, task):
+        print("*"*20)
+        print("Executing ", task.script)
+        print("*"*20, flush=True)
+        log_ = os.path.join(self.logs_dir, os.path.splitext(task.script)[0] + '.log')
+        prefix_ = f'[{task.num:02}] ' if self.jobs > 1 else ''
+        return run_logged(['./' + task.script], log_, cwd=self.cwd, prefix=prefix_)
+
+    def run_func(self, task):
+        os.chdir(self.cwd)
+        start_ = time.time()
+        ru_self = resource.getrusage(resource.RUSAGE_SELF)
+        ru_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        res_ = {'start': timestamp()}
+        exit_code = 0
+        metrics_ = None
+        try:
+            metrics_ = task.func()
+        except Exception as ex_:
+            print(f"Stage {task.name} failed: {ex_!r}")
+            exit_code = 1
+            res_['error'] = repr(ex_)
+        finally:
+            os.chdir(self.cwd)
+        ru_self2 = resource.getrusage(resource.RUSAGE_SELF)
+        ru_children2 = resource.getrusage(resource.RUSAGE_CHILDREN)
+        res_.update({
+            'end': timestamp(),
+            'exit_code': exit_code,
+            'wall': round(time.time() - start_, 3),
+            'cpu_user': round(ru_self2.ru_utime - ru_self.ru_utime + ru_children2.ru_utime - ru_children.ru_utime, 3),
+            'cpu_sys': round(ru_self2.ru_stime - ru_self.ru_stime + ru_children2.ru_stime - ru_children.ru_stime, 3),
+        })
+        if isinstance(metrics_, dict):
+            res_['metrics'] = metrics_
+        return res_
+
+    def finished(self, task):
+        if not self.graph:
+            return
+        os.chdir(self.cwd)
+        if task.result['exit_code'] == 0:
+            self.graph.record(task)
+        else:
+            self.graph.forget(task)
+
+    def write_report(self, started):
+        report_ = {
+            'started': started,
+            'finished': timestamp(),
+            'jobs': self.jobs,
+            'argv': sys.argv,
+            'stages': [dict(stage=t_.name, num=t_.num, script=t_.script, deps=t_.deps, **t_.result)
+                       for t_ in self.tasks],
+        }
+        mkdir_p(os.path.dirname(self.report_path) or '.')
+        with open(self.report_path, 'w', encoding='utf-8') as lf:
+            json.dump(report_, lf, indent=2, ensure_ascii=False)
+
+    def run(self):
+        started_ = timestamp()
+        pending_ = list(self.tasks)
+        done_ = set()
+        running_ = {}
+        failed_ = None
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) as pool_:
+            while (pending_ or running_):
+                if not failed_:
+                    for task_ in list(pending_):
+                        if len(running_) >= self.jobs:
+                            break
+                        if not all(d_ in done_ for d_ in task_.deps):
+                            continue
+                        # in-process stages share cwd of TA, so only one at a time
+                        if task_.func and any(r_.func for r_ in running_.values()):
+                            continue
+                        if self.graph:
+                            os.chdir(self.cwd)
+                            reason_ = self.graph.uptodate(task_)
+                            if reason_:
+                                print(f'Stage {task_.name} skipped: {reason_}')
+                                pending_.remove(task_)
+                                task_.result.update(status='up-to-date', reason=reason_)
+                                done_.add(task_.name)
+                                continue
+                        if task_.func and task_.declared():
+                            pending_.remove(task_)
+                            running_[pool_.submit(self.run_func, task_)] = task_
+                            continue
+                        if task_.func:
+                            if running_:
+                                break
+                            pending_.remove(task_)
+                            task_.result.update(self.run_func(task_))
+                            done_.add(task_.name)
+                            self.finished(task_)
+                            if task_.result['exit_code'] != 0:
+                                failed_ = task_
+                                break
+                            continue
+                        pending_.remove(task_)
+                        running_[pool_.submit(self.run_script, task_)] = task_
+
+                if failed_ and not running_:
+                    break
+                if not running_:
+                    continue
+                finished_, _ = concurrent.futures.wait(running_, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future_ in finished_:
+                    task_ = running_.pop(future_)
+                    try:
+                        task_.result.update(future_.result())
+                    except Exception as ex_:
+                        task_.result.update(exit_code=-1, error=repr(ex_))
+                    done_.add(task_.name)
+                    self.finished(task_)
+                    if task_.result['exit_code'] != 0:
+                        print(f'{task_.script or task_.name} execution failed!')
+                        failed_ = failed_ or task_
+
+        for task_ in pending_:
+            task_.result['status'] = 'not started'
+        for task_ in self.tasks:
+            if 'exit_code' in task_.result:
+                task_.result['status'] = 'ok' if task_.result['exit_code'] == 0 else 'failed'
+        self.write_report(started_)
+        assert not failed_, 'Execution of stage failed!'
@@ -0,0 +1,214 @@
+"""
+    Streaming analyzer of strace logs for TA: which files were touched by tests.
+
+    python -m terrarium_assembler.straceparse [--jobs N] [--cache-dir DIR] <log or folder> ...
+"""
+
+import os
+import re
+import sys
+import gzip
+import json
+import hashlib
+import argparse
+import subprocess
+import concurrent.futures
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CHUNK = 16*1024*1024
+# first quoted argument of syscall, the same as «.*\([^"]*\"(?P<filename>[^"]+)\".*» on text lines
+RE_FILE = re.compile(rb'.*\([^"]*"(?P<filename>[^"]+)".*')
+
+
+class ProcessReader:
+    '''
+    Stdout of decompressing process as binary stream.
+    Process is waited on close, nonzero exit code (f.e. corrupt archive) raises IOError,
+    so truncated output is not taken for the whole log.
+    '''
+
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self.proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.eof = False
+
+    def read(self, size=-1):
+        data_ = self.proc.stdout.read(size)
+        if not data_ and size != 0:
+            self.eof = True
+        return data_
+
+    def close(self, check=True):
+        if self.proc.returncode is not None:
+            return
+        self.proc.stdout.close()
+        # output was not read to the end — exit code of killed process means nothing
+        check = check and self.eof
+        if not check:
+            self.proc.kill()
+        err_ = self.proc.stderr.read()
+        self.proc.stderr.close()
+        self.proc.wait()
+        if check and self.proc.returncode != 0:
+            raise IOError(f"«{' '.join(self.cmd)}» failed with code {self.proc.returncode}: "
+                          f"{err_.decode('utf-8', errors='replace').strip()}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(check=exc_type is None)
+
+
+def open_trace(path):
+    '''
+    Binary stream of log, .gz and .zst are decompressed on the fly.
+    '''
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.zst'):
+        if zstandard:
+            # logs are often concatenated from several frames (zstd of chunks, «cat a.zst b.zst»)
+            return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True,
+                                                              read_across_frames=True)
+        return ProcessReader(['zstd', '-dc', path])
+    return open(path, 'rb')
+
+
+def trace_lines(path):
+    '''
+    Lines of log, read by big chunks.
+    '''
+    tail_ = b''
+    with open_trace(path) as lf:
+        while True:
+            chunk_ = lf.read(CHUNK)
+            if not chunk_:
+                break
+            lines_ = (tail_ + chunk_).split(b'\n')
+            tail_ = lines_.pop()
+            yield from lines_
+    if tail_:
+        yield tail_
+
+
+def trace_filenames(path):
+    '''
+    Set of file names from successful syscalls of one log.
+    Cheap substring checks go first, regexp only for lines with quoted argument.
+    '''
+    names_ = set()
+    for line in trace_lines(path):
+        if b'"' not in line or b'ENOENT' in line:
+            continue
+        m_ = RE_FILE.match(line)
+        if m_:
+            names_.add(m_.group('filename'))
+    return sorted(n_.decode('utf-8', errors='replace') for n_ in names_)
+
+
+def trace_files(paths):
+    '''
+    Logs from list of logs and folders with them.
+    '''
+    files_ = []
+    for path_ in paths:
+        if os.path.isdir(path_):
+            for name_ in sorted(os.listdir(path_)):
+                if os.path.isfile(os.path.join(path_, name_)):
+                    files_.append(os.path.join(path_, name_))
+        elif os.path.isfile(path_):
+            files_.append(path_)
+    return files_
+
+
+class StraceAnalyzer:
+    '''
+    File names from many logs on pool of processes.
+    Result for every log is cached by (size, mtime), so already analysed logs are not read again.
+    '''
+
+    def __init__(self, cache_dir=None, jobs=1):
+        self.cache_dir = cache_dir
+        self.jobs = max(1, jobs)
+        self.analysed = 0
+        self.cached = 0
+
+    def cache_path(self, path):
+        key_ = hashlib.blake2b(os.path.abspath(path).encode('utf-8', errors='surrogateescape'),
+                               digest_size=8).hexdigest()
+        return os.path.join(self.cache_dir, key_ + '.json')
+
+    def from_cache(self, path):
+        if not self.cache_dir or not os.path.exists(self.cache_path(path)):
+            return None
+        st_ = os.stat(path)
+        try:
+            with open(self.cache_path(path), 'r', encoding='utf-8') as lf:
+                data_ = json.load(lf)
+        except Exception:
+            return None
+        if data_.get('path') != os.path.abspath(path) or data_.get('stat') != [st_.st_size, st_.st_mtime_ns]:
+            return None
+        return data_['files']
+
+    def to_cache(self, path, files):
+        if not self.cache_dir:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        st_ = os.stat(path)
+        tmp_ = self.cache_path(path) + '.tmp'
+        with open(tmp_, 'w', encoding='utf-8') as lf:
+            json.dump({'path': os.path.abspath(path), 'stat': [st_.st_size, st_.st_mtime_ns], 'files': files}, lf)
+        os.replace(tmp_, self.cache_path(path))
+
+    def filenames(self, paths):
+        '''
+        Union of file names from all logs (files or folders).
+        '''
+        result_ = set()
+        todo_ = []
+        for path_ in trace_files(paths):
+            files_ = self.from_cache(path_)
+            if files_ is None:
+                todo_.append(path_)
+            else:
+                self.cached += 1
+                result_.update(files_)
+
+        if self.jobs > 1 and len(todo_) > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=min(self.jobs, len(todo_))) as pool_:
+                results_ = zip(todo_, pool_.map(trace_filenames, todo_))
+                for path_, files_ in results_:
+                    print(f'Analysed {path_}', file=sys.stderr)
+                    self.to_cache(path_, files_)
+                    result_.update(files_)
+        else:
+            for path_ in todo_:
+                print(f'Analysing {path_}', file=sys.stderr)
+                files_ = trace_filenames(path_)
+                self.to_cache(path_, files_)
+                result_.update(files_)
+        self.analysed += len(todo_)
+        return result_
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Print file names, used in strace logs')
+    ap.add_argument('--jobs', type=int, default=0, help='Number of processes (0 — by CPU count)')
+    ap.add_argument('--cache-dir', type=str, default=None, help='Folder for per-log results')
+    ap.add_argument('paths', type=str, nargs='+')
+    args = ap.parse_args()
+
+    sa_ = StraceAnalyzer(args.cache_dir, args.jobs or os.cpu_count() or 1)
+    for name_ in sorted(sa_.filenames(args.paths)):
+        print(name_)
+    print(f'{sa_.analysed} logs analysed, {sa_.cached} from cache', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
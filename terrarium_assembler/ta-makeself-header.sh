@@ -307,9 +307,9 @@ MS_Check()
 MS_Decompress()
 {
     if test x"\$decrypt_cmd" != x""; then
-        { eval "\$decrypt_cmd" || echo " ... Decryption failed." >&2; } | eval "$GUNZIP_CMD"
+        { eval "\$decrypt_cmd" || echo " ... Decryption failed." >&2; } | eval "{{ makeself_unpack_cmd | default('$GUNZIP_CMD') }}"
     else
-        eval "$GUNZIP_CMD"
+        eval "{{ makeself_unpack_cmd | default('$GUNZIP_CMD') }}"
     fi
     
     if test \$? -ne 0; then
@@ -543,6 +543,15 @@ if test x"$NEED_ROOT" = xy -a \`id -u\` -ne 0; then
 	exit 1	
 fi
 
+{% if delta_from %}
+installed_release=\`cat "{{install_dir}}/ta-release.txt" 2>/dev/null\`
+if test x"\$installed_release" != x"{{delta_from}}" -a x"\$installed_release" != x"{{delta_to}}"; then
+	echo "This is update of {{install_dir}} from release {{delta_from}} to {{delta_to}}," >&2
+	echo "but installed release is «\$installed_release», use full installer" >&2
+	exit 1
+fi
+{% endif %}
+
 if test x"\$copy" \!= xphase2; then
     MS_PrintLicense
 fi
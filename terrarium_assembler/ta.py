@@ -12,6 +12,7 @@ import dataclasses as dc
 import datetime
 import hashlib
 import time
+import functools
 import glob
 import csv
 import jinja2.exceptions
@@ -57,12 +58,29 @@ from dateutil.relativedelta import relativedelta
 # новая ветка
 from .nuitkaprofiles import *
 from .python_rebuild_profiles import *
+from .elfcache import PatchedElfCache
+from .regexset import RegexSet
+from .packmanifest import PackManifest
+from .filetypes import FileTypes
+from .stagerunner import StageTask, StageRunner
+from .stagegraph import StageGraph
+from .rpmindex import RpmFileIndex, build_rpm_index
+from .buildmanifest import BuildManifest, convert_yaml
+from .straceparse import StraceAnalyzer
+from .minimize import Minimizer
+from .elfdeps import ElfDeps, elf_closure
+from .dedup import Deduplicator, DEDUP_MODES
+from .packsched import PackagingScheduler, hardlink_tree, stream_with_md5
+from .gitcheckout import GitCheckout, RepoPool
+from .buildsched import BuildScheduler, BuildTarget, available_memory_gb
+from .delta import DeltaPackage, release_manifest, save_manifest, load_manifest, previous_manifest, RELEASE_FILE, MANIFEST_SUFFIX, DELTA_SCRIPT
 
 
 from pytictoc import TicToc
 t = TicToc()
 
 ROW_SPLIT = ' ||| '
+MAKESELF_CODECS = ['gzip', 'pbzip2', 'zstd']
 
 
 class SourceType(Enum):
@@ -97,6 +115,21 @@ class PackageFileRow:
     filename: str
 
 
+@dc.dataclass
+class PackOp:
+    '''
+    Planned operation of putting one file into out build.
+    '''
+    kind: str         # 'copy', 'patch_binary', 'patch_sharedlib' or 'none' (only register)
+    source: str       # file as listed in RPM or folder
+    path: str         # real path to read from (toolbox path)
+    relname: str      # destination relative to out
+    rpath: str = ''   # RUNPATH for patched ELF
+    source_type: Optional[SourceType] = None  # if set, register in FileSource
+    source_name: str = ''   # package/folder/wheel for FileSource registration
+    bin_source: str = ''    # source for bin_files_sources
+
+
 # @dc.dataclass
 @dataclass(config=DCConfig)
 class FileInBuild:
@@ -179,29 +212,26 @@ class BinRegexps:
         if 'ignore' in self.need_exclude:
             add_listrex2dict(self.need_exclude.ignore, self.ignore_re)
 
+        # Every category is matched by one combined regexp,
+        # which still tells what pattern matched (for need_exclude_re counters).
+        self.just_copy_set = RegexSet(self.just_copy_re)
+        self.need_patch_set = RegexSet(self.need_patch_re)
+        self.need_exclude_set = RegexSet(self.need_exclude_re.keys())
+        self.ignore_set = RegexSet(self.ignore_re.keys())
+
     def is_just_copy(self, f):
-        for re_ in self.just_copy_re:
-            if re_.match(f):
-                return True
-        return False
+        return self.just_copy_set.match_index(f) is not None
 
     def is_need_patch(self, f):
-        for re_ in self.need_patch_re:
-            if re_.match(f):
-                return True
-        return False
+        return self.need_patch_set.match_index(f) is not None
 
     def is_need_exclude(self, f):
-        for re_ in self.ignore_re:
-            if re_.match(f):
-                return False
-        for re_ in self.need_exclude_re:
-            if re_.match(f):
-                cnt_ = self.need_exclude_re[re_]
-                if not cnt_:
-                    cnt = 0
-                self.need_exclude_re[re_] = cnt_ + 1
-                return True
+        if self.ignore_set.match_index(f) is not None:
+            return False
+        re_ = self.need_exclude_set.match(f)
+        if re_ is not None:
+            self.need_exclude_re[re_] += 1
+            return True
         return False
 
     def is_needed(self, f):
@@ -285,6 +315,7 @@ class GoPackages:
     '''
     build: GoPackagesSpec
     terra: GoPackagesSpec
+    cache_gb: float = 10  # size limit of persistent Go build cache
 
     def __post_init__(self):
         '''
@@ -428,6 +459,7 @@ class TestsSpec:
     scripts: Optional[Dict] = dc.field(default_factory=dict)
     runs_before_compile: Optional[List] = dc.field(default_factory=list)
     runs_after_compile: Optional[List] = dc.field(default_factory=list)
+    tracer: Optional[str] = 'strace'  # or 'fanotify'
 
     def __post_init__(self):
         if not self.profiles:
@@ -447,6 +479,7 @@ class TerrariumAssembler:
         self.root_dir = None
         self.toolbox_mode = True
         self.build_mode = False
+        self.stage_tasks = {}
 
         self.container_info = None
         self.container_path = None
@@ -458,6 +491,9 @@ class TerrariumAssembler:
 
         self.src_tar_filename = 'in-src.tar'
         self.report_binary_files_path = 'reports/binary-files-report.txt'
+        self.stage_run_report_path = 'reports/stage-run-report.json'
+        self.stage_logs_dir = 'reports/stage-logs'
+        self.folderhash_index_dir = 'tmp/folderhash'
         self.not_need_packages_to_rebuild_in_terra_path = 'reports/not-need-packages-to-rebuild-in-terra.txt'
         self.not_linked_python_packages_path = 'tmp/not-linked-python-packages-path.yml'
         self.file_list_from_terra_rpms = 'tmp/file-list-from-terra-rpms.txt'
@@ -471,6 +507,7 @@ class TerrariumAssembler:
         self.file_list_from_rpms = 'tmp/file-list-from-rpm.txt'
         self.ld_so_path = 'tmp/ld_so_path.txt'
         self.file_package_list_from_rpms = 'tmp/file-package-list-from-rpm.txt'
+        self.rpm_file_index_path = 'tmp/file-package-index.bin'
         self.src_deps_packages = 'tmp/src_deps_packages.txt'
         self.src_deps_packages_main = 'tmp/src_deps_packages_main.txt'
         self.src_deps_packages_add = 'tmp/src_deps_packages_add.txt'
@@ -478,13 +515,24 @@ class TerrariumAssembler:
         self.files_source_path = 'tmp/files-source.yaml'
         self.bin_files_sources_path = 'tmp/bin-files-sources.yaml'
         self.used_files_path = 'tmp/used-files.yaml'
+        self.minimization_report_path = 'reports/minimization-report.yaml'
+        self.checkout_report_path = 'reports/checkout-report.yaml'
+        self.elf_deps_cache_path = 'tmp/elf-deps-cache.json'
         self.files_source_after_minimization_path = 'tmp/files-source-after-minimization.yaml'
         self.bin_files_sources_after_minimization_path = 'tmp/bin-files-sources-after-minimization.yaml'
+        self.build_manifest_path = 'tmp/build-manifest.sqlite'
+        self.strace_cache_dir = 'tmp/strace-cache'
+        self.build_manifest = None
         self.pipdeptree_graph_dot = 'reports/pipdeptree-graph.dot'
         self.pipdeptree_graph_mw = 'reports/pipdeptree-graph.mw'
         self.pip_list = 'tmp/pip-list.txt'
         self.pip_list_json = 'tmp/pip-list.json'
 
+        self.pack_manifest_path = 'tmp/pack-manifest.json'
+        self.dedup_links_path = 'tmp/dedup-links.json'
+        self.pack_manifest = None
+        self.pack_incremental = False
+        self.pack_done = set()
         self.out_interpreter = "pbin/ld.so"
         self.bin_files_path = "tmp/bin-files.txt"
 
@@ -526,6 +574,13 @@ class TerrariumAssembler:
         # ap.add_argument('--step-to', type=int, default=0, help='Step from')
         ap.add_argument('--steps', type=str, default='', help='Steps like page list or intervals')
         ap.add_argument('--skip-words', type=str, default='', help='Skip steps that contain these words (comma, separated)')
+        ap.add_argument('--incremental', default=False, action='store_true',
+                        help='Incremental packing: touch only files whose source changed since last packing')
+        ap.add_argument('--force', default=False, action='store_true',
+                        help='Run selected stages even if they are up to date')
+        ap.add_argument('--minimize-dry-run', default=False, action='store_true',
+                        help='Only report what minimization would delete (bytes per source package)')
+        ap.add_argument('--jobs', type=int, default=1, help='Number of parallel workers for packing, independent stages etc (0 — number of CPUs)')
         ap.add_argument('specfile', type=str, help='Specification File')
         ap.add_argument('-o', '--override-spec', action='append', help='Override variable from SPEC file', default=[])
 
@@ -542,26 +597,24 @@ class TerrariumAssembler:
             ap.add_argument(f'--{cs_}', default=False, action='store_true', help=f'{desc}')
 
         self.args = args = ap.parse_args()
+        self.jobs = args.jobs
+        if self.jobs <= 0:
+            self.jobs = os.cpu_count() or 1
 
+        self.graph = StageGraph(self.stages_names)
+        self.graph.force = args.force
         if args.steps:
-            for step_ in args.steps.split(','):
-                if '-' in step_:
-                    sfrom, sto = step_.split('-')
-                    for s_ in self.stages_names:
-                        if int(sfrom) <= fname2num(s_) <= int(sto):
-                            setattr(self.args, fname2stage(s_).replace('-','_'), True)
-                else:
-                    for s_ in self.stages_names:
-                        if fname2num(s_) == int(step_):
-                            setattr(self.args, fname2stage(s_).replace('-','_'), True)
-
-
+            try:
+                steps_ = self.graph.resolve_steps(args.steps)
+            except ValueError as ex_:
+                ap.error(str(ex_))
+            for s_ in steps_:
+                setattr(self.args, fname2stage(s_).replace('-','_'), True)
 
         for cs_, filter_ in complex_stages.items():
             if vars(self.args)[cs_.replace('-','_')]:
-                for s_ in self.stages_names:
-                    if filter_(s_):
-                        setattr(self.args, fname2stage(s_).replace('-','_'), True)
+                for s_ in self.graph.select(filter_):
+                    setattr(self.args, fname2stage(s_).replace('-','_'), True)
 
         if args.skip_words:
             for word_ in args.skip_words.split(','):
@@ -584,14 +637,6 @@ sudo sysctl net.ipv4.ip_unprivileged_port_start=0 || true
 
         self.start_dir = self.curdir = os.path.split(specfile_)[0]
 
-        # self.common_cache_dir = Path('/tmp/ta_cache')
-        # self.common_cache_dir.mkdir(exist_ok=True, parents=True)
-        # now_ = time.time()
-        # delete_time = now_ + 3600
-        # for f in self.common_cache_dir.iterdir():
-        #     if f.stat().st_atime > delete_time:
-        #         f.unlink()
-
         os.environ['TERRA_SPECDIR'] = self.start_dir
         self.our_builddir2sourcedesc = {}
         os.chdir(self.curdir)
@@ -670,12 +715,64 @@ sudo sysctl net.ipv4.ip_unprivileged_port_start=0 || true
             self.tests = dacite.from_dict(data_class=TestsSpec, data=spec.tests, config=dacite.Config(cast=[TestProfiles, TestProfileSpec]))
 
 
+        # opt-in: links change layout of «out» and payloads of packages
+        self.dedup_mode = 'none'
+        if 'dedup' in self.spec:
+            self.dedup_mode = self.spec.dedup or 'none'
+            if self.dedup_mode not in DEDUP_MODES:
+                print(f'Unknown dedup mode «{self.dedup_mode}», should be one of {DEDUP_MODES}')
+                sys.exit(1)
+
         self.package_modes = 'iso'
+        # makeself compression: codec (pbzip2 if exists, else gzip), level, zstd long window (log2)
+        self.makeself_codec = None
+        self.makeself_level = None
+        self.makeself_window = 27
+        self.packaging_jobs = None
         if 'packaging' in self.spec:
-            if isinstance(self.spec.packaging, list):
-                self.package_modes = ','.join(self.spec.packaging)
-            if isinstance(self.spec.packaging, str):
-                self.package_modes = self.spec.packaging
+            packaging_ = self.spec.packaging
+            if isinstance(packaging_, dict):
+                if 'codec' in packaging_:
+                    self.makeself_codec = packaging_.codec
+                if 'level' in packaging_:
+                    self.makeself_level = packaging_.level
+                if 'window' in packaging_:
+                    self.makeself_window = packaging_.window
+                if 'jobs' in packaging_:
+                    self.packaging_jobs = packaging_.jobs
+                packaging_ = packaging_.modes if 'modes' in packaging_ else self.package_modes
+            if isinstance(packaging_, list):
+                self.package_modes = ','.join(packaging_)
+            if isinstance(packaging_, str):
+                self.package_modes = packaging_
+            if self.makeself_codec not in [None] + MAKESELF_CODECS:
+                print(f'Unknown packaging codec «{self.makeself_codec}», should be one of {MAKESELF_CODECS}')
+                sys.exit(1)
+
+        # budgets of build scheduler of stage 40: CPUs, memory (default — 80% of available at build time)
+        # and what one target takes, unless target says «cpus»/«memory_gb» itself
+        self.build_cpus = os.cpu_count()
+        self.build_memory_gb = None
+        self.target_cpus = 4
+        self.target_memory_gb = 4
+        if 'build_scheduler' in self.spec:
+            bs_ = self.spec.build_scheduler
+            if 'cpus' in bs_:
+                self.build_cpus = bs_.cpus
+            if 'memory_gb' in bs_:
+                self.build_memory_gb = bs_.memory_gb
+            if 'target_cpus' in bs_:
+                self.target_cpus = bs_.target_cpus
+            if 'target_memory_gb' in bs_:
+                self.target_memory_gb = bs_.target_memory_gb
+        self.build_durations_path = 'tmp/build-durations.json'
+        self.go_build_durations_path = 'tmp/go-build-durations.json'
+        self.rpm_build_durations_path = 'tmp/rpm-build-durations.json'
+        # «-j» of every rpmbuild, rebuilt SPECs share CPU budget of build scheduler
+        self.rpm_target_cpus = 8
+        if 'build_scheduler' in self.spec and 'rpm_target_cpus' in self.spec.build_scheduler:
+            self.rpm_target_cpus = self.spec.build_scheduler.rpm_target_cpus
+        self.build_targets = []
 
         if self.args.stage_make_packages == 'default':
             self.args.stage_make_packages = self.package_modes
@@ -687,7 +784,7 @@ sudo sysctl net.ipv4.ip_unprivileged_port_start=0 || true
 
         self.need_packages = ['patchelf', 'ccache', 'gcc', 'gcc-c++', 'gcc-gfortran', 'chrpath', 'makeself', 'wget',
                             'python3-wheel', 'python3-pip', 'python3-virtualenv', 'e2fsprogs', 'git',
-                            'genisoimage', 'libtool', 'makeself', 'pbzip2', 'jq', 'curl', 'yum', 'nfpm', 'python3-devel',
+                            'genisoimage', 'libtool', 'makeself', 'pbzip2', 'zstd', 'jq', 'curl', 'yum', 'nfpm', 'python3-devel',
                             #WTF, why they not downloaded as deps for python3-devel? Todo!
                             # https://github.com/rpm-software-management/dnf/issues/1998
                             'pyproject-rpm-macros',
@@ -746,6 +843,14 @@ sudo sysctl net.ipv4.ip_unprivileged_port_start=0 || true
         self.fs = FoldersSpec(folders=fs_)
 
         self.in_bin = 'in/bin'
+        # bare mirrors of projects, checkout clones from them
+        self.git_mirrors_path = os.path.join(self.in_bin, 'git-mirrors')
+        self.checkout_jobs = 8
+        # persistent Go caches, builds are incremental between runs and clean checkouts
+        self.go_cache_path = os.path.join(self.in_bin, 'go-cache')
+        self.go_mod_cache_path = os.path.join(self.in_bin, 'go-mod-cache')
+        if 'checkout_jobs' in self.spec:
+            self.checkout_jobs = self.spec.checkout_jobs
         self.src_dir = self.src_path = 'in/src'
         self.tmp_dir = 'tmp'
         if 'src_dir' in spec:
@@ -792,6 +897,7 @@ sudo sysctl net.ipv4.ip_unprivileged_port_start=0 || true
         self.ext_whl_path = in_bin_fld("external_python_wheels_resolved_dependencies")
         self.rebuilded_whl_path = tmp_fld("rebuilded_python_wheels")
         self.strace_files_path = tmp_fld("strace_files")
+        self.used_files_traces_path = tmp_fld("used_files_traces")
         self.pip_source_path = in_bin_fld("pip_sources_to_rebuild")
         # self.ext_pip_path = in_bin_fld("extpip")
         self.base_whl_path = in_bin_fld("external_python_wheels_fixed_versions")
@@ -803,6 +909,7 @@ sudo sysctl net.ipv4.ip_unprivileged_port_start=0 || true
         self.rpmbuild_path =  tmp_fld("rpmbuild")
         self.common_rpmbuild_path =  tmp_fld("common_rpmbuild")
         self.nuitka_compiled_path =  tmp_fld("nuitka_compiled")
+        self.nuitka_modules_path =  tmp_fld("nuitka_modules")
         self.go_compiled_path =  tmp_fld("go_compiled")
         self.rpms_backup_pool = tmp_fld("rpms_backup_pool")
         self.ext_compiled_tar_path = tmp_fld("external_python_wheels_compiled_from_tars")
@@ -825,6 +932,18 @@ sudo sysctl net.ipv4.ip_unprivileged_port_start=0 || true
         if 'optional_bin_patcher' in self.spec and os.path.exists(self.spec.optional_bin_patcher):
             self.optional_bin_patcher = self.spec.optional_bin_patcher
 
+        # Patched ELF files are cached between builds, size in Mb (0 — disable)
+        self.patcher_id = None
+        self.elf_cache = None
+        self.patched_elf_cache_report = 'reports/patched-elf-cache.txt'
+        elf_cache_mb = 8192
+        if 'patched_elf_cache_mb' in self.spec:
+            elf_cache_mb = int(self.spec.patched_elf_cache_mb)
+        if elf_cache_mb > 0:
+            self.elf_cache = PatchedElfCache(tmp_fld("patched_elf_cache"), elf_cache_mb*1024*1024)
+
+        self.file_types = FileTypes(os.path.join(self.curdir, 'tmp/file-types-cache.json'))
+
         rex_ver = re.compile(r"[\d\.]+")
         def strip_rpm_version(p):
             if not '-' in p:
@@ -978,27 +1097,25 @@ fi
                     pl_.append(node['name'])
         return pl_
 
-    def lines2sh(self, name, lines, stage=None, spy=False):
+    def lines2sh(self, name, lines, stage=None, spy=False, inputs=None, outputs=None, inprocess=False, spec=None):
+        '''
+        Write shell script for «name».
+        For stages also register task for stage runner: paths (or pseudo resources like «@container»)
+        that stage reads and writes, and spec fragments it depends on.
+        Undeclared stages are run exclusively and never skipped as up to date.
+        '''
         os.chdir(self.curdir)
 
         fname = fname2shname(name, spy)
         if stage:
+            self.stage_tasks[stage] = StageTask(name=stage, num=fname2num(stage), script=fname,
+                                                inputs=self.abs_resources(inputs),
+                                                outputs=self.abs_resources(outputs),
+                                                spec=spec,
+                                                func=getattr(self, stage) if inprocess else None)
             stage = fname2stage(stage)
 
         if self.build_mode:
-            if stage:
-                option = stage.replace('-', '_')
-                dict_ = vars(self.args)
-                if option in dict_:
-                    if dict_[option]:
-                        print("*"*20)
-                        print("Executing ", fname)
-                        print("*"*20)
-                        res = self.cmd("./" + fname)
-                        failmsg = f'{fname} execution failed!'
-                        if res != 0:
-                            print(failmsg)
-                        assert res==0, 'Execution of stage failed!'
             return
 
         with open(os.path.join(fname), 'w', encoding="utf-8") as lf:
@@ -1056,8 +1173,13 @@ date
         if not self.nuitka_profiles:
             return
 
+        if self.build_mode:
+            if not self.args.stage_build_python_projects:
+                return
+            return self.run_build_targets(self.build_targets)
+
         tmpdir = os.path.relpath(self.nuitka_compiled_path)
-        bfiles = []
+        self.build_targets = []
 
         # First pass
         module2build = {}
@@ -1065,10 +1187,38 @@ date
         referenced_modules = set()
 
         for np_name, np_ in self.nuitka_profiles.profiles.items():
+            if np_.builds:
+                for name_, _ in np_.get_shared_packages():
+                    self.build_targets.append(self.shared_module_target(np_name, np_, name_))
+
+            multidist_ = []
+            if np_.multidist:
+                utilities_ = set(t_.get('outputname', t_.utility)
+                                 for p_ in self.nuitka_profiles.profiles.values() for t_ in p_.builds or [])
+                if np_name in utilities_:
+                    print(f'Nuitka profile «{np_name}» with multidist is named as utility, «{np_name}.ok» would collide with it. Rename profile.')
+                    sys.exit(1)
+                # Nuitka chooses main by name of binary, so renamed utilities are built separately
+                multidist_ = [t_ for t_ in np_.builds or [] if t_.get('outputname', t_.utility) == t_.utility]
+                # flags (f.e. «--nofollow-import-to» of «modules») are for the whole compilation
+                if len(set(np_.get_flags(tmpdir, t_) + ' ' + t_.get('flags', '') for t_ in multidist_)) > 1:
+                    print(f'Utilities of Nuitka profile «{np_name}» differ in «modules», «force_modules» or «flags», they are built separately, not as multidist')
+                    multidist_ = []
+                if len(multidist_) > 1:
+                    self.build_targets.append(self.nuitka_multidist_target(np_name, np_, multidist_, tmpdir))
+                else:
+                    multidist_ = []
+            multidist_ids = set(id(t_) for t_ in multidist_)
+
             for target_ in np_.builds or []:
+                if id(target_) in multidist_ids:
+                    continue
                 srcname = target_.utility
                 outputname = target_.utility
                 nflags = np_.get_flags(tmpdir, target_)
+                shared_flags = np_.get_shared_flags()
+                if shared_flags:
+                    nflags += ' ' + ' '.join(shared_flags)
                 ok_dir = os.path.join(tmpdir, outputname + '.ok')
                 target_dir = os.path.join(tmpdir, outputname + '.dist')
                 build_dir = os.path.join(tmpdir, outputname + '.build')
@@ -1079,6 +1229,10 @@ date
                 flags_ = ''
                 if 'flags' in target_:
                     flags_ = target_.flags
+                cpus_ = target_.cpus if 'cpus' in target_ else self.target_cpus
+                memory_gb_ = target_.memory_gb if 'memory_gb' in target_ else self.target_memory_gb
+                # C compilation of target takes as many CPUs, as scheduler gives it
+                jobs_mod = '' if '--jobs' in f'{nflags} {flags_}' else f'--jobs={cpus_}'
                 lines = []
                 lines.append("""
 export PATH="/usr/lib64/ccache:$PATH"
@@ -1105,7 +1259,7 @@ rm -rf {build_dir}/.svace-dir
 
 
                 lines.append(fR"""
-{self.tb_mod} bash -c 'time nice -19 {svace_prefix} ./.venv/bin/python3 -X utf8 -m nuitka --report={build_dir}/report.xml {nflags} {flags_} {src} 2>&1 > reports/{build_name}.log'
+{self.tb_mod} bash -c 'time nice -19 {svace_prefix} ./.venv/bin/python3 -X utf8 -m nuitka --report={build_dir}/report.xml {jobs_mod} {nflags} {flags_} {src} 2>&1'
 {self.tb_mod} ./.venv/bin/python3 -m pip freeze > {target_dir_}/{build_name}-pip-freeze.txt
 {self.tb_mod} ./.venv/bin/python3 -m pip list > {target_dir_}/{build_name}-pip-list.txt
 mv {target_dir}/{outputname}.bin {target_dir}/{outputname} || true
@@ -1118,38 +1272,12 @@ mv {target_dir}/{outputname}.bin {target_dir}/{outputname} || true
 mv  %(target_dir_)s/%(outputname)s   %(target_dir_)s/%(srcname)s
     """ % vars())
 
-                if "sync" in target_:
-                    ts_ = target_.sync
-                    for dst_ in ts_:
-                        si_ = ts_[dst_]
-                        srcs = []
-                        filtermod = ''
-                        if isinstance(si_, str):
-                            srcs.append(si_)
-                        elif isinstance(si_, dict):
-                            filtermods = []
-                            if "filters" in si_:
-                                filtermods += [
-                                    " --include='*/' "
-                                ]
-
-                                for fil_ in si_.filters:
-                                    filtermods.append(f'--include="{fil_}"')
-
-                                filtermods += [
-                                    "--include='*/'",
-                                    "--exclude='*'"
-                                ]
-
-                            filtermod = ' '.join(filtermods)
-                            for s_ in si_.src:
-                                srcs.append(s_)
-                        for src in srcs:
-                            scmd = f'''
-mkdir -p {target_dir_}/{dst_}
-{self.tb_mod} rsync -ravm {src} {target_dir_}/{dst_} {filtermod}
-                            '''
-                            lines.append(scmd)
+                lines += self.nuitka_sync_lines(target_, target_dir_)
+
+                for name_, _ in np_.get_shared_packages():
+                    lines.append(fR"""
+cp -a {self.shared_module_dir(np_name, name_)}/current/{name_}.*.so {target_dir_}/
+    """)
 
                 lines.append(fR"""
 mv {ok_dir} {ok_dir}.old || true
@@ -1159,7 +1287,8 @@ rm -rf {ok_dir}.old
     """)
 
                 self.lines2sh(build_name, lines)
-                bfiles.append(fname2shname(build_name))
+                self.build_targets.append(BuildTarget(build_name, fname2shname(build_name),
+                                                      cpus_, memory_gb_, group=2))
 
         if 'custombuilds' in self.spec:
             cbs = self.spec.custombuilds
@@ -1170,15 +1299,195 @@ rm -rf {ok_dir}.old
                 self.lines2sh(build_name, [f'''
 {self.tb_mod} bash {fname2shname(build_name_inside_tb)}
                 '''], None)
-                bfiles.insert(0, fname2shname(build_name))
+                # custom builds are finished before Nuitka builds, as before
+                self.build_targets.append(BuildTarget(build_name, fname2shname(build_name),
+                                                      cb.cpus if 'cpus' in cb else self.target_cpus,
+                                                      cb.memory_gb if 'memory_gb' in cb else self.target_memory_gb,
+                                                      group=0))
+
+        # custom builds could do anything, then stage is run alone and always
+        inputs_ = None
+        outputs_ = None
+        if 'custombuilds' not in self.spec:
+            inputs_ = self.projects_dirs(self.pp) + ['@venv', '@container']
+            outputs_ = [self.nuitka_compiled_path, self.nuitka_modules_path, self.build_durations_path]
+        mn_ = get_method_name()
+        self.write_shell_file_for_method(mn_, inputs=inputs_, outputs=outputs_,
+                                         spec=[self.spec.nuitka_profiles, self.spec.get('build_scheduler')])
+        pass
+
+    def nuitka_multidist_target(self, np_name, np_, targets, tmpdir):
+        '''
+        One Nuitka compilation with several «--main» for utilities of profile (multidist):
+        common extensions and libraries are compiled, packed and patched once,
+        every utility is a hardlink to one binary, that runs main by its name.
+        Targets must have the same flags.
+        '''
+        src_dir = os.path.relpath(self.src_dir, start=self.curdir)
+        multidist_dir = os.path.join(tmpdir, np_name + '.multidist')
+        ok_dir = os.path.join(tmpdir, np_name + '.ok')
+        build_dir = os.path.join(tmpdir, np_name + '.build')
+        target_dir_ = os.path.join(tmpdir, np_name + '.dist')
+        first_ = targets[0].utility
+
+        # flags of all targets are the same, it is checked before
+        nflags = np_.get_flags(multidist_dir, targets[0])
+        if 'flags' in targets[0]:
+            nflags += ' ' + targets[0].flags
+        shared_flags = np_.get_shared_flags()
+        if shared_flags:
+            nflags += ' ' + ' '.join(shared_flags)
+        mains_ = ' '.join(f'--main={os.path.join(src_dir, t_.folder, t_.utility)}.py' for t_ in targets)
+        cpus_ = max(t_.cpus if 'cpus' in t_ else self.target_cpus for t_ in targets)
+        memory_gb_ = max(t_.memory_gb if 'memory_gb' in t_ else self.target_memory_gb for t_ in targets)
+        jobs_mod = '' if '--jobs' in nflags else f'--jobs={cpus_}'
+
+        build_name = 'build_multidist_' + np_name
+        shellname = fname2shname(build_name)
+        self.our_builddir2sourcedesc[ok_dir] = f'Компиляция {", ".join(t_.utility for t_ in targets)} (multidist), сборка скриптом {shellname}'
 
         lines = []
-        for b_ in bfiles:
-            lines.append("./" + b_)
+        lines.append(fR"""
+export PATH="/usr/lib64/ccache:$PATH"
+{bashash_ok_folders_strings(ok_dir, ['.venv', src_dir], [nflags, mains_],
+        f"Sources for {build_name} not changed, skipping"
+        )}
+    """)
 
-        mn_ = get_method_name()
-        self.lines2sh(mn_, lines, mn_)
-        pass
+        svace_prefix = ''
+        if self.svace_mod:
+            lines.append(fR"""
+rm -rf {build_dir}/.svace-dir
+            """)
+            svace_prefix = f'{self.svace_path} build --svace-dir {build_dir} '
+            lines.append(f'''
+{self.svace_path} init {build_dir}
+    ''')
+
+        lines.append(fR"""
+mkdir -p {build_dir}
+rm -rf {multidist_dir}
+{self.tb_mod} bash -c 'time nice -19 {svace_prefix} ./.venv/bin/python3 -X utf8 -m nuitka --report={build_dir}/report.xml {jobs_mod} {nflags} {mains_} 2>&1'
+rm -rf {target_dir_}
+mv {multidist_dir}/{first_}.dist {target_dir_}
+mv {target_dir_}/{first_}.bin {target_dir_}/{first_} || true
+{self.tb_mod} ./.venv/bin/python3 -m pip freeze > {target_dir_}/{build_name}-pip-freeze.txt
+{self.tb_mod} ./.venv/bin/python3 -m pip list > {target_dir_}/{build_name}-pip-list.txt
+    """)
+        for t_ in targets[1:]:
+            lines.append(fR"""
+ln -f {target_dir_}/{first_} {target_dir_}/{t_.utility}
+    """)
+        for t_ in targets:
+            lines += self.nuitka_sync_lines(t_, target_dir_)
+
+        for name_, _ in np_.get_shared_packages():
+            lines.append(fR"""
+cp -a {self.shared_module_dir(np_name, name_)}/current/{name_}.*.so {target_dir_}/
+    """)
+
+        lines.append(fR"""
+mv {ok_dir} {ok_dir}.old || true
+mv {target_dir_} {ok_dir}
+rm -rf {ok_dir}.old
+{save_state_hash(ok_dir)}
+    """)
+        self.fs.folders.append(ok_dir)
+        self.lines2sh(build_name, lines)
+        return BuildTarget(build_name, shellname, cpus_, memory_gb_, group=2)
+
+    def nuitka_sync_lines(self, target_, target_dir_):
+        '''
+        Lines, that sync additional folders («sync» of Nuitka target) into dist of target.
+        '''
+        lines = []
+        if "sync" in target_:
+            ts_ = target_.sync
+            for dst_ in ts_:
+                si_ = ts_[dst_]
+                srcs = []
+                filtermod = ''
+                if isinstance(si_, str):
+                    srcs.append(si_)
+                elif isinstance(si_, dict):
+                    filtermods = []
+                    if "filters" in si_:
+                        filtermods += [
+                            " --include='*/' "
+                        ]
+
+                        for fil_ in si_.filters:
+                            filtermods.append(f'--include="{fil_}"')
+
+                        filtermods += [
+                            "--include='*/'",
+                            "--exclude='*'"
+                        ]
+
+                    filtermod = ' '.join(filtermods)
+                    for s_ in si_.src:
+                        srcs.append(s_)
+                for src in srcs:
+                    scmd = f'''
+mkdir -p {target_dir_}/{dst_}
+{self.tb_mod} rsync -ravm {src} {target_dir_}/{dst_} {filtermod}
+                    '''
+                    lines.append(scmd)
+        return lines
+
+    def shared_module_dir(self, np_name, name_):
+        return os.path.join(os.path.relpath(self.nuitka_modules_path, start=self.curdir), np_name, name_)
+
+    def shared_module_target(self, np_name, np_, name_):
+        '''
+        Script, that compiles shared package of Nuitka profile as module once:
+        result is cached by (hash of package sources, Nuitka version, flags),
+        «current» points to the result for sources in «.venv».
+        Only packages (one folder) can be shared, not single-file modules.
+        '''
+        module_dir = self.shared_module_dir(np_name, name_)
+        mflags = ' '.join(np_.get_module_flags())
+        build_name = f'build_module_{np_name}_{name_}'
+        self.lines2sh(build_name, [fR"""
+export PATH="/usr/lib64/ccache:$PATH"
+PKG_DIR=$({self.tb_mod} ./.venv/bin/python3 -c "import importlib.util, sys; s_ = importlib.util.find_spec('{name_}'); l_ = list(s_.submodule_search_locations or []) if s_ else []; print(l_[0]) if len(l_) == 1 else sys.exit('Shared package {name_} of Nuitka profile {np_name} is not a package in one folder (single-file module, namespace package in several folders or not installed)')") || exit 1
+HASH_SRC=`{sys.executable} -m terrarium_assembler.folderhash --stat --exclude __pycache__ "$PKG_DIR"`
+NUITKA_VERSION=$({self.tb_mod} ./.venv/bin/python3 -m nuitka --version | tr '\n' ' ')
+# «--jobs» does not change result, so it is not in the key
+KEY=$(echo "$HASH_SRC $NUITKA_VERSION {mflags}" | md5sum | cut -d' ' -f1)
+mkdir -p {module_dir}
+if [ -f "{module_dir}/$KEY/ok" ]; then
+    echo "Module {name_} for {np_name} is already compiled ($KEY)"
+else
+    rm -rf {module_dir}/$KEY.tmp
+    mkdir -p {module_dir}/$KEY.tmp
+    {self.tb_mod} bash -c "time nice -19 ./.venv/bin/python3 -X utf8 -m nuitka --module $PKG_DIR --include-package={name_} --output-dir={module_dir}/$KEY.tmp --jobs={self.target_cpus} {mflags} 2>&1" || exit 1
+    rm -rf {module_dir}/$KEY.tmp/*.build
+    touch {module_dir}/$KEY.tmp/ok
+    rm -rf {module_dir}/$KEY
+    mv {module_dir}/$KEY.tmp {module_dir}/$KEY
+fi
+ln -sfn $KEY {module_dir}/current
+"""])
+        return BuildTarget(build_name, fname2shname(build_name), self.target_cpus, self.target_memory_gb, group=1)
+
+    def run_build_targets(self, targets):
+        '''
+        Build targets of stage 40 concurrently within CPU and memory budgets.
+        '''
+        memory_gb_ = self.build_memory_gb
+        if memory_gb_ is None:
+            available_ = available_memory_gb()
+            memory_gb_ = round(available_ * 0.8, 1) if available_ else None
+        sched_ = BuildScheduler(self.build_cpus, memory_gb_,
+                                os.path.join(self.curdir, self.build_durations_path),
+                                os.path.join(self.curdir, 'reports'), cwd=self.curdir)
+        results_ = sched_.run(targets)
+        metrics_ = {'cpus': sched_.cpus, 'memory_gb': memory_gb_, 'targets': results_}
+        failed_ = [name_ for name_, res_ in results_.items() if res_['exit_code'] != 0]
+        if failed_:
+            raise Exception(f'Build of {", ".join(failed_)} failed, see reports/<target>.log')
+        return metrics_
 
     def stage_41_download_go(self):
         '''
@@ -1202,14 +1511,21 @@ d="$(dirname "$x")"
                     path_to_dir_, start=self.curdir)
                 outputname = os.path.split(path_to_dir_)[-1]
 # {self.tb_mod} bash -c "GOPATH=$d/tmp/go go mod download"
+                # projects are vendored concurrently, modules are downloaded once to shared GOMODCACHE
                 lines.append(fR"""
-pushd {path_to_dir__}
-{self.tb_mod} bash -c "GOPATH=$d/tmp/go go mod vendor"
-popd
+(cd {path_to_dir__} && {self.tb_mod} bash -c "GOPATH=$d/tmp/go GOMODCACHE=$d/{self.go_mod_cache_path} go mod vendor") &
+pids="$pids $!"
     """)
 
+        lines.append(fR"""
+for pid in $pids; do
+    wait $pid
+done
+""")
         mn_ = get_method_name()
-        self.lines2sh(mn_, lines, mn_)
+        self.lines2sh(mn_, lines, mn_,
+                      inputs=['@container'],
+                      outputs=self.projects_dirs(self.gp) + ['tmp/go', self.go_mod_cache_path])
         pass
 
     def stage_42_build_go(self):
@@ -1221,6 +1537,7 @@ popd
 
         # tmpdir = os.path.join(self.curdir, "tmp/ta")
         bfiles = []
+        build_logs = []
 
         # First pass
         module2build = {}
@@ -1251,45 +1568,72 @@ popd
                 log_dir_ = os.path.relpath(self.curdir, start=path_to_dir_)
                 lines = []
                 build_name = 'build_' + outputname
+                target_dir_rel = os.path.relpath(target_dir, start=self.curdir)
+                svace_ = self.svace_mod and not ('svace' in td_ and not td_.svace)
+                build_flags = f"-p {self.target_cpus} -ldflags='-linkmode=internal -r'"
 # {self.tb_mod} bash -c "GOPATH=$d/tmp/go go mod download"
                 lines.append(fR"""
 x="$(readlink -f "$0")"
 d="$(dirname "$x")"
+""")
+                if not svace_:
+                    lines.append(fR"""
+{bashash_ok_folders_strings(target_dir_rel, [path_to_dir__], [env_mod, target_, build_flags],
+        f"Sources for {build_name} not changed, skipping"
+        )}
+""")
+                lines.append(fR"""
 pushd {path_to_dir__}
 """)
 
                 svace_prefix = ''
-                if self.svace_mod and not ('svace' in td_ and not td_.svace):
+                if svace_:
                     svace_dir_ = os.path.relpath(Path(self.curdir) / self.svace_path, start=path_to_dir_)
                     lines.append(fR"""
 rm -rf .svace-dir || true
 rm -rf {target_dir_}/*
                     """)
+                    # svace has to see all compilations, but shared build cache is kept: «-a» instead of «go clean -cache»
                     svace_prefix = f'{svace_dir_} build  '
+                    build_flags = '-a ' + build_flags
                     lines.append(f'''
 {svace_dir_} init
-{self.tb_mod} go clean -cache
     ''')
 
 # {self.tb_mod} bash -c "GOPATH=$d/tmp/go go mod download"
                 lines.append(fR"""
-{self.tb_mod} bash -c "GOPATH=$d/tmp/go {env_mod} {svace_prefix} go build -ldflags='-linkmode=internal -r' -o {target_dir_}/  {target_}  >{log_dir_}/{build_name}.log 2>&1 "
+{self.tb_mod} bash -c "GOPATH=$d/tmp/go GOCACHE=$d/{self.go_cache_path} GOMODCACHE=$d/{self.go_mod_cache_path} {env_mod} {svace_prefix} go build {build_flags} -o {target_dir_}/  {target_}  >{log_dir_}/{build_name}.log 2>&1 "
 popd
     """)
+                if not svace_:
+                    lines.append(fR"""
+{save_state_hash(target_dir_rel)}
+""")
                 self.fs.folders.append(target_dir)
 
-                target_dir_rel = os.path.relpath(target_dir, start=self.curdir)
                 self.our_builddir2sourcedesc[target_dir_rel] = f'Компиляция {path_to_dir_}, сборка скриптом {build_name}'
 
                 self.lines2sh(build_name, lines, None)
-                bfiles.append(fname2shname(build_name))
-
-        lines = []
-        for b_ in bfiles:
-            lines.append("./" + b_)
-
+                bfiles.append(f'{build_name}:{fname2shname(build_name)}:{self.target_cpus}:{self.target_memory_gb}')
+                build_logs.append(build_name + '.log')
+
+        # projects are built concurrently within CPU and memory budgets, longest first
+        memory_mod = f'--memory-gb {self.build_memory_gb}' if self.build_memory_gb else ''
+        lines = [f'''
+mkdir -p {self.go_cache_path} {self.go_mod_cache_path}
+{sys.executable} -m terrarium_assembler.buildsched --cpus {self.build_cpus} {memory_mod} --history {self.go_build_durations_path} --logs-dir {self.stage_logs_dir} {' '.join(bfiles)}
+{sys.executable} -m terrarium_assembler.gobuild --max-gb {self.gp.cache_gb} {self.go_cache_path}
+''']
+
+        go_dirs_ = self.projects_dirs(self.gp)
+        outputs_ = [self.go_compiled_path, self.go_cache_path, self.go_build_durations_path] + build_logs
+        if self.svace_mod:
+            # svace keeps its data inside projects
+            outputs_ += go_dirs_
         mn_ = get_method_name()
-        self.lines2sh(mn_, lines, mn_)
+        self.lines2sh(mn_, lines, mn_,
+                      inputs=go_dirs_ + ['tmp/go', self.go_mod_cache_path, '@container'],
+                      outputs=outputs_)
         pass
 
 
@@ -1630,6 +1974,18 @@ popd
 
         return res_
 
+    def default_relname(self, what_):
+        '''
+        Where «add» puts file if destination is not given.
+        '''
+        what = self.toolbox_path(what_)
+        if not os.path.exists(what):
+            what = what_
+        to_ = what
+        if to_.startswith('/'):
+            to_ = to_[1:]
+        return to_
+
     def add(self, what_, to_=None, recursive=True):
         what = self.toolbox_path(what_)
         if not os.path.exists(what):
@@ -1637,9 +1993,7 @@ popd
 
         try:
             if not to_:
-                to_ = what
-                if to_.startswith('/'):
-                    to_ = to_[1:]
+                to_ = self.default_relname(what_)
 
             dir_, _ = os.path.split(to_)
             Path(os.path.join(self.root_dir, dir_)).mkdir(
@@ -1672,22 +2026,40 @@ popd
             projects_ += self.gp.projects()
         return projects_
 
-    def fix_elf(self, path, libpath=None):
+    def patcher_identity(self):
         '''
-        Patch ELF file
+        What patches ELF files: patchelf version and optional patcher, for keys of patched ELF cache.
         '''
-        # key_ = hashfile(path, hexdigest=True)
-        # cached_path = self.common_cache_dir / key_
-        # if cached_path.exists():
-        #     return cached_path.as_posix()
+        if self.patcher_id is None:
+            ids_ = [f'disable_patchelf={self.disable_patchelf}']
+            try:
+                ids_.append(subprocess.check_output(['patchelf', '--version'], universal_newlines=True).strip())
+            except Exception:
+                ids_.append('no patchelf')
+            if self.optional_bin_patcher:
+                ids_.append(self.optional_bin_patcher + ':' + file_digest(self.optional_bin_patcher))
+            self.patcher_id = ' '.join(ids_)
+        return self.patcher_id
 
-        # patched_elf = cached_path.as_posix()
+    def fix_elf(self, path, libpath=None):
+        '''
+        Patch ELF file (or take already patched one from the patched ELF cache)
+        '''
         fd_, patched_elf = mkstemp(dir=self.patching_dir)
+        key_ = None
+        if self.elf_cache:
+            key_ = self.elf_cache.key(path, libpath, self.patcher_identity())
+            if self.elf_cache.get(key_, patched_elf):
+                os.close(fd_)
+                return patched_elf
+
         shutil.copy2(path, patched_elf)
 
         orig_perm = stat.S_IMODE(os.lstat(path).st_mode)
         os.chmod(patched_elf, orig_perm | stat.S_IWUSR)
 
+        # unpatched file is not cached, so patching is retried next time
+        patched_ok = True
         if libpath:
             try:
                 if not self.disable_patchelf:
@@ -1697,20 +2069,36 @@ popd
                                         patched_elf])
             except Exception as ex_:
                 print("Cannot patch ", path)
-                pass
+                patched_ok = False
 
         os.close(fd_)
         os.chmod(patched_elf, orig_perm)
 
         self.optional_patch_binary(patched_elf)
-        # shutil.move(patched_elf, cached_path)
-        # self.cache.put_file(key_, open(patched_elf, 'rb'))
+        if key_ and patched_ok:
+            self.elf_cache.put(key_, patched_elf)
         return patched_elf
 
 
-    def process_binary(self, binpath):
+    def install_interpreter(self):
         '''
-        Фиксим бинарник.
+        Put patched interpreter (ld.so) into pbin, only once.
+        '''
+        if self.interpreter:
+            return
+        with open(self.ld_so_path, 'r') as lf:
+            self.interpreter = lf.read().strip()
+        patched_interpreter = self.fix_elf(self.toolbox_path(self.interpreter))
+        out_interpreter_ = os.path.join(self.root_dir, self.out_interpreter)
+        if self.pack_incremental and os.path.lexists(out_interpreter_):
+            os.unlink(out_interpreter_)
+        self.add(patched_interpreter, self.out_interpreter)
+        self.bin_files.add( self.out_interpreter )
+        os.remove(patched_interpreter)
+
+    def plan_binary(self, binpath, m=None):
+        '''
+        Планируем фикс бинарника: он кладется в pbin с исправленным RUNPATH.
         '''
         tb_binpath = self.toolbox_path(binpath)
         pyname = os.path.basename(binpath)
@@ -1718,49 +2106,144 @@ popd
 
         for wtf_ in ['libldap']:
             if wtf_ in binpath:
-                return binpath
+                return PackOp('none', binpath, tb_binpath, new_path_for_binary)
 
-        # m = magic.detect_from_filename(binpath)
-        m = fucking_magic(tb_binpath)
+        if m is None:
+            m = self.file_magic(tb_binpath)
         if m in ['inode/symlink', 'text/plain']:
-            return new_path_for_binary
+            return PackOp('none', binpath, tb_binpath, new_path_for_binary)
 
         if not 'ELF' in m:
-            return new_path_for_binary
+            return PackOp('none', binpath, tb_binpath, new_path_for_binary)
 
-        try:
-            patched_binary = self.fix_elf(tb_binpath, '$ORIGIN/../lib64/')
-        except Exception as ex_:
-            print("Mime type ", m)
-            print("Cannot fix", binpath)
-            raise ex_
+        return PackOp('patch_binary', binpath, tb_binpath, new_path_for_binary,
+                      rpath='$ORIGIN/../lib64/', bin_source=binpath)
 
-        if not self.interpreter:
-            with open(self.ld_so_path, 'r') as lf:
-                self.interpreter = lf.read().strip()
-            patched_interpreter = self.fix_elf(self.toolbox_path(self.interpreter))
-            # patched_interpreter = self.fix_elf(self.interpreter)
-            self.add(patched_interpreter, self.out_interpreter)
-            self.bin_files.add( self.out_interpreter )
-
-        self.add(patched_binary, new_path_for_binary)
-        self.bin_files.add( new_path_for_binary )
-        self.bin_files_sources[new_path_for_binary] = binpath
-        if 'libgcc_s.so.1' in new_path_for_binary:
-            wtf = 1
-        os.remove(patched_binary)
-        return new_path_for_binary
+    def process_binary(self, binpath):
+        '''
+        Фиксим бинарник.
+        '''
+        op = self.plan_binary(binpath)
+        self.run_pack_ops([op])
+        return op.relname
 
     def fix_sharedlib(self, binpath, targetpath):
         relpath = os.path.join(os.path.relpath("lib64", targetpath), "lib64")
         patched_binary = self.fix_elf(binpath, '$ORIGIN/' + relpath)
         self.add(patched_binary, targetpath)
-        self.bin_files.add( targetpath )
         if 'libgcc_s.so.1' in targetpath:
             wtf = 1
         os.remove(patched_binary)
         pass
 
+    def file_magic(self, path):
+        '''
+        Type of file, when we need to know only is it ELF (shared) or symlink.
+        '''
+        try:
+            return self.file_types.describe(path, elf_only=True)
+        except Exception as ex_:
+            print("Cannot detect Magic for ", path)
+            raise ex_
+
+    def apply_pack_op(self, op):
+        '''
+        Perform one planned PackOp, returns relname in out (or None).
+        Called from worker threads, so touches only files of this op.
+        '''
+        if op.kind == 'none':
+            return op.relname
+        if op.kind == 'copy':
+            return self.add(op.source, op.relname, recursive=False)
+        if op.kind == 'patch_binary':
+            try:
+                patched_binary = self.fix_elf(op.path, op.rpath)
+            except Exception as ex_:
+                print("Cannot fix", op.source)
+                raise ex_
+            self.add(patched_binary, op.relname)
+            if 'libgcc_s.so.1' in op.relname:
+                wtf = 1
+            os.remove(patched_binary)
+            return op.relname
+        if op.kind == 'patch_sharedlib':
+            try:
+                self.fix_sharedlib(op.path, op.relname)
+            except Exception as ex_:
+                print('Cannot optionally patch', op.path)
+                raise ex_
+            return op.relname
+        assert False, f'Unknown pack operation «{op.kind}»'
+
+    def pack_transform(self, op):
+        '''
+        What is done with the file while packing, for pack manifest.
+        '''
+        if op.kind in ['patch_binary', 'patch_sharedlib']:
+            return f'{op.kind}:{op.rpath}:{self.patcher_identity()}'
+        return op.kind
+
+    def apply_pack_op_incremental(self, op):
+        '''
+        Perform PackOp, but keep file from previous packing if its source was not changed.
+        Returns relname and pack manifest entry.
+        '''
+        if op.kind == 'none' or op.relname in self.pack_done:
+            return self.apply_pack_op(op), None
+        entry_ = self.pack_manifest.entry(op, self.pack_transform(op))
+        dst_ = os.path.join(self.root_dir, op.relname)
+        if self.pack_incremental:
+            if self.pack_manifest.unchanged(op.relname, entry_, dst_):
+                return op.relname, entry_
+            if os.path.lexists(dst_) and not os.path.isdir(dst_):
+                os.unlink(dst_)
+        # hash in worker, not in serial record
+        return self.apply_pack_op(op), self.pack_manifest.fill_hash(entry_)
+
+    def run_pack_ops(self, ops, file_source_table=None):
+        '''
+        Perform planned operations on pool of --jobs workers.
+        Only first operation for each destination is performed (like sequential copying did),
+        all bookkeeping is merged after that in the order of plan.
+        '''
+        if any(op.kind == 'patch_binary' for op in ops):
+            self.install_interpreter()
+
+        first_ops = {}
+        for op in ops:
+            if op.relname not in first_ops:
+                first_ops[op.relname] = op
+        todo_ = [op for op in ops if first_ops[op.relname] is op]
+        if self.pack_manifest is None:
+            results_ = [(relname, None) for relname in map_ordered(self.apply_pack_op, todo_, self.jobs)]
+        else:
+            results_ = map_ordered(self.apply_pack_op_incremental, todo_, self.jobs)
+        done_ = {}
+        for op, (relname, entry_) in zip(todo_, results_):
+            done_[id(op)] = relname
+            if relname and entry_:
+                self.pack_manifest.record(relname, entry_)
+            if relname:
+                self.pack_done.add(relname)
+
+        relnames = []
+        for op in ops:
+            relname = done_.get(id(first_ops[op.relname]))
+            relnames.append(relname)
+            if not relname or relname.startswith('/'):
+                continue
+            if op.kind in ['patch_binary', 'patch_sharedlib']:
+                self.bin_files.add(relname)
+                self.bin_files_sources[relname] = op.bin_source
+            if op.source_type and file_source_table is not None:
+                fib_ = FileInBuild(relname, op.source_type, op.source_name, op.source)
+                file_source_table[relname] = fib_
+                if self.build_manifest:
+                    self.build_manifest.add_file(relname, fib_.source_type, fib_.source, fib_.source_path)
+            if self.build_manifest and op.kind in ['patch_binary', 'patch_sharedlib']:
+                self.build_manifest.add_bin_source(relname, op.bin_source)
+        return relnames
+
     def optional_patch_binary(self, f):
         if self.optional_bin_patcher:
             try:
@@ -1776,58 +2259,65 @@ popd
             git_url, git_branch, path_to_dir_, _ = self.explode_pp_node(td_)
             yield git_url, git_branch, path_to_dir_
 
+    def existing_source_paths(self):
+        '''
+        Existing folders of all sources, each once (project can be both in «build» and «terra»),
+        so two workers never run git in the same repository.
+        '''
+        paths_ = []
+        already_seen = set()
+        for _, _, path_to_dir_ in self.get_all_sources():
+            path_ = os.path.abspath(path_to_dir_)
+            if path_ not in already_seen and os.path.exists(path_):
+                already_seen.add(path_)
+                paths_.append(path_to_dir_)
+        return paths_
+
     def folder_command(self):
         '''
-            Just checking out sources.
-            This stage should be done when we have authorization to check them out.
+            Run command in all project folders (in parallel, «checkout_jobs» at once).
         '''
         if not self.pp:
             return
 
-        curdir = os.getcwd()
         args = self.args
-        in_src = os.path.relpath(self.src_dir, start=self.curdir)
-        # for td_ in self.projects() + self.spec.templates_dirs:
-        #     git_url, git_branch, path_to_dir_, _ = self.explode_pp_node(td_)
+        paths_ = self.existing_source_paths()
 
-        for git_url, git_branch, path_to_dir_ in self.get_all_sources():
-            os.chdir(curdir)
-            if os.path.exists(path_to_dir_):
-                os.chdir(path_to_dir_)
-                print('*'*10 + f' Git «{args.folder_command}» for {git_url} ')
-                scmd = f'''{args.folder_command}'''
-                os.system(scmd)
+        def command(pool_, path_, log_):
+            code_, _ = pool_.sh(args.folder_command, path_, log_)
+            return 'ok' if code_ == 0 else f'exit {code_}'
+
+        RepoPool(self.checkout_jobs).run(command, paths_, f'«{args.folder_command}» in')
         pass
 
     def git_sync(self):
         '''
-         Performing lazy git sync all project folders
+         Performing lazy git sync all project folders (in parallel, «checkout_jobs» at once)
          * get last git commit message (usially link to issue)
          * commit with same message
          * pull-merge (without rebase)
          * push to same branch
         '''
-        curdir = os.getcwd()
-        args = self.args
-        in_src = os.path.relpath(self.src_dir, start=self.curdir)
-        # for td_ in self.projects() + self.spec.templates_dirs:
-        #     git_url, git_branch, path_to_dir_, _ = self.explode_pp_node(td_)
-
-        for git_url, git_branch, path_to_dir_ in self.get_all_sources():
-            os.chdir(curdir)
-            if os.path.exists(path_to_dir_):
-                os.chdir(path_to_dir_)
-                print(f'''\nSyncing project "{path_to_dir_}"''')
-                last_commit_message = subprocess.check_output(
-                    "git log -1 --pretty=%B", shell=True).decode("utf-8")
-                last_commit_message = last_commit_message.strip('"')
-                last_commit_message = last_commit_message.strip("'")
-                if not last_commit_message.startswith("Merge branch"):
-                    os.system(f'''git commit -am "{last_commit_message}" ''')
-                os.system(f'''git pull --rebase=false ''')
-                if 'out' in self.args.git_sync:
-                    os.system(f'''git push origin ''')
-                os.chdir(self.curdir)
+        paths_ = self.existing_source_paths()
+        push_ = 'out' in self.args.git_sync
+
+        def sync(pool_, path_, log_):
+            code_, last_commit_message = pool_.sh("git log -1 --pretty=%B", path_, log_)
+            if code_ != 0:
+                return 'no git log'
+            last_commit_message = last_commit_message.strip().strip('"').strip("'")
+            if not last_commit_message.startswith("Merge branch"):
+                pool_.sh(f'''git commit -am "{last_commit_message}" ''', path_, log_)
+            code_, _ = pool_.sh(f'''git pull --rebase=false ''', path_, log_)
+            if code_ != 0:
+                return 'pull failed'
+            if push_:
+                code_, _ = pool_.sh(f'''git push origin ''', path_, log_)
+                if code_ != 0:
+                    return 'push failed'
+            return 'ok'
+
+        RepoPool(self.checkout_jobs).run(sync, paths_, 'Syncing project')
         pass
 
     def stage_23_checkout_sources(self):
@@ -1837,74 +2327,42 @@ popd
         if not self.pp:
             return
 
-        args = self.args
-        lines = []
-        lines2 = []
+        if not self.build_mode:
+            # always run (to pull new commits), but do not touch build container
+            mn_ = get_method_name()
+            self.write_shell_file_for_method(mn_, outputs=[self.src_dir])
+            return
+
+        if not self.args.stage_checkout_sources:
+            return
+
+        os.chdir(self.curdir)
         in_src = os.path.relpath(self.src_dir, start=self.curdir)
-        # lines.add("rm -rf %s " % in_src)
-        lines.append(f"""
-mkdir -p tmp/snaphots-src
-snapshotdir=$(date +"tmp/snaphots-src/snapshot-src-before-%Y-%m-%d-%H-%M-%S")
-mv {self.src_dir} $snapshotdir
-rm -f {self.src_dir}/{self.src_tar_filename} || true
-mkdir -p {in_src}
-""")
+        snapshot_dir = os.path.join('tmp/snaphots-src', datetime.datetime.now().strftime('snapshot-src-before-%Y-%m-%d-%H-%M-%S'))
+        mkdir_p('tmp/snaphots-src')
+        if os.path.exists(self.src_dir):
+            shutil.move(self.src_dir, snapshot_dir)
+        mkdir_p(in_src)
+
         already_checkouted = set()
+        projects_ = []
         for td_ in self.projects() + self.spec.templates_dirs:
             git_url, git_branch, path_to_dir_, _ = self.explode_pp_node(td_)
             if path_to_dir_ not in already_checkouted:
-                probably_package_name = os.path.split(path_to_dir_)[-1]
                 already_checkouted.add(path_to_dir_)
-                path_to_dir = os.path.relpath(path_to_dir_, start=self.curdir)
-                newpath = path_to_dir + '.new'
-                # lines.append('rm -rf "%(newpath)s"' % vars())
-                # scmd = 'git --git-dir=/dev/null clone --single-branch --branch %(git_branch)s  --depth=1 %(git_url)s %(newpath)s ' % vars()
-                scmd = f'''
-git --git-dir=/dev/null clone --branch {git_branch} {git_url} {newpath}
-pushd {newpath}
-git checkout {git_branch}
-git config core.fileMode false
-git config core.autocrlf input
-git lfs install
-git lfs pull
-popd
-mv "{newpath}" "{path_to_dir}" || true
-'''
-                lines.append(scmd)
+                projects_.append((git_url, git_branch, os.path.join(self.curdir, path_to_dir_)))
 
-#                 lines2.append(f'''
-# pushd "{path_to_dir}"
-# git config core.fileMode false
-# git config core.autocrlf input
-# git pull
-# ./.venv/bin/python3 -m pip uninstall  {probably_package_name} -y
-# ./.venv/bin/python3 setup.py develop
-# popd
-# ''' )
-
-                # Fucking https://www.virtualbox.org/ticket/19086 + https://www.virtualbox.org/ticket/8761
-# if [ -d "{newpath}" ]; then
-#   echo 2 > /proc/sys/vm/drop_caches || true
-#   find  "{path_to_dir}" -type f -delete || true;
-#   find  "{path_to_dir}" -type f -exec rm -rf {{}} \ || true;
-#   rm -rf "{path_to_dir}" || true
-#   rm -rf "{newpath}"
-# fi
-#                 lines.append(f"""
-# mv "{newpath}" "{path_to_dir}" || true
-#                 """)
-
-        lines.append(f"""
-tar -cvf  {in_src}/{self.src_tar_filename} {in_src}
-
-
-# We need to update all shell files after checkout.
-#terrarium_assembler "{self.args.specfile}"
-""")
+        checkout_ = GitCheckout(self.git_mirrors_path, self.checkout_jobs, os.path.join(self.curdir, self.stage_logs_dir))
+        results_ = checkout_.run(projects_)
+        with open(self.checkout_report_path, 'w', encoding='utf-8') as lf:
+            yaml.dump(results_, lf, sort_keys=False, allow_unicode=True)
 
-        mn_ = get_method_name()
-        self.lines2sh(mn_, lines, mn_)
-        pass
+        failed_ = [r_['url'] for r_ in results_ if r_['status'] != 'ok']
+        if failed_:
+            raise Exception(f'Checkout of {", ".join(failed_)} failed, see {self.checkout_report_path}')
+
+        self.cmd(f'tar -cvf  {in_src}/{self.src_tar_filename} {in_src}')
+        return {'projects': len(results_), 'slowest': sorted(results_, key=lambda r_: -r_['wall'])[:5]}
 
 #     def stage_98_checkout_clean_version(self):
 #         '''
@@ -1982,6 +2440,14 @@ tar -cvf  {in_src}/{self.src_tar_filename} {in_src}
 
         return git_url, git_branch, path_to_dir, setup_path
 
+    def projects_dirs(self, pp):
+        '''
+        Source folders of projects (python or go)
+        '''
+        if not pp:
+            return []
+        return [self.explode_pp_node(td_)[2] for td_ in pp.projects()]
+
 
 
 
@@ -2167,7 +2633,9 @@ podman save --compress --format docker-dir --quiet -o in/bin/fc{self.spec.fc_ver
 {save_state_hash(self.states_path + '/' + mn_)}
 ''')
 
-        self.lines2sh(mn_, lines, mn_)
+        self.lines2sh(mn_, lines, mn_,
+                      inputs=[], outputs=[self.platform_path],
+                      spec=[self.spec.fc_version])
         pass
 
     def stage_01_init_box_and_repos(self):
@@ -2215,7 +2683,9 @@ done
 # s
 
         mn_ = get_method_name()
-        self.lines2sh(mn_, lines, mn_)
+        self.lines2sh(mn_, lines, mn_,
+                      inputs=[self.platform_path], outputs=['@container'],
+                      spec=[self.spec.fc_version, self.ps.repos])
         pass
 
     def strlist_of_minimal_rpm_packages(self):
@@ -2256,7 +2726,10 @@ createrepo {self.rpmrepo_path}
 createrepo {self.tarrepo_path}
 {save_state_hash(self.rpms_path + '/' + mn_)}
 ''')
-        self.lines2sh(mn_, lines, mn_)
+        # base RPMs are in the common RPM folder, so the state folder of stage is its output
+        self.lines2sh(mn_, lines, mn_,
+                      inputs=['@container'], outputs=[self.rpms_path + '/' + mn_],
+                      spec=[packages, self.ps.exclude_prefix])
 
 
     def stage_05_download_rpm_packages(self):
@@ -2310,7 +2783,9 @@ createrepo {self.tarrepo_path}
 {save_state_hash(self.rpms_path)}
 ''')
         mn_ = get_method_name()
-        self.lines2sh(mn_, lines, mn_)
+        self.lines2sh(mn_, lines, mn_,
+                      inputs=['@container'], outputs=[self.rpms_path],
+                      spec=[packages, self.ps.builddep, self.ps.exclude_prefix])
 
 
     def stage_07_audit_download_srpms(self):
@@ -2556,17 +3031,18 @@ done
 
         rebuild_mod = ' --without '.join([''] + self.ps.rebuild_disable_features)
 
+        # every SPEC is built by own script, SPECs are built concurrently by build scheduler
         lines.append(f'''
-chmod u+w {self.rpmbuild_path} -R
-SPECS=`find {self.rpmbuild_path} -wholename "*SPECS/*.spec"`
-for SPEC in `echo $SPECS`
-do
-    echo $SPEC
-    BASEDIR=`dirname $SPEC`/..
-    SPECNAME=`basename $SPEC`
-    {self.tb_mod} find $d/$BASEDIR -wholename "$d/$BASEDIR*/RPMS/*/*.rpm" -exec cp {{}} {self.rebuilded_rpms_path}/ \;
-    {bashash_ok_folders_strings("$d/$BASEDIR/RPMS", ["$d/$BASEDIR/SPECS", "$d/$BASEDIR/SOURCES"], [self.disttag, rebuild_mod], f"Looks all here already build RPMs from $BASEDIR", cont=True)}
-    echo -e "\\n\\n\\n ****** Build $SPEC ****** \\n\\n"
+x="$(readlink -f "$0")"
+d="$(dirname "$x")"
+SPEC=$1
+echo $SPEC
+BASEDIR=`dirname $SPEC`/..
+SPECNAME=`basename $SPEC`
+{self.tb_mod} find $d/$BASEDIR -wholename "$d/$BASEDIR*/RPMS/*/*.rpm" -exec cp {{}} {self.rebuilded_rpms_path}/ \\;
+{bashash_ok_folders_strings("$d/$BASEDIR/RPMS", ["$d/$BASEDIR/SPECS", "$d/$BASEDIR/SOURCES"], [self.disttag, rebuild_mod], f"Looks all here already build RPMs from $BASEDIR")}
+echo -e "\\n\\n\\n ****** Build $SPEC ****** \\n\\n"
+NO_SVACE=0
         ''')
         if self.svace_mod:
             lines.append(f'''
@@ -2574,36 +3050,31 @@ do
 {self.svace_path} init $BASEDIR
             ''')
         lines.append(f'''
-    rm -rf $BASEDIR/BUILD/*
-
-{self.tb_mod} sudo bash -c 'echo "_unpackaged_files_terminate_build 0" > /usr/lib/rpm/macros.d/macros.tas'
+rm -rf $BASEDIR/BUILD/*
         ''')
 
         if 'rebuild_patches' in self.spec.packages:
             for package in self.spec.packages.rebuild_patches:
                 lines.append(f'''
-    if [[ "$SPECNAME" =~ ^({package}.spec)$ ]]; then
+if [[ "$SPECNAME" =~ ^({package}.spec)$ ]]; then
                 ''')
                 for sed_patch in self.spec.packages.rebuild_patches[package]:
                     lines.append(f'''
-                        {self.tb_mod} sed -e '{sed_patch}' -i $SPEC
+    {self.tb_mod} sed -e '{sed_patch}' -i $SPEC
                     ''')
                 lines.append(f'''
-    fi
+fi
                 ''')
 
-            lines.append(f'''
-NO_SVACE=0
-            ''')
         if 'rebuild_disable_svace' in self.spec.packages:
             specs_disable_svace_ = '|'.join([f'{f}.spec' for f in self.spec.packages.rebuild_disable_svace])
             lines.append(f'''
-    if [[ "$SPECNAME" =~ ^({specs_disable_svace_})$ ]]; then
-        NO_SVACE=1
-    fi
+if [[ "$SPECNAME" =~ ^({specs_disable_svace_})$ ]]; then
+    NO_SVACE=1
+fi
             ''')
 
-        rpmbuild_cmd = f'''rpmbuild -bb --noclean --nocheck --nodeps  {rebuild_mod} --define "_smp_mflags -j8" --define "java_arches 0" --define "_unpackaged_files_terminate_build 0" --define "_topdir $d/$BASEDIR" --define 'dist %{{!?distprefix0:%{{?distprefix}}}}%{{expand:%{{lua:for i=0,9999 do print("%{{?distprefix" .. i .."}}") end}}}}.{self.disttag}'  $SPEC'''
+        rpmbuild_cmd = f'''rpmbuild -bb --noclean --nocheck --nodeps  {rebuild_mod} --define "_smp_mflags -j{self.rpm_target_cpus}" --define "java_arches 0" --define "_unpackaged_files_terminate_build 0" --define "_topdir $d/$BASEDIR" --define 'dist %{{!?distprefix0:%{{?distprefix}}}}%{{expand:%{{lua:for i=0,9999 do print("%{{?distprefix" .. i .."}}") end}}}}.{self.disttag}'  $SPEC'''
 
         lines.append(f'''
 if [[ $NO_SVACE -ne 0 ]]; then
@@ -2612,11 +3083,19 @@ else
     {self.tb_mod} {svace_prefix} {rpmbuild_cmd}
 fi
 
-    {save_state_hash("$d/$BASEDIR/RPMS")}
-    {self.tb_mod} find $d/$BASEDIR -wholename "$d/$BASEDIR*/RPMS/*/*.rpm" -exec cp {{}} {self.rebuilded_rpms_path}/ \;
-done
-{self.create_rebuilded_repo_cmd}
+{save_state_hash("$d/$BASEDIR/RPMS")}
+{self.tb_mod} find $d/$BASEDIR -wholename "$d/$BASEDIR*/RPMS/*/*.rpm" -exec cp {{}} {self.rebuilded_rpms_path}/ \\;
 ''')
+        self.lines2sh('rebuild_spec', lines)
+
+        memory_mod = f'--memory-gb {self.build_memory_gb}' if self.build_memory_gb else ''
+        lines = [f'''
+chmod u+w {self.rpmbuild_path} -R
+{self.tb_mod} sudo bash -c 'echo "_unpackaged_files_terminate_build 0" > /usr/lib/rpm/macros.d/macros.tas'
+SPECS=`find {self.rpmbuild_path} -wholename "*SPECS/*.spec"`
+{sys.executable} -m terrarium_assembler.buildsched --cpus {self.build_cpus} {memory_mod} --history {self.rpm_build_durations_path} --logs-dir {self.stage_logs_dir}/rpmbuild --script {fname2shname('rebuild_spec')} --target-cpus {self.rpm_target_cpus} --target-memory-gb {self.target_memory_gb} $SPECS
+{self.create_rebuilded_repo_cmd}
+''']
 
     # {self.tb_mod} find $d/$BASEDIR -wholename "$d/$BASEDIR*/RPMS/*/*.rpm" -delete
         mn_ = get_method_name()
@@ -2651,7 +3130,10 @@ done
 # {self.tb_mod} sudo rpm install -ivh --excludedocs $RPMS
 #--disablerepo="*"
         mn_ = get_method_name()
-        self.lines2sh(mn_, lines, mn_)
+        self.lines2sh(mn_, lines, mn_,
+                      inputs=[self.rebuilded_rpms_path, '@container'],
+                      outputs=['@container'],
+                      spec=[packages])
 
     def stage_19_save_file_rpmpackage_info(self):
         '''
@@ -2665,6 +3147,7 @@ done
 {self.tb_mod} sort -u {self.terra_rpms_closure}-1 {self.terra_rpms_closure}-2 > {self.terra_rpms_closure}
 {self.tb_mod} rpm -qa --queryformat "%{{NAME}} " > tmp/rpm-packages-names-list.txt
 {self.tb_mod} patchelf --print-interpreter /usr/bin/createrepo > {self.ld_so_path}
+{sys.executable} -m terrarium_assembler.rpmindex build {self.file_package_list_from_rpms} {self.rpm_file_index_path}
 ''')
 # {self.tb_mod} sudo repoquery -y --installed --archlist=x86_64,noarch --cacheonly --list {self.terra_package_names} > {self.file_list_from_terra_rpms}
 # {self.tb_mod} sudo repoquery -y --installed --archlist=x86_64,noarch --resolve --recursive --cacheonly --requires --list {self.terra_package_names} > {self.file_list_from_deps_rpms}
@@ -2676,7 +3159,11 @@ done
 
 
         mn_ = get_method_name()
-        self.lines2sh(mn_, lines, mn_)
+        self.lines2sh(mn_, lines, mn_,
+                      inputs=['@container'],
+                      outputs=[self.file_package_list_from_rpms, self.rpm_file_index_path, self.terra_rpms_closure,
+                               self.terra_rpms_closure + '-1', self.terra_rpms_closure + '-2',
+                               'tmp/rpm-packages-names-list.txt', self.ld_so_path])
 
 
     def stage_95_install_all_rpms(self):
@@ -2747,6 +3234,11 @@ find {self.src_dir} -name "*.so*"  > {self.so_files_from_our_packages}
                     shell_name = '-'.join(['test', profile_name, script_name])
                     if strace:
                         strace_mod = f'strace -o {self.strace_files_path}/strace-{box_name}-{script_name}.log -f -e trace=file '
+                        if self.tests.tracer == 'fanotify':
+                            out_ = os.path.abspath(self.out_dir)
+                            strace_mod = (f'sudo -E {sys.executable} -m terrarium_assembler.fanotrace --root {out_} '
+                                          f'--alias {self.spec.install_dir}={out_} '
+                                          f'--output {self.used_files_traces_path}/used-{box_name}-{script_name}.yaml -- ')
                         shell_name = '-'.join(['test', profile_name, script_name, 'strace'])
                     shell_name = shell_name.replace('_', '-')
                     scmd = ''
@@ -2821,7 +3313,10 @@ createrepo {self.rpmrepo_path}
 #--skip-broken
         ]
         mn_ = get_method_name()
-        self.lines2sh(mn_, lines, mn_)
+        self.lines2sh(mn_, lines, mn_,
+                      inputs=[self.rpms_path + '/stage_02_download_base_packages', '@container'],
+                      outputs=['@container'],
+                      spec=[packages])
         pass
 # {self.tb_mod} sudo dnf config-manager --add-repo file://$d/{self.rpmrepo_path}/ -y
 
@@ -2857,7 +3352,10 @@ createrepo {self.rpmrepo_path}
 # self.file_list_from_rpms}
         ]
         mn_ = get_method_name()
-        self.lines2sh(mn_, lines, mn_)
+        self.lines2sh(mn_, lines, mn_,
+                      inputs=[self.rpms_path, '@container'],
+                      outputs=['@container', self.file_list_from_terra_rpms, self.file_list_from_deps_rpms, self.file_list_from_rpms],
+                      spec=[packages, self.ps.builddep])
         pass
 
 
@@ -2940,8 +3438,9 @@ rsync  {self.rpms_backup_pool}/*.rpm  {self.rpms_path}/
         lines = []
         in_bin = os.path.relpath(self.in_bin, start=self.curdir)
         relwheelpath = os.path.relpath(self.rebuilded_whl_path, start=self.curdir)
+        python_dirs_ = self.projects_dirs(self.pp)
         lines.append(fR'''
-{bashash_ok_folders_strings(self.our_whl_path, [self.src_dir], [],
+{bashash_ok_folders_strings(self.our_whl_path, python_dirs_, [],
 f"Looks like sources not changed, not need to rebuild WHLs for our sources"
 )}
 rm -f {self.our_whl_path}/*
@@ -2959,7 +3458,9 @@ rm -f {self.our_whl_path}/*
 
         lines.append(save_state_hash(self.our_whl_path))
         mn_ = get_method_name()
-        self.lines2sh(mn_, lines, mn_)
+        self.lines2sh(mn_, lines, mn_,
+                      inputs=python_dirs_ + ['@venv', '@container'],
+                      outputs=python_dirs_ + [self.our_whl_path])
 
 
     def stage_22_init_python_env(self):
@@ -2988,7 +3489,9 @@ fi
 
         lines.append(scmd)
         mn_ = get_method_name()
-        self.lines2sh(mn_, lines, mn_)
+        self.lines2sh(mn_, lines, mn_,
+                      inputs=[self.base_whl_path, '@container'],
+                      outputs=['@venv'])
         pass
 
     def stage_27_install_wheels(self):
@@ -3034,8 +3537,14 @@ fi
 {save_state_hash('.venv')}
 ''')
 
+        inputs_ = [self.our_whl_path, self.ext_whl_path, self.ext_compiled_tar_path, self.base_whl_path, '@container']
+        if self.pp.shell_commands:
+            # arbitrary commands, can not tell what they touch
+            inputs_ = None
         mn_ = get_method_name()
-        self.lines2sh(mn_, lines, mn_)
+        self.lines2sh(mn_, lines, mn_,
+                      inputs=inputs_,
+                      outputs=['@venv', self.pip_list, self.pip_list_json])
         pass
 
     def stage_34_audit_install_depswheels_for_rebuild(self):
@@ -3220,7 +3729,9 @@ rm -f {self.base_whl_path}/*
 {save_state_hash(self.base_whl_path)}
 ''')
         mn_ = get_method_name()
-        self.lines2sh(mn_, lines, mn_)
+        self.lines2sh(mn_, lines, mn_,
+                      inputs=['@container'],
+                      outputs=[self.base_whl_path])
         pass
 
     def stage_32_audit_download_extra_pip_for_build_pip_from_sources(self):
@@ -3447,8 +3958,9 @@ fi
 
         scmd = f"./.venv/bin/python3 -m pip download wheel {pip_args_} --dest {self.ext_whl_path} --find-links='{self.our_whl_path}' --find-links='{self.base_whl_path}' --default-timeout=1000  "
         # scmd_srcs = f"{self.tb_mod} ./.venv/bin/python3 -m pip download --no-build-isolation {self.base_wheels_string()} {pip_args_} --dest {self.ext_pip_path} --find-links='{self.our_whl_path}' --find-links='{self.base_whl_path}' --no-binary :all: "
+        python_dirs_ = self.projects_dirs(self.pp)
         lines.append(f'''
-{bashash_ok_folders_strings(self.ext_whl_path, [self.src_dir], [scmd, remove_pips_str],
+{bashash_ok_folders_strings(self.ext_whl_path, python_dirs_, [scmd, remove_pips_str],
         f"Looks required RPMs already downloaded"
         )}
 
@@ -3464,7 +3976,9 @@ rm -f {self.ext_whl_path}/*
 {save_state_hash(self.ext_whl_path)}
 ''')
         mn_ = get_method_name()
-        self.lines2sh(mn_, lines, mn_)
+        self.lines2sh(mn_, lines, mn_,
+                      inputs=python_dirs_ + [self.our_whl_path, self.base_whl_path, '@venv', '@container'],
+                      outputs=[self.ext_whl_path])
         # self.lines2sh("12-download-pip-sources", [scmd_srcs], "download-pip-sources")
         pass
 
@@ -3498,7 +4012,9 @@ done
 {save_state_hash(self.ext_compiled_tar_path)}
 ''')
         mn_ = get_method_name()
-        self.lines2sh(mn_, lines, mn_)
+        self.lines2sh(mn_, lines, mn_,
+                      inputs=[self.ext_whl_path, '@container'],
+                      outputs=[self.ext_compiled_tar_path])
         pass
 
     def stage_89_rpm_graph(self):
@@ -3510,22 +4026,17 @@ done
 
         if not self.build_mode:
             mn_ = get_method_name()
-            lines = [
-                f'''
-{sys.executable} {sys.argv[0]} "{self.args.specfile}" --stage-rpm-graph
-                ''']
-            self.lines2sh(mn_, lines, mn_)
+            self.write_shell_file_for_method(mn_)
             return
 
         if not self.args.stage_rpm_graph:
             return
 
-        fn_ = self.files_source_after_minimization_path if Path(self.files_source_after_minimization_path).exists() else self.files_source_path
-        file_source_table = yaml.unsafe_load(open(fn_, 'r'))
+        manifest_ = self.open_build_manifest()
+        file_source_table = manifest_.file_table()
         file_source = list(file_source_table.values())
-
-        fn_ = self.bin_files_sources_after_minimization_path if Path(self.bin_files_sources_after_minimization_path).exists() else self.bin_files_sources_path
-        bin_files_sources = yaml.unsafe_load(open(fn_, 'r'))
+        bin_files_sources = manifest_.bin_sources()
+        manifest_.close()
         bin_files_relnames = set(bin_files_sources.values())
 
         packages = yaml.unsafe_load(open('tmp/rpm-packages-info.yaml', 'r'))
@@ -3533,8 +4044,6 @@ done
                                      if (r.source_type==SourceType.rpm_package.value or r.source_type==SourceType.rebuilded_rpm_package.value
                                         ) and r.source_path in bin_files_relnames]
 
-        file_package_list, file2package = self.load_file_package_list_from_rpms()
-
         packages_from_build = set([r.source for r in file_source_from_packages])
         # rpm_packages_table = sorted(list(set([(pfr.package, pfr.version) for pfr in file_package_list if pfr.package in packages_from_build])))
 
@@ -3568,11 +4077,7 @@ done
         '''
         if not self.build_mode:
             mn_ = get_method_name()
-            lines = [
-                f'''
-{sys.executable} {sys.argv[0]} "{self.args.specfile}" --stage-audit-analyse
-                ''']
-            self.lines2sh(mn_, lines, mn_)
+            self.write_shell_file_for_method(mn_)
             return
 
 
@@ -3777,12 +4282,11 @@ Nuitka zstandard
             abs_path_to_out_dir.split(os.path.sep)[-2:])
 
 
-        fn_ = self.files_source_after_minimization_path if Path(self.files_source_after_minimization_path).exists() else self.files_source_path
-        file_source_table = yaml.unsafe_load(open(fn_, 'r'))
+        manifest_ = self.open_build_manifest()
+        file_source_table = manifest_.file_table()
         file_source = list(file_source_table.values())
-
-        fn_ = self.bin_files_sources_after_minimization_path if Path(self.bin_files_sources_after_minimization_path).exists() else self.bin_files_sources_path
-        bin_files_sources = yaml.unsafe_load(open(fn_, 'r'))
+        bin_files_sources = manifest_.bin_sources()
+        manifest_.close()
 
         # file_source_table = yaml.unsafe_load(open(self.files_source_after_minimization_path, 'r'))
         # file_source = list(file_source_table.values())
@@ -3795,10 +4299,8 @@ Nuitka zstandard
 
         used_files = set(yaml.unsafe_load(open(self.used_files_path, 'r'))) if Path(self.used_files_path).exists() else set([v.relname for v in file_source])
 
-        file_package_list, file2package = self.load_file_package_list_from_rpms()
-
         packages_from_build = set([r.source for r in file_source_from_packages])
-        rpm_packages_table = sorted(list(set([(pfr.package, pfr.version) for pfr in file_package_list if pfr.package in packages_from_build])))
+        rpm_packages_table = sorted(list(set([(p_[0], p_[1]) for p_ in self.rpm_file_index().packages if p_[0] in packages_from_build])))
         write_doc_table('reports/doc-rpm-packages.htm', ['Packages', 'Version'], rpm_packages_table)
 
 
@@ -3969,30 +4471,39 @@ Nuitka zstandard
 
         pass
 
-    def load_file_package_list_from_rpms(self):
-        file_package_list = []
-        file2package = {}
-        with open(self.file_package_list_from_rpms, 'r') as lf:
-            for i, line in enumerate(lf.readlines()):
-                line = line.strip('\n')
-                pfr = PackageFileRow(*line.split(ROW_SPLIT))
-                file_package_list.append(pfr)
-                file2package[pfr.filename] = pfr
-                if pfr.filename.startswith('/lib64'):
-                    file2package['/usr' + pfr.filename] = pfr
-        return file_package_list, file2package
-
-    def load_files_source(self):
-        alist = []
-        key2row = {}
-        with open(self.files_source_path, 'r') as lf:
-            for i, line in enumerate(lf.readlines()):
-                line = line.strip('\n')
-                terms = [p.strip() for p in line.split(ROW_SPLIT)]
-                row = FileInBuild(*terms)
-                alist.append(row)
-                key2row[row.relname] = row
-        return alist, key2row
+    def rpm_file_index(self):
+        '''
+        Index «file → RPM package» (PackageFileRow), written by stage 19.
+        Rebuilt here if it is absent, older than file list or of old format.
+        '''
+        index_path = os.path.join(self.curdir, self.rpm_file_index_path)
+        list_path = os.path.join(self.curdir, self.file_package_list_from_rpms)
+        if not os.path.exists(index_path) or os.path.getmtime(index_path) < os.path.getmtime(list_path):
+            build_rpm_index(list_path, index_path)
+        try:
+            return RpmFileIndex(index_path, PackageFileRow)
+        except ValueError:
+            build_rpm_index(list_path, index_path)
+            return RpmFileIndex(index_path, PackageFileRow)
+
+    def open_build_manifest(self, reset=False):
+        '''
+        Manifest of build files (tmp/build-manifest.sqlite).
+        YAML tables of trees, packed by older versions, are converted once.
+        '''
+        manifest_path = os.path.join(self.curdir, self.build_manifest_path)
+        if not reset and not os.path.exists(manifest_path):
+            files_path = os.path.join(self.curdir, self.files_source_path)
+            bin_path = os.path.join(self.curdir, self.bin_files_sources_path)
+            if os.path.exists(files_path) and os.path.exists(bin_path):
+                print(f"Converting {files_path} and {bin_path} to {manifest_path}")
+                convert_yaml(files_path, bin_path, manifest_path,
+                             os.path.join(self.curdir, self.files_source_after_minimization_path),
+                             os.path.join(self.curdir, self.bin_files_sources_after_minimization_path))
+        manifest_ = BuildManifest(manifest_path)
+        if reset or not manifest_.exists():
+            manifest_.reset()
+        return manifest_
 
 
     def stage_50_pack(self):
@@ -4000,12 +4511,11 @@ Nuitka zstandard
         Packing portable environment
         '''
         if not self.build_mode:
-            lines = [
-                f'''
-{sys.executable} {sys.argv[0]} --stage-pack "{self.args.specfile}"
-                ''' ]
+            extra_ = f' --jobs {self.jobs}'
+            if self.args.incremental:
+                extra_ += ' --incremental'
             mn_ = get_method_name()
-            self.lines2sh(mn_, lines, mn_)
+            self.write_shell_file_for_method(mn_, extra_)
             return
 
         if not self.args.stage_pack:
@@ -4020,11 +4530,7 @@ Nuitka zstandard
         # for out_ in self.output_folders:
         #     root_dir = self.root_dir = expandpath(out_)
 
-        file_package_list, file2rpmpackage = self.load_file_package_list_from_rpms()
-        sofile2rpmfile = {}
-        for f_ in file2rpmpackage:
-            if '.so' in f_:
-                sofile2rpmfile[os.path.split(f_)[-1]] = f_
+        file2rpmpackage = self.rpm_file_index()
 
         so_files_rpips_filename2path = {}
         so_files_rpips_path2package = {}
@@ -4117,7 +4623,7 @@ Nuitka zstandard
                         try:
                             if 'users.xml' in fname_:
                                 dfdsfdsf = 1
-                            m = fucking_magic(fname_)
+                            m = self.file_types.describe(fname_)
                             for t_ in ['ASCII text', 'UTF8 text', 'Unicode text', 'UTF-8 text']:
                                 if t_ in m:
                                     plain = True
@@ -4231,19 +4737,26 @@ Nuitka zstandard
         user_ = os.getlogin()
         scmd = f'sudo chown {user_} {root_dir} -R '
         self.cmd(scmd)
-        old_root_dir = root_dir + ".old"
-        if os.path.exists(old_root_dir):
-            scmd = f'sudo chown {user_} {old_root_dir} -R '
-            self.cmd(scmd)
-            shutil.rmtree(old_root_dir, ignore_errors=True)
-        if os.path.exists(old_root_dir):
-            os.system("rm -rf " + old_root_dir)
-        if os.path.exists(root_dir):
-            shutil.move(root_dir, old_root_dir)
+
+        self.pack_manifest = PackManifest(os.path.join(self.curdir, self.pack_manifest_path))
+        self.pack_incremental = args.incremental and bool(self.pack_manifest.old) and os.path.exists(root_dir)
+        self.pack_done = set()
+        if self.pack_incremental:
+            print(f"Incremental packing into {root_dir}")
+        else:
+            old_root_dir = root_dir + ".old"
+            if os.path.exists(old_root_dir):
+                scmd = f'sudo chown {user_} {old_root_dir} -R '
+                self.cmd(scmd)
+                shutil.rmtree(old_root_dir, ignore_errors=True)
+            if os.path.exists(old_root_dir):
+                os.system("rm -rf " + old_root_dir)
+            if os.path.exists(root_dir):
+                shutil.move(root_dir, old_root_dir)
 
         mkdir_p(root_dir)
 
-        def copy_file_to_environment(f):
+        def plan_file_to_environment(f):
             if 'grafana-server' in f:
                 ...
 
@@ -4255,12 +4768,12 @@ Nuitka zstandard
                 return None
 
             if self.br.is_need_patch(f):
-                return self.process_binary(f)
+                return self.plan_binary(f)
 
             if self.br.is_just_copy(f):
-                return self.add(f)
+                return PackOp('copy', f, tf, self.default_relname(f))
             elif self.spec.debug and f.startswith("/usr/include"):
-                return self.add(f)
+                return PackOp('copy', f, tf, self.default_relname(f))
             else:
                 libfile = f
                 # python tends  install in both /usr/lib and /usr/lib64, which doesn't mean it is
@@ -4288,53 +4801,40 @@ Nuitka zstandard
                 #     rp_ = os.path.realpath(f)
                 #     if os.path.exists(rp_):
                 #         add(os.path.realpath(f), libfile)
-                if 1:
-                    if not os.path.exists(tf) and os.path.splitext(f)[1] not in ['.rpmmoved', '.debug']:
-                        print("Missing %s" % f)
-                        return
-                        # # assert(False)
-                    try:
-                        m = fucking_magic(tf)
-                    except Exception as ex_:
-                        print("Cannot detect Magic for ", tf)
-                        raise ex_
-                    if m.startswith('ELF') and 'shared' in m:
-                        # startswith('application/x-sharedlib') or m.startswith('application/x-pie-executable'):
-                        try:
-                            self.fix_sharedlib(tf, libfile)
-                            self.bin_files_sources[libfile] = f
-                            return libfile
-                        except:
-                            print('Cannot optionally patch', tf)
-                            assert(False)
-                    else:
-                        # in case this is a directory that is listed, we don't want to include everything that is in that directory
-                        # for instance, the python3 package will own site-packages, but other packages that we are not packaging could have
-                        # filled it with stuff.
-                        return self.add(f, libfile, recursive=False)
-                        # shutil.copy2(f, os.path.join(root_dir, libfile))
-                        # add(f, arcname=libfile, recursive=False)
-            pass
+                if not os.path.exists(tf) and os.path.splitext(f)[1] not in ['.rpmmoved', '.debug']:
+                    print("Missing %s" % f)
+                    return None
+                    # # assert(False)
+                m = self.file_magic(tf)
+                if m.startswith('ELF') and 'shared' in m:
+                    # startswith('application/x-sharedlib') or m.startswith('application/x-pie-executable'):
+                    return PackOp('patch_sharedlib', f, tf, libfile, bin_source=f)
+                # in case this is a directory that is listed, we don't want to include everything that is in that directory
+                # for instance, the python3 package will own site-packages, but other packages that we are not packaging could have
+                # filled it with stuff.
+                return PackOp('copy', f, tf, libfile)
+                # shutil.copy2(f, os.path.join(root_dir, libfile))
+                # add(f, arcname=libfile, recursive=False)
 
         self.cmd(f'{self.tb_mod} sudo chmod a+r /usr/lib/cups -R')
 
         # file_source_table = {}
         file_source_table = FileSource()
-        def register_rpmpackage_file(relpath, f, pfr):
-            if not relpath:
-                return
-            if 'libdl.so' in relpath:
-                wtf = 1
+        self.build_manifest = self.open_build_manifest(reset=True)
+        def rpm_source_type(pfr):
             if '.' in pfr.release and self.disttag in pfr.release.split('.'):
-                file_source_table[relpath] = FileInBuild(relpath, SourceType.rebuilded_rpm_package, pfr.package, f)
-            else:
-                file_source_table[relpath] = FileInBuild(relpath, SourceType.rpm_package, pfr.package, f)
+                return SourceType.rebuilded_rpm_package
+            return SourceType.rpm_package
+
+        # Mount container overlay before workers start to use it.
+        self.toolbox_path('/')
 
-        terra_closure_packages = [p.strip('\n') for p in open(self.terra_rpms_closure).readlines()] + self.ps.terra
-        for fpl_ in file_package_list:
+        rpm_files = []
+        terra_closure_packages = set([p.strip('\n') for p in open(self.terra_rpms_closure).readlines()] + self.ps.terra)
+        for fpl_ in file2rpmpackage.rows(packages=terra_closure_packages):
             if fpl_.filename.endswith('bin/clickhouse'):
                 wtf = 1
-            if fpl_.package in terra_closure_packages and not fpl_.package in self.ps.terra_exclude:
+            if not fpl_.package in self.ps.terra_exclude:
                 ok = True
                 for prefix in self.ps.exclude_prefix or []:
                     if fpl_.package.startswith(prefix):
@@ -4346,12 +4846,20 @@ Nuitka zstandard
                         wtf = 1
                     if not self.should_copy(f):
                         continue
-                    relpath = copy_file_to_environment(f)
-                    if relpath and not relpath.startswith('/'):
-                        register_rpmpackage_file(relpath, f, fpl_)
+                    rpm_files.append(fpl_)
                     # # if relpath:
                     #     file_source_table[relpath] = FileInBuild(relpath, 'package', fpl_.package, f)
 
+        ops = []
+        for fpl_, op in zip(rpm_files, map_ordered(lambda fpl_: plan_file_to_environment(fpl_.filename), rpm_files, self.jobs)):
+            if op:
+                op.source_type = rpm_source_type(fpl_)
+                op.source_name = fpl_.package
+                ops.append(op)
+        self.run_pack_ops(ops, file_source_table)
+        print(f"Packing {len(ops)} files from RPMs ({self.jobs} jobs) takes")
+        t.toc()
+
         if self.fs:
             for folder_ in self.fs.folders:
                 if 'install' in folder_:
@@ -4392,6 +4900,8 @@ Nuitka zstandard
                                 if 'libgcc_s.so.1' in dp_ :
                                     wtf  = 1
                                 map2package[dp_] = package_
+
+                folder_files = []
                 for dirpath, dirnames, filenames in os.walk(folder_):
                     for filename in filenames:
                         f = os.path.join(dirpath, filename)
@@ -4420,84 +4930,96 @@ Nuitka zstandard
                                 continue
                         if '{cwd}' in f:
                             wtf  = 1
-                        if self.br.is_need_patch(f):
-                            relname = self.process_binary(f)
-                            if os.path.isabs(relname):
-                                wtf = 1
-                            file_source_table[relname] = FileInBuild(relname, SourceType.file_from_folder, folder_, f)
-                            continue
+                        folder_files.append((f, rf, filename))
+
+                magics_ = map_ordered(lambda it_: self.file_magic(self.toolbox_path(it_[0])), folder_files, self.jobs)
+
+                ops = []
+                planned_ = set()
+                for (f, rf, filename), m in zip(folder_files, magics_):
+                    tf = self.toolbox_path(f)
+                    if self.br.is_need_patch(f):
+                        op = self.plan_binary(f, m)
+                        op.source_type = SourceType.file_from_folder
+                        op.source_name = folder_
+                        ops.append(op)
+                        continue
 
-                        m = ''
-                        if '{cwd}' in f:
-                            wtf  = 1
-                        try:
-                            tf = self.toolbox_path(f)
-                            m = fucking_magic(tf)
-                        except Exception as ex_:
-                            print("Cannot detect Magic for ", f)
-                            raise ex_
-                        if m.startswith('ELF') and 'shared' in m  or 'symbolic' in m:
-                            # startswith('application/x-sharedlib') or m.startswith('application/x-pie-executable'):
-                            if '{cwd}' in f:
-                                wtf  = 1
-                            if '.libs' in rf:
+                    if m.startswith('ELF') and 'shared' in m  or 'symbolic' in m:
+                        # startswith('application/x-sharedlib') or m.startswith('application/x-pie-executable'):
+                        if '.libs' in rf:
+                            wtf = 1
+                        relname = 'pbin/' + filename
+                        if '/' in rf and not '..' in rf:
+                            relname = 'pbin/' + rf
+                        elif filename.startswith('lib'):
+                             relname = 'lib64/' + filename
+                        # if Path(tf).is_absolute():
+                        #     relname = f'lib64/' + filename
+                        # elif self.src_dir in f:
+                        #     relname = 'lib64/' + filename
+                        # elif f.startswith('.venv/lib'):
+                        #     relname = 'lib64/' + filename
+                        # elif filename.startswith('lib') and dirpath == folder_:
+                        #     relname = f.replace(folder_, 'lib64')
+                        # else:
+                        #     relname = f.replace(folder_, 'pbin')
+                        if relname not in file_source_table and relname not in planned_:
+                            if 'extract' in relname:
                                 wtf = 1
-                            relname = 'pbin/' + filename
-                            if '/' in rf and not '..' in rf:
-                                relname = 'pbin/' + rf
-                            elif filename.startswith('lib'):
-                                 relname = 'lib64/' + filename
-                            # if Path(tf).is_absolute():
-                            #     relname = f'lib64/' + filename
-                            # elif self.src_dir in f:
-                            #     relname = 'lib64/' + filename
-                            # elif f.startswith('.venv/lib'):
-                            #     relname = 'lib64/' + filename
-                            # elif filename.startswith('lib') and dirpath == folder_:
-                            #     relname = f.replace(folder_, 'lib64')
-                            # else:
-                            #     relname = f.replace(folder_, 'pbin')
-                            if relname not in file_source_table:
-                                if 'extract' in relname:
-                                    wtf = 1
-                                source_ = f
-                                if source_ in file2rpmpackage:
-                                    package_ = file2rpmpackage[source_]
-                                    register_rpmpackage_file(relname, source_, package_)
-                                # if filename in sofile2rpmfile:
-                                #     source_ = sofile2rpmfile[filename]
-                                #     package_ = file2rpmpackage[source_]
-                                #     register_rpmpackage_file(relname, source_, package_)
-                                else:
-                                    type_ = SourceType.file_from_folder
-                                    what_ = folder_
-                                    if f in so_files_from_src_path2folder:
-                                        type_ = SourceType.our_source
-                                        what_ = so_files_from_src_path2folder[f]
-                                    elif 'site-packages' in f and f.split('site-packages')[1][1:] in so_files_rpips_path2whl:
-                                    # elif f in so_files_rpips_path2package:
-                                        type_ = SourceType.rebuilded_python_package
-                                        what_ = so_files_rpips_path2whl[f.split('site-packages')[1][1:]]
-                                    elif rf in map2package:
-                                        if 'skimage' in rf:
-                                            wtf = 1
-                                        type_ = SourceType.python_package
-                                        what_ = map2package[rf]
-                                        if what_ == 'cv2':
-                                            wtf = 1
-                                    file_source_table[relname] = FileInBuild(relname, type_, what_, source_)
-                                self.bin_files_sources[relname] = source_
-                                self.fix_sharedlib(tf, relname)
-                        else:
-                            relname = f.replace(folder_, 'pbin')
-                            self.add(f, relname, recursive=False)
-                pass
+                            planned_.add(relname)
+                            source_ = f
+                            op = PackOp('patch_sharedlib', source_, tf, relname, bin_source=source_)
+                            if source_ in file2rpmpackage:
+                                package_ = file2rpmpackage[source_]
+                                op.source_type = rpm_source_type(package_)
+                                op.source_name = package_.package
+                            # if filename in sofile2rpmfile:
+                            #     source_ = sofile2rpmfile[filename]
+                            #     package_ = file2rpmpackage[source_]
+                            #     register_rpmpackage_file(relname, source_, package_)
+                            else:
+                                type_ = SourceType.file_from_folder
+                                what_ = folder_
+                                if f in so_files_from_src_path2folder:
+                                    type_ = SourceType.our_source
+                                    what_ = so_files_from_src_path2folder[f]
+                                elif 'site-packages' in f and f.split('site-packages')[1][1:] in so_files_rpips_path2whl:
+                                # elif f in so_files_rpips_path2package:
+                                    type_ = SourceType.rebuilded_python_package
+                                    what_ = so_files_rpips_path2whl[f.split('site-packages')[1][1:]]
+                                elif rf in map2package:
+                                    if 'skimage' in rf:
+                                        wtf = 1
+                                    type_ = SourceType.python_package
+                                    what_ = map2package[rf]
+                                    if what_ == 'cv2':
+                                        wtf = 1
+                                op.source_type = type_
+                                op.source_name = what_
+                            ops.append(op)
+                    else:
+                        relname = f.replace(folder_, 'pbin')
+                        ops.append(PackOp('copy', f, tf, relname))
+                self.run_pack_ops(ops, file_source_table)
+                print(f"Packing {len(ops)} files from {folder_} takes")
+                t.toc()
+
+        # templates, terra pythons and libc.so link are not in manifest, they are rewritten below
+        if self.pack_incremental:
+            stale_ = self.pack_manifest.stale()
+            for relname in stale_:
+                path_ = os.path.join(root_dir, relname)
+                if os.path.lexists(path_) and not os.path.isdir(path_):
+                    os.unlink(path_)
+            print(f"Removed {len(stale_)} stale files")
+        self.pack_manifest.save()
 
         scmd = f"""
 {self.tb_mod} python3 -c "from ctypes.util import _findSoname_ldconfig;print(_findSoname_ldconfig('c'))"
 """
         libc_name = subprocess.check_output(scmd, shell=True).decode('utf-8').strip()
-        self.cmd(f"ln -s {libc_name} {self.out_dir}/lib64/libc.so")
+        self.cmd(f"ln -sf {libc_name} {self.out_dir}/lib64/libc.so")
 
         install_templates(root_dir, args)
         self.install_terra_pythons()
@@ -4566,17 +5088,29 @@ Nuitka zstandard
         #                 lc.write("\n".join(it))
         #             lf.write("\n".join(it))
 
+        if self.elf_cache:
+            self.elf_cache.save(os.path.join(self.curdir, self.patched_elf_cache_report))
+        self.file_types.save()
+
+        dedup_ = Deduplicator(self.root_dir, self.dedup_mode, self.jobs)
+        dedup_links_ = dedup_.run(sorted(file_source_table))
+        with open(os.path.join(self.curdir, self.dedup_links_path), 'w') as lf:
+            json.dump(dedup_links_, lf, indent=1, sort_keys=True)
+        if dedup_links_:
+            print(f"Dedup ({self.dedup_mode}): {len(dedup_links_)} duplicates, {dedup_.saved/1024/1024:.1f} Mb saved")
+
         size_ = folder_size(self.root_dir, follow_symlinks=False)
 
         print("Size ", size_/1024/1024, 'Mb')
 
-        with open(os.path.join(self.curdir, self.files_source_path), 'w') as lf:
-            lf.write(yaml.dump(file_source_table))
-
-        with open(os.path.join(self.curdir, self.bin_files_sources_path), 'w') as lf:
-            lf.write(yaml.dump(self.bin_files_sources))
-        if os.path.exists(self.bin_files_sources_after_minimization_path):
-            os.unlink(self.bin_files_sources_after_minimization_path)
+        self.build_manifest.flush()
+        self.build_manifest.export_yaml(os.path.join(self.curdir, self.files_source_path),
+                                        os.path.join(self.curdir, self.bin_files_sources_path))
+        self.build_manifest.close()
+        self.build_manifest = None
+        for path_ in [self.files_source_after_minimization_path, self.bin_files_sources_after_minimization_path]:
+            if os.path.exists(os.path.join(self.curdir, path_)):
+                os.unlink(os.path.join(self.curdir, path_))
 
         try:
             os.chdir(self.curdir)
@@ -4591,6 +5125,11 @@ Nuitka zstandard
             print(ex_)
             pass
 
+        metrics_ = {'size_mb': round(size_/1024/1024, 1), 'files': len(file_source_table)}
+        if self.elf_cache:
+            metrics_.update(elf_cache_hits=self.elf_cache.hits, elf_cache_misses=self.elf_cache.misses)
+        return metrics_
+
 
     def stage_51_tests_setup(self):
         '''
@@ -4687,15 +5226,10 @@ tar -v -c  --use-compress-program=pbzip2 -f svace-dirs.tar.bz2 $(find . -name ".
         pack generated/unpacked sources after_build_process
         '''
         import tarfile
-        import magic
-        
+
         if not self.build_mode:
-            lines = [
-                f'''
-{sys.executable} {sys.argv[0]} --stage-pack-generated-sources "{self.args.specfile}"
-                ''' ]
             mn_ = get_method_name()
-            self.lines2sh(mn_, lines, mn_)
+            self.write_shell_file_for_method(mn_)
             return
 
         if not self.args.stage_pack_generated_sources:
@@ -4844,7 +5378,7 @@ NumPy array
 
                 file_ = Path(tarinfo.name)
                 if not file_.is_dir() and file_.exists():
-                    m = magic.from_file(file_)  # empty,
+                    m = self.file_types.describe(str(file_))  # empty,
                     if m not in unknown_types:
                         for s in magic_nonsources:
                             if s in m:
@@ -4872,6 +5406,7 @@ NumPy array
         add_dir(self.src_path)
         add_dir(self.pip_source_path)
         tar.close() 
+        self.file_types.save()
         ...
 
     def stage_99_export_for_audit(self):
@@ -4999,7 +5534,8 @@ toolbox -c {self.container_name} run bash ./{shellname_}
 
             ...
         mn_ = get_method_name()
-        self.lines2sh(mn_, lines, mn_)
+        # tests do not install anything into build container
+        self.lines2sh(mn_, lines, mn_, outputs=[])
 
         scmd = f'''
 toolbox -c {self.container_name} run $@
@@ -5017,22 +5553,25 @@ toolbox -c {self.container_name} run $@
         mn_ = get_method_name()
         self.lines2sh(mn_, lines, mn_)
 
-    def write_shell_file_for_method(self, mn_):
+    def write_shell_file_for_method(self, mn_, extra='', inputs=None, outputs=None, spec=None):
             '''
-            Write shell file how to call a function
+            Write shell file how to call a function.
+            Stage runner calls the function itself, in process
+            (with declared inputs and outputs — concurrently with independent script stages).
             '''
             stage_ = fname2stage(mn_).replace('_', '-')
             lines = [
                 f'''
-{sys.executable} {sys.argv[0]} "{self.args.specfile}" --{stage_}
+{sys.executable} {sys.argv[0]} "{self.args.specfile}" --{stage_}{extra}
                 ''']
-            self.lines2sh(mn_, lines, mn_)
+            self.lines2sh(mn_, lines, mn_, inprocess=True, inputs=inputs, outputs=outputs, spec=spec)
             return
 
 
     def stage_54_analyze_used_files(self):
         '''
-        Analyze strace files, getted from tests.
+        Analyze strace files, getted from tests,
+        and merge used files, collected by fanotify tracer.
         '''
         if not self.build_mode:
             mn_ = get_method_name()
@@ -5061,38 +5600,34 @@ toolbox -c {self.container_name} run $@
             abs_path_to_out_dir.split(os.path.sep)[-2:])
 
         used_files = set()
-        # for trace_file_glob in tracefiles:
+        analyzer_ = StraceAnalyzer(os.path.join(self.curdir, self.strace_cache_dir), self.jobs)
         for trace_file_dir in tracefiles:
             print(f'Looking strace files in {trace_file_dir}')
-            # for trace_file in glob.glob(trace_file_glob):
-            for trace_file in os.listdir(trace_file_dir):
-                print(f'Analysing {trace_file}')
-                re_file = re.compile(
-                    r'''.*\([^"]*\"(?P<filename>[^"]+)\".*''')
-                for linenum, line in enumerate(open(Path(trace_file_dir) / trace_file, 'r', encoding='utf-8').readlines()):
-                    if 'ENOENT' in line:
-                        continue
-                    if 'pbin/ld.so' in line:
-                        wtf = 1
-                    m_ = re_file.match(line)
-                    if m_:
-                        fname = m_.group('filename')
-                        # Heuristic to process strace files from Vagrant virtualboxes
-                        fname = fname.replace('/run/host', '')
-                        fname = fname.replace('/vagrant', self.curdir)
-                        # Heuristic to process strace files from remote VM, mounted by sshmnt
-                        fname = re.sub(
-                            fr'''/mnt/.*{lastdirs}''', abs_path_to_out_dir, fname)
-                        fname = re.sub(self.spec.install_dir,
-                                       abs_path_to_out_dir, fname)
-                        if os.path.isabs(fname):
-                            fname = os.path.abspath(fname)
-                            if fname.startswith(abs_path_to_out_dir):
-                                if os.path.islink(fname):
-                                    link_ = os.readlink(fname)
-                                    fname = os.path.join(os.path.split(fname)[0], link_)
-                                relpath = os.path.relpath(os.path.abspath(fname), start=self.out_dir)
-                                used_files.add(relpath)
+        fnames_ = analyzer_.filenames(tracefiles)
+        print(f'{analyzer_.analysed} strace files analysed, {analyzer_.cached} taken from cache')
+
+        # lists from fanotify tracer are already relative to out
+        for used_ in sorted(Path(self.used_files_traces_path).glob('*.yaml')):
+            print(f'Adding used files from {used_}')
+            used_files.update(yaml.safe_load(used_.read_text()) or [])
+
+        for fname in fnames_:
+            # Heuristic to process strace files from Vagrant virtualboxes
+            fname = fname.replace('/run/host', '')
+            fname = fname.replace('/vagrant', self.curdir)
+            # Heuristic to process strace files from remote VM, mounted by sshmnt
+            fname = re.sub(
+                fr'''/mnt/.*{lastdirs}''', abs_path_to_out_dir, fname)
+            fname = re.sub(self.spec.install_dir,
+                           abs_path_to_out_dir, fname)
+            if os.path.isabs(fname):
+                fname = os.path.abspath(fname)
+                if fname.startswith(abs_path_to_out_dir):
+                    if os.path.islink(fname):
+                        link_ = os.readlink(fname)
+                        fname = os.path.join(os.path.split(fname)[0], link_)
+                    relpath = os.path.relpath(os.path.abspath(fname), start=self.out_dir)
+                    used_files.add(relpath)
 
         with open(os.path.join(self.curdir, self.used_files_path), 'w') as lf:
             lf.write(yaml.dump(sorted(list(used_files))))
@@ -5113,59 +5648,52 @@ toolbox -c {self.container_name} run $@
 
         used_files = yaml.unsafe_load(open(self.used_files_path, 'r'))
 
-        file_source_table = yaml.unsafe_load(open(self.files_source_path, 'r'))
-        file_source = list(file_source_table.values())
-
-        bin_files_sources = yaml.unsafe_load(open(self.bin_files_sources_path, 'r'))
-
-        removed_paths = []
+        manifest_ = self.open_build_manifest()
+        if not self.args.minimize_dry_run:
+            # minimization starts from the full packed build every time
+            manifest_.clear_removed()
+        file_source_table = manifest_.file_table()
+        bin_files_sources = manifest_.bin_sources()
+
+        minimizer_ = Minimizer(self.out_dir, self.jobs)
+        minimizer_.reach(used_files or [])
+        removed_relnames = []
+        if used_files:
+            # keep libraries that kept binaries need, even if tests did not touch them
+            seeds_ = set(minimizer_.used) | set(r_ for r_ in file_source_table if self.br.is_needed(r_))
+            elf_deps_ = ElfDeps(os.path.join(self.curdir, self.elf_deps_cache_path))
+            closure_ = elf_closure(minimizer_.index, seeds_, elf_deps_, aliases=[self.spec.install_dir])
+            elf_deps_.save()
+            print(f"ELF closure: {len(closure_ - minimizer_.used)} files added to used ones, {elf_deps_.parsed} ELF files parsed")
+            minimizer_.used |= closure_
+            removed_relnames = minimizer_.plan(list(file_source_table.keys()), self.br.is_needed)
+
+        report_ = minimizer_.saved_by_source({r_: f_.source for r_, f_ in file_source_table.items()})
+        with open(os.path.join(self.curdir, self.minimization_report_path), 'w') as lf:
+            lf.write(yaml.dump(report_, allow_unicode=True, sort_keys=False))
+        print(f"Minimization: {len(minimizer_.deleted)} files, "
+              f"{sum(v_[1] for v_ in report_.values())/1024/1024:.1f} Mb, {len(minimizer_.broken_links)} broken links")
+        for source_, (files_, bytes_) in list(report_.items())[:30]:
+            print(f"{bytes_/1024/1024:10.1f} Mb {files_:7} files  {source_}")
+
+        if self.args.minimize_dry_run:
+            print(f"Dry run, nothing is deleted, see {self.minimization_report_path}")
+            manifest_.close()
+            return
 
-        used_files_resolved = set()
-        out_dir_ = Path(os.path.abspath(self.out_dir))
-        for uf in used_files:
-            if 'libzbar.so' in uf:
-                wtf = 1
-            path_ = out_dir_ / uf
-            while path_.is_symlink():
-                path_ = path_.resolve()
-            if path_.exists() and path_.is_relative_to(out_dir_):
-                rpp_ = str(path_.relative_to(out_dir_))
-                used_files_resolved.add(rpp_)
-
-        for fib in list(file_source_table.keys()):
-            rp_ = fib
-            if '.gitattributes' in rp_:
-                wtf = 1
-            if 'sotruss-lib.so' in rp_:
-                wtf = 1
-            if used_files and not self.br.is_needed(rp_):
-                if rp_ not in used_files_resolved:
-                    if rp_ in bin_files_sources:
-                        del bin_files_sources[ rp_ ]
-                    del file_source_table[fib]
-                    path_ = Path(self.out_dir) / rp_
-                    if path_.exists():
-                        if not path_.is_symlink():
-                            path_.unlink(missing_ok=True)
-                            removed_paths.append(rp_)
-
-        # killing broken links
-        for path in Path(self.out_dir).rglob('*'):
-            # rp_ = str(path.absolute())
-            if 'libtiff.so.5' in rp_:
-                wtf = 1
-            if path.is_symlink() and not path.resolve().exists():
-                path.unlink(missing_ok=True)
-        pass
+        for rp_ in removed_relnames:
+            bin_files_sources.pop(rp_, None)
+        minimizer_.apply()
+        removed_paths = minimizer_.deleted
 
         with open(os.path.join(self.curdir, 'tmp/last-removed-paths.yml'), 'w') as lf:
             lf.write(yaml.dump(removed_paths))
 
-        with open(os.path.join(self.curdir, self.files_source_after_minimization_path), 'w') as lf:
-            lf.write(yaml.dump(file_source_table))
-
-        with open(os.path.join(self.curdir, self.bin_files_sources_after_minimization_path), 'w') as lf:
-            lf.write(yaml.dump(bin_files_sources))
+        manifest_.remove(removed_relnames)
+        manifest_.set_meta('minimized', 1)
+        manifest_.export_yaml(os.path.join(self.curdir, self.files_source_after_minimization_path),
+                              os.path.join(self.curdir, self.bin_files_sources_after_minimization_path))
+        manifest_.close()
 
         # bf_ = [os.path.abspath(f) for f in self.bin_files if os.path.isabs(f)] + [os.path.join(root_dir, f) for f in self.bin_files if not os.path.isabs(f)]
         bf_ = [Path(os.path.abspath(self.out_dir)) / f for f in bin_files_sources]
@@ -5194,12 +5722,8 @@ toolbox -c {self.container_name} run $@
         Make DEB/RPM/ISO packages
         '''
         if not self.build_mode:
-            lines = [
-                f'''
-{sys.executable} {sys.argv[0]} {self.args.specfile} --stage-make-packages
-                ''']
             mn_ = get_method_name()
-            self.lines2sh(mn_, lines, mn_)
+            self.write_shell_file_for_method(mn_)
             return
 
         if not self.args.stage_make_packages:
@@ -5218,9 +5742,6 @@ toolbox -c {self.container_name} run $@
 
         git_version = self.get_version()
 
-        nfpm_dir = os.path.join(self.curdir, 'tmp/nfpm')
-        mkdir_p(nfpm_dir)
-
         current_time = datetime.datetime.now().replace(microsecond=0)
         time_ = current_time.isoformat().replace(':', '').replace('-', '').replace('T', '')
         version_with_time = f"{git_version}-{time_}"
@@ -5264,48 +5785,125 @@ toolbox -c {self.container_name} run $@
         if isinstance(self.spec.label, list):
             labels = self.spec.label
 
+        package_modes = self.package_modes
+        metrics_ = {}
+        self.cmd(f'chmod a+x {root_dir}/install-me')
+
+        # installed release is marked, delta updates check it
+        release_path_ = os.path.join(root_dir, RELEASE_FILE)
+        if os.path.lexists(release_path_):
+            os.unlink(release_path_)
+        open(release_path_, 'w', encoding='utf-8').write(version_with_time)
+
+        # manifest of this release is saved to changelogs, it is the base of the next delta
+        manifest_ = self.open_build_manifest()
+        rel2source_ = {r_.relname: r_.source for r_ in manifest_.files()}
+        manifest_.close()
+        release_ = {'version': version_with_time, 'files': release_manifest(root_dir, self.jobs, rel2source_)}
+        changelog_dir_ = str(Path(self.curdir) / self.changelogdir)
+        prev_manifest_path = previous_manifest(changelog_dir_)
+
+        makeself_ = None
+        if 'iso' in package_modes:
+            makeself_ = self.makeself_options()
+
+        sched_ = PackagingScheduler(self.packaging_jobs or self.jobs, os.path.join(self.curdir, self.stage_logs_dir))
         for label_ in labels:
             isofilename = f"{deployname(label_)}.iso"
-            chp_ = os.path.join(root_dir, 'isodistr.txt')
+            if len(labels) == 1:
+                label_dir = root_dir
+            else:
+                # every label has its own «isodistr.txt», so labels are packed from hardlinked copies of out
+                label_dir = os.path.join(self.curdir, 'tmp/package-staging', label_.lower())
+                hardlink_tree(root_dir, label_dir)
+            chp_ = os.path.join(label_dir, 'isodistr.txt')
+            if os.path.lexists(chp_):
+                os.unlink(chp_)
             open(chp_, 'w', encoding='utf-8').write(isofilename)
 
-            package_modes = self.package_modes
+            for packagetype in ['rpm', 'deb']:
+                if not packagetype in package_modes:
+                    continue
+                nfpm_dir = self.nfpm_config(label_, label_dir, f"v{git_version}-{time_}")
+                sched_.add(f'{label_}-{packagetype}',
+                           functools.partial(self.make_nfpm_package, sched_, label_, packagetype, nfpm_dir,
+                                             f"{deployname(label_)}.{packagetype}"))
+
+            if 'iso' in package_modes:
+                sched_.add(f'{label_}-iso',
+                           functools.partial(self.make_iso_package, sched_, label_, label_dir, isofilename, makeself_))
+
+        if 'delta' in package_modes:
+            if prev_manifest_path:
+                delta_ = DeltaPackage(root_dir, load_manifest(prev_manifest_path), release_)
+                makeself_delta = self.makeself_options('makeself-delta-header.sh',
+                                                       delta_from=delta_.old['version'], delta_to=version_with_time)
+                sched_.add('delta', functools.partial(self.make_delta_package, sched_, labels[0], delta_, makeself_delta))
+            else:
+                print(f'No release manifest in {changelog_dir_}, delta package is not built')
+
+        results_ = sched_.run()
+        metrics_['artifacts'] = results_
+        failed_ = [name_ for name_, res_ in results_.items() if res_.get('exit_code') != 0]
+        if failed_:
+            print(f'Packaging of {", ".join(failed_)} failed!')
+            return metrics_
+
+        save_manifest(os.path.join(changelog_dir_, f'{version_with_time}{MANIFEST_SUFFIX}'), version_with_time, release_['files'])
+
+        # «last» links point to the artifacts of the last label, as before
+        for packagetype in ['rpm', 'deb', 'iso']:
+            if packagetype in package_modes:
+                package_dir = os.path.join(self.curdir, f'{self.out_dir}.{packagetype}')
+                last_ = os.path.join(package_dir, f'last-{labels[-1]}.{packagetype}')
+                if packagetype == 'iso':
+                    last_ = os.path.join(package_dir, f'{deployname(labels[-1])}.iso')
+                if os.path.lexists(last_):
+                    self.cmd(f'ln -sf {os.readlink(last_) if os.path.islink(last_) else os.path.basename(last_)} {package_dir}/last.{packagetype}')
+        os.chdir(self.curdir)
+        return metrics_
+
+    def nfpm_config(self, label_, src_dir, version_):
+        '''
+        Directory with nfpm.yaml and scripts for label.
+        '''
+        nfpm_dir = os.path.join(self.curdir, 'tmp/nfpm', label_.lower())
+        mkdir_p(nfpm_dir)
 
-            os.chdir(nfpm_dir)
-            install_mod = ''
-            postinst_script_path_ = os.path.join(nfpm_dir, 'postinstall.sh')
-            Path(postinst_script_path_).unlink(missing_ok=True)
-            if 'post_installer' in self.spec:
-                with open(postinst_script_path_, 'w', encoding='utf-8') as lf:
-                    lf.write(f'''
+        install_mod = ''
+        postinst_script_path_ = os.path.join(nfpm_dir, 'postinstall.sh')
+        Path(postinst_script_path_).unlink(missing_ok=True)
+        if 'post_installer' in self.spec:
+            with open(postinst_script_path_, 'w', encoding='utf-8') as lf:
+                lf.write(f'''
 #!/bin/bash
 {self.spec.post_installer}
 # may be we have to do something when error occurs. rollback???
 exit $?
-            '''.strip())
-                install_mod ="""
+        '''.strip())
+            install_mod ="""
       postinstall: ./postinstall.sh
     """
 
-            remove_mod = ''
-            pre_remove_script_path_ = os.path.join(nfpm_dir, 'pre_remove.sh')
-            Path(pre_remove_script_path_).unlink(missing_ok=True)
-            if 'pre_remove' in self.spec:
-                with open(pre_remove_script_path_, 'w', encoding='utf-8') as lf:
-                    lf.write(f'''
+        remove_mod = ''
+        pre_remove_script_path_ = os.path.join(nfpm_dir, 'pre_remove.sh')
+        Path(pre_remove_script_path_).unlink(missing_ok=True)
+        if 'pre_remove' in self.spec:
+            with open(pre_remove_script_path_, 'w', encoding='utf-8') as lf:
+                lf.write(f'''
 #!/bin/bash
 {self.spec.pre_remove}
-                '''.strip())
-                    remove_mod ="""
+            '''.strip())
+                remove_mod ="""
       preremove: ./pre_remove.sh
     """
 
-            with open(os.path.join(nfpm_dir, 'nfpm.yaml'), 'w', encoding='utf-8') as lf:
-                lf.write(f'''
+        with open(os.path.join(nfpm_dir, 'nfpm.yaml'), 'w', encoding='utf-8') as lf:
+            lf.write(f'''
 name: "{label_.lower()}"
 arch: "amd64"
 platform: "linux"
-version: "v{git_version}-{time_}"
+version: "{version_}"
 section: "default"
 priority: "extra"
 maintainer: "{self.spec.maintainer}"
@@ -5314,7 +5912,7 @@ vendor: "{self.spec.vendor} "
 homepage: "{self.spec.homepage} "
 license: "{self.spec.license}"
 contents:
-- src: ../../out
+- src: {src_dir}
   dst: "{self.spec.install_dir}"
 overrides:
   rpm:
@@ -5325,99 +5923,148 @@ overrides:
     scripts:
 {install_mod}
 {remove_mod}
-    ''')
-            for packagetype in ['rpm', 'deb']:
-                if not packagetype in package_modes:
-                    continue
-                pkgdir = '../../' + self.out_dir + '.'+ packagetype
-                os.chdir(nfpm_dir)
-                mkdir_p(pkgdir)
-                scmd = f'''
-    {self.tb_mod} nfpm pkg --packager {packagetype} --target {pkgdir}
-        '''.strip()
-                self.cmd(scmd)
-
-                package_dir = f'out.{packagetype}'
-                os.chdir(self.curdir)
-                os.chdir(package_dir)
-                paths = sorted([f for f in Path('').glob(f'*.{packagetype}') if f.is_file() and not f.is_symlink()], key=os.path.getmtime)
-                fname_ = paths[-1]
-                scmd = f'''ln -sf {fname_} last.{packagetype}'''
-                self.cmd(scmd)
-                scmd = f'''ln -sf {fname_} last-{label_}.{packagetype}'''
-                self.cmd(scmd)
-        pass
-
-        for packagetype in ['iso']:
-            if not packagetype in package_modes:
-                continue
-
-            os.chdir(self.curdir)
-
-            isodir = self.out_dir + '.iso'
-            mkdir_p(isodir)
-
-            installscript = "install-me.sh" % vars()
-            os.chdir(self.curdir)
-            installscriptpath = os.path.abspath(
-                os.path.join("tmp/", installscript))
-            if os.path.exists(installscriptpath):
-                os.unlink(installscriptpath)
-
-            pmode = ''
-            if shutil.which('pbzip2'):
-                pmode = ' --threads 8 --pbzip2 '
-            os.chdir(self.curdir)
-            self.cmd(f'chmod a+x {root_dir}/install-me')
-
-
-            # res_ = list(p for p in self.installed_packages if p.name=='makeself')
-            add_opts = ''
-            if 1:
-                # version_ = res_[0].version
-                # if version.parse(version_) >= version.parse("2.4.5"):
-                add_opts = ' --tar-format posix '
-
-                path_to_dir = Path(__file__).parent
-                makeself_header_template_path = path_to_dir / "ta-makeself-header.sh"
-                assert(makeself_header_template_path.exists())
-                makeself_header_template = ''
-
-                file_loader = FileSystemLoader(path_to_dir)
-                env = Environment(loader=file_loader)
-                env.trim_blocks = True
-                env.lstrip_blocks = True
-                env.rstrip_blocks = True
-
-                # makeself_header = makeself_header_template.format(vars())
-                template = env.get_template(makeself_header_template_path.name)
-                makeself_header = template.render(self.tvars)
-
-                makeself_header_path = 'tmp/makeself-header.sh'
-                with open(makeself_header_path, 'w', encoding='utf-8') as lf:
-                    lf.write(makeself_header)
+''')
+        return nfpm_dir
+
+    def make_nfpm_package(self, sched_, label_, packagetype, nfpm_dir, package_name):
+        '''
+        RPM/DEB package of label by nfpm.
+        File name is given to nfpm explicitly, so package of one label is never taken
+        for package of other label with the same prefix.
+        '''
+        package_dir = os.path.join(self.curdir, f'{self.out_dir}.{packagetype}')
+        mkdir_p(package_dir)
+        fname_ = Path(package_dir) / package_name
+        fname_.unlink(missing_ok=True)
+        scmd = f'cd {nfpm_dir} && {self.tb_mod} nfpm pkg --packager {packagetype} --target {fname_}'
+        res_ = sched_.run_cmd(f'{label_}-{packagetype}', scmd)
+        if res_['exit_code'] != 0:
+            return res_
+        if not fname_.is_file():
+            res_.update(exit_code=1, error=f'nfpm did not write {fname_}')
+            return res_
+        subprocess.call(['ln', '-sf', fname_.name, os.path.join(package_dir, f'last-{label_}.{packagetype}')])
+        res_['size_mb'] = round(fname_.stat().st_size/1024/1024, 1)
+        res_['file'] = str(fname_)
+        return res_
 
-                scmd = (f'''
-{self.tb_mod} makeself.sh {pmode} {add_opts} --header {makeself_header_path} --target "{self.spec.install_dir}" --tar-extra "--xattrs --xattrs-include=*" --untar-extra " --xattrs --xattrs-include=*"  --needroot {root_dir} {installscriptpath} "Installation" {self.spec.install_dir}/install-me
-        ''' % vars()).replace('\n', ' ').strip()
-                if not self.cmd(scmd) == 0:
-                    print(f'« {scmd} » failed!')
-                    return
-            os.chdir(self.curdir)
-            isofilepath = os.path.join(isodir, isofilename)
-            scmd = f'''{self.tb_mod} mkisofs -r -J -o  {isofilepath}  {installscriptpath}'''
-            self.cmd(scmd)
-            scmd = f'''{self.tb_mod} md5sum {isofilepath}'''
-            os.chdir(self.curdir)
-            md5s_ = subprocess.check_output(
-                scmd, shell=True).decode('utf-8').strip().split()[0]
-            lines_.insert(0, f';MD5: {md5s_}')
-            open(f'{isodir}/{deployname}.md5', 'w', encoding='utf-8').write(md5s_)
+    def makeself_options(self, header_name='makeself-header.sh', **extra_tvars):
+        '''
+        Compression options for makeself and rendered header.
+        '''
+        codec_ = self.makeself_codec or ('pbzip2' if shutil.which('pbzip2') else 'gzip')
+        pmode = ''
+        env_mod = ''
+        unpack_cmd = '$GUNZIP_CMD'
+        if codec_ == 'pbzip2':
+            pmode = ' --threads 8 --pbzip2 '
+        elif codec_ == 'zstd':
+            pmode = ' --zstd --threads 0 '
+            unpack_cmd = 'zstd -T0 -dc'
+            if self.makeself_window:
+                # makeself has no option for long window, so «zstd» first in PATH adds it
+                wrapper_dir = os.path.abspath('tmp/ta-zstd')
+                mkdir_p(wrapper_dir)
+                wrapper_ = Path(wrapper_dir) / 'zstd'
+                wrapper_.write_text(f'#!/bin/sh\nexec /usr/bin/zstd --long={self.makeself_window} "$@"\n')
+                wrapper_.chmod(0o755)
+                env_mod = f'env PATH={wrapper_dir}:/usr/local/bin:/usr/bin:/bin'
+                unpack_cmd += f' --long={self.makeself_window}'
+        if self.makeself_level:
+            pmode += f' --complevel {self.makeself_level} '
+
+        # res_ = list(p for p in self.installed_packages if p.name=='makeself')
+        # version_ = res_[0].version
+        # if version.parse(version_) >= version.parse("2.4.5"):
+        add_opts = ' --tar-format posix '
+
+        path_to_dir = Path(__file__).parent
+        makeself_header_template_path = path_to_dir / "ta-makeself-header.sh"
+        assert(makeself_header_template_path.exists())
+
+        file_loader = FileSystemLoader(path_to_dir)
+        env = Environment(loader=file_loader)
+        env.trim_blocks = True
+        env.lstrip_blocks = True
+        env.rstrip_blocks = True
+
+        template = env.get_template(makeself_header_template_path.name)
+        makeself_header = template.render(dict(self.tvars, makeself_unpack_cmd=unpack_cmd, **extra_tvars))
+
+        makeself_header_path = os.path.join(self.curdir, 'tmp', header_name)
+        with open(makeself_header_path, 'w', encoding='utf-8') as lf:
+            lf.write(makeself_header)
+        return {'codec': codec_, 'pmode': pmode, 'env_mod': env_mod, 'add_opts': add_opts, 'header': makeself_header_path}
+
+    def make_iso_package(self, sched_, label_, label_dir, isofilename, makeself_):
+        '''
+        Makeself installer of label in ISO, MD5 is computed while ISO is written.
+        '''
+        installscriptpath = os.path.join(self.curdir, 'tmp/makeself', label_.lower(), "install-me.sh")
+        mkdir_p(os.path.dirname(installscriptpath))
+        if os.path.exists(installscriptpath):
+            os.unlink(installscriptpath)
+
+        scmd = (f'''
+{self.tb_mod} {makeself_['env_mod']} makeself.sh {makeself_['pmode']} {makeself_['add_opts']} --header {makeself_['header']} --target "{self.spec.install_dir}" --tar-extra "--xattrs --xattrs-include=*" --untar-extra " --xattrs --xattrs-include=*"  --needroot {label_dir} {installscriptpath} "Installation" {self.spec.install_dir}/install-me
+        ''').replace('\n', ' ').strip()
+        start_ = time.time()
+        res_ = sched_.run_cmd(f'{label_}-makeself', scmd)
+        if res_['exit_code'] != 0:
+            print(f'« {scmd} » failed!')
+            return res_
+        packed_size_ = os.path.getsize(installscriptpath)
+        out_size_ = folder_size(label_dir, follow_symlinks=False)
+        res_['makeself'] = {
+            'codec': makeself_['codec'],
+            'level': self.makeself_level,
+            'seconds': round(time.time() - start_, 1),
+            'size_mb': round(packed_size_/1024/1024, 1),
+            'out_size_mb': round(out_size_/1024/1024, 1),
+            'ratio': round(out_size_/packed_size_, 2) if packed_size_ else None,
+        }
+        print(f"Makeself {label_}: {res_['makeself']}")
+
+        isodir = os.path.join(self.curdir, self.out_dir + '.iso')
+        mkdir_p(isodir)
+        isofilepath = os.path.join(isodir, isofilename)
+        iso_ = stream_with_md5(f'{self.tb_mod} mkisofs -r -J {installscriptpath}', isofilepath,
+                               sched_.log_path(f'{label_}-iso'))
+        res_['exit_code'] = iso_['exit_code']
+        if iso_['exit_code'] != 0:
+            return res_
+        res_['md5'] = iso_['md5']
+        res_['size_mb'] = round(iso_['size']/1024/1024, 1)
+        res_['file'] = isofilepath
+        open(os.path.join(isodir, f'{os.path.splitext(isofilename)[0]}.md5'), 'w', encoding='utf-8').write(iso_['md5'])
+        return res_
 
-            os.chdir(isodir)
-            scmd = f'''ln -sf {isofilename} last.iso'''
-            self.cmd(scmd)
-            os.chdir(self.curdir)
+    def make_delta_package(self, sched_, label_, delta_, makeself_):
+        '''
+        Self-applying makeself update from previous release (only added, changed and removed files).
+        '''
+        summary_ = delta_.summary()
+        print(f"Delta {label_}: {summary_}")
+        delta_dir = os.path.join(self.curdir, 'tmp/delta', label_.lower())
+        delta_.stage(delta_dir, self.spec.install_dir)
+
+        package_dir = os.path.join(self.curdir, f'{self.out_dir}.delta')
+        mkdir_p(package_dir)
+        deltapath = os.path.join(package_dir, f"{label_.lower()}-{summary_['from']}-to-{summary_['to']}.sh")
+        # no «--target»: update is unpacked to temporary dir and applied to install_dir by script
+        scmd = (f'''
+{self.tb_mod} {makeself_['env_mod']} makeself.sh {makeself_['pmode']} {makeself_['add_opts']} --header {makeself_['header']} --tar-extra "--xattrs --xattrs-include=*" --untar-extra " --xattrs --xattrs-include=*"  --needroot {delta_dir} {deltapath} "Update {summary_['from']} to {summary_['to']}" ./{DELTA_SCRIPT} {self.spec.install_dir}
+        ''').replace('\n', ' ').strip()
+        res_ = sched_.run_cmd('delta', scmd)
+        if res_['exit_code'] != 0:
+            print(f'« {scmd} » failed!')
+            return res_
+        subprocess.call(['ln', '-sf', os.path.basename(deltapath), os.path.join(package_dir, 'last.delta.sh')])
+        res_['delta'] = summary_
+        res_['by_source'] = delta_.by_source()
+        res_['size_mb'] = round(os.path.getsize(deltapath)/1024/1024, 1)
+        res_['file'] = deltapath
+        return res_
 
 
     def stage_94_install_develop_nuitka(self):
@@ -5434,6 +6081,56 @@ overrides:
         pass
 
 
+    def container_identity(self):
+        '''
+        ID of build container, to know when it was recreated.
+        '''
+        if not self.toolbox_mode:
+            return ''
+        res_ = subprocess.run(['podman', 'container', 'inspect', '--format', '{{.Id}}', self.container_name],
+                              capture_output=True, text=True)
+        if res_.returncode != 0:
+            return 'missing'
+        return res_.stdout.strip()
+
+    def venv_identity(self):
+        '''
+        Build virtualenv is recreated by stages 22 and 27, so it is pseudo resource, not folder
+        (fingerprint of folder, changed by stage 27, would restart stages 24-27 every time).
+        '''
+        if os.path.exists(os.path.join(self.curdir, '.venv/bin/python3')):
+            return 'present'
+        return 'missing'
+
+    def abs_resources(self, resources):
+        '''
+        Absolute paths of stage inputs/outputs, pseudo resources («@container») as is.
+        '''
+        if resources is None:
+            return None
+        return [r_ if r_.startswith('@') else os.path.abspath(os.path.join(self.curdir, r_))
+                for r_ in resources]
+
+    def run_stages(self):
+        '''
+        Run selected stages by stage runner.
+        '''
+        self.graph.load(os.path.join(self.curdir, self.states_path, 'dag'),
+                        {'@container': self.container_identity, '@venv': self.venv_identity},
+                        index_dir=os.path.join(self.curdir, self.folderhash_index_dir))
+        runner = StageRunner(self.jobs, self.curdir,
+                             os.path.join(self.curdir, self.stage_run_report_path),
+                             os.path.join(self.curdir, self.stage_logs_dir),
+                             graph=self.graph)
+        dict_ = vars(self.args)
+        for s_ in self.stages_names:
+            if not dict_.get(fname2stage(s_)):
+                continue
+            if s_ in self.stage_tasks:
+                runner.add(self.stage_tasks[s_])
+        if runner.tasks:
+            runner.run()
+
     def process(self):
         '''
         Основная процедура генерации переносимого питон окружения.
@@ -5456,8 +6153,7 @@ overrides:
             stage_()
 
         self.build_mode = True
-        for stage_ in self.stage_methods:
-            stage_()
+        self.run_stages()
 
 #         self.lines2sh("91-pack-debug", [
 #             f'''
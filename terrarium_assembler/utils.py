@@ -2,6 +2,7 @@
     Different (geeky) utils for TA
 """
 import os
+import sys
 import magic
 import subprocess
 import shutil
@@ -14,11 +15,13 @@ import itertools
 
 import inspect
 import hashlib
+import concurrent.futures
 
 def bashash4folder(var, folder):
 #     scmd =f'''HASH_{var}=`tar cf - -C {folder} --mtime='1970-01-01' --format=pax --pax-option="exthdr.name=%d/PaxHeaders.0/%f,delete=atime,delete=ctime"  --numeric-owner --owner=0 --group=0 --mode='aou+rwx' --exclude=build  --exclude=.eggs --exclude=.git  --exclude='*.egg-info'  . | md5sum`
 # '''
-    scmd =f'''HASH_{var}=`cd {folder}; md5deep -r -l -of . | sort | md5sum`
+    # scmd =f'''HASH_{var}=`cd {folder}; md5deep -r -l -of . | sort | md5sum`
+    scmd =f'''HASH_{var}=`{sys.executable} -m terrarium_assembler.folderhash --stat "{folder}"`
 '''
     return scmd
 
@@ -110,6 +113,33 @@ def split_seq(iterable, size):
         yield item
         item = list(itertools.islice(it, size))
 
+def map_ordered(func, items, jobs=1):
+    '''
+    Apply func to all items on a bounded pool of threads.
+    Results are returned in the order of items, so merging them stays deterministic.
+    With jobs <= 1 works as plain map in the current thread.
+    '''
+    items = list(items)
+    if jobs <= 1 or len(items) < 2:
+        return [func(it_) for it_ in items]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool_:
+        return list(pool_.map(func, items))
+
+
+def file_digest(path, algo='sha256', bufsize=1024*1024):
+    '''
+    Hex digest of file content.
+    '''
+    h_ = hashlib.new(algo)
+    with open(path, 'rb') as lf:
+        while True:
+            chunk_ = lf.read(bufsize)
+            if not chunk_:
+                break
+            h_.update(chunk_)
+    return h_.hexdigest()
+
+
 def j2_hash_filter(value, hash_type="sha1"):
     """
     Example filter providing custom Jinja2 filter - hash
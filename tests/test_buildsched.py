@@ -0,0 +1,59 @@
+"""Tests for `terrarium_assembler.buildsched`."""
+
+import json
+
+from terrarium_assembler.buildsched import BuildScheduler, BuildTarget
+
+
+def make_script(tmp_path, name, body):
+    path_ = tmp_path / name
+    path_.write_text('#!/bin/bash\n' + body + '\n')
+    path_.chmod(0o755)
+    return name
+
+
+def test_order_by_group_and_history(tmp_path):
+    history_ = tmp_path / 'durations.json'
+    history_.write_text(json.dumps({'short': 1, 'long': 100}))
+    sched_ = BuildScheduler(4, None, str(history_), str(tmp_path / 'logs'))
+    targets_ = [BuildTarget('short', 's', group=2), BuildTarget('long', 's', group=2),
+                BuildTarget('unknown', 's', group=2), BuildTarget('custom', 's', group=0)]
+    assert [t_.name for t_ in sched_.order(targets_)] == ['custom', 'unknown', 'long', 'short']
+
+
+def test_budgets(tmp_path):
+    # every target writes start/end marks, overlapping targets see each other
+    body_ = 'echo start $1 >> marks; sleep 0.3; echo end $1 >> marks'
+    make_script(tmp_path, 'build.sh', body_)
+    sched_ = BuildScheduler(4, 8, str(tmp_path / 'durations.json'), str(tmp_path / 'logs'), cwd=str(tmp_path))
+    targets_ = [BuildTarget(f't{i_}', 'build.sh', cpus=2, memory_gb=2, args=(f't{i_}',)) for i_ in range(4)]
+    results_ = sched_.run(targets_)
+    assert all(r_['exit_code'] == 0 for r_ in results_.values())
+
+    running_ = 0
+    max_running_ = 0
+    for line_ in (tmp_path / 'marks').read_text().split('\n'):
+        if line_.startswith('start'):
+            running_ += 1
+        elif line_.startswith('end'):
+            running_ -= 1
+        max_running_ = max(max_running_, running_)
+    assert max_running_ == 2
+    assert set(json.loads((tmp_path / 'durations.json').read_text())) == {'t0', 't1', 't2', 't3'}
+
+
+def test_group_barrier_and_failures(tmp_path):
+    make_script(tmp_path, 'ok.sh', 'echo $1 >> marks')
+    make_script(tmp_path, 'fail.sh', 'exit 3')
+    sched_ = BuildScheduler(8, None, str(tmp_path / 'durations.json'), str(tmp_path / 'logs'), cwd=str(tmp_path))
+    results_ = sched_.run([
+        BuildTarget('late', 'ok.sh', group=1, args=('late',)),
+        BuildTarget('early', 'ok.sh', group=0, args=('early',)),
+        BuildTarget('failed', 'fail.sh', group=0),
+        BuildTarget('missing', 'no-such-script.sh', group=0),
+    ])
+    assert (tmp_path / 'marks').read_text().split() == ['early', 'late']
+    assert results_['failed']['exit_code'] == 3
+    assert results_['missing']['exit_code'] != 0
+    # history is saved even if some target could not be started
+    assert set(json.loads((tmp_path / 'durations.json').read_text())) == {'early', 'late'}
@@ -0,0 +1,93 @@
+"""Tests for `terrarium_assembler.delta`."""
+
+import os
+import shutil
+import subprocess
+
+from terrarium_assembler.delta import (DeltaPackage, RELEASE_FILE, diff_manifests,
+                                       release_manifest, save_manifest, load_manifest)
+
+
+def write(root, rel, content):
+    path_ = os.path.join(root, rel)
+    os.makedirs(os.path.dirname(path_), exist_ok=True)
+    with open(path_, 'w', encoding='utf-8') as lf:
+        lf.write(content)
+
+
+def test_diff_manifests():
+    old_ = {'a': ['h1', 0o644, 1, None], 'b': ['h2', 0o644, 1, None], 'c': ['h3', 0o644, 1, None],
+            'd': ['h4', 0o644, 1, None]}
+    new_ = {'a': ['h1', 0o644, 1, None], 'b': ['h2x', 0o644, 1, None], 'c': ['h3', 0o755, 1, None],
+            'e': ['link:a', 0o777, 0, None]}
+    assert diff_manifests(old_, new_) == (['e'], ['b', 'c'], ['d'])
+
+
+def test_stage_and_apply(tmp_path):
+    old_root_ = str(tmp_path / 'old')
+    new_root_ = str(tmp_path / 'new')
+    write(old_root_, 'bin/tool', 'v1')
+    write(old_root_, 'lib64/libold.so', 'old')
+    write(old_root_, 'share/same.txt', 'same')
+    write(new_root_, 'bin/tool', 'v2')
+    write(new_root_, 'lib64/libnew.so', 'new')
+    write(new_root_, 'share/same.txt', 'same')
+    os.symlink('libnew.so', os.path.join(new_root_, 'lib64/libnew.so.1'))
+    write(new_root_, RELEASE_FILE, '2\n')
+
+    old_ = {'version': '1', 'files': release_manifest(old_root_)}
+    new_ = {'version': '2', 'files': release_manifest(new_root_, rel2source={'bin/tool': 'tool'})}
+    assert RELEASE_FILE not in new_['files']
+    manifest_path_ = str(tmp_path / 'changelogs' / '2.manifest.json.gz')
+    save_manifest(manifest_path_, '2', new_['files'])
+    assert load_manifest(manifest_path_) == new_
+
+    delta_ = DeltaPackage(new_root_, old_, new_)
+    assert delta_.summary()['added'] == 2
+    assert delta_.summary()['changed'] == 1
+    assert delta_.summary()['removed'] == 1
+    assert delta_.by_source()['tool'] == {'changed': 1}
+
+    delta_dir_ = str(tmp_path / 'delta')
+    target_ = str(tmp_path / 'installed')
+    delta_.stage(delta_dir_, target_)
+    assert sorted(os.listdir(os.path.join(delta_dir_, 'payload'))) == ['bin', 'lib64']
+
+    # delta is refused for other installed release
+    shutil.copytree(old_root_, target_)
+    script_ = os.path.join(delta_dir_, 'ta-apply-delta.sh')
+    assert subprocess.run([script_], capture_output=True).returncode != 0
+
+    write(target_, RELEASE_FILE, '1\n')
+    subprocess.check_call([script_], stdout=subprocess.DEVNULL)
+    assert release_manifest(target_) == release_manifest(new_root_)
+    assert not os.path.exists(os.path.join(target_, 'lib64', 'libold.so'))
+    # second run does nothing
+    subprocess.check_call([script_], stdout=subprocess.DEVNULL)
+
+
+def test_symlink_becomes_file(tmp_path):
+    '''
+    Symlink of old release (f.e. by «dedup: symlink») replaced by regular file:
+    file it pointed to must not be overwritten.
+    '''
+    old_root_ = str(tmp_path / 'old')
+    new_root_ = str(tmp_path / 'new')
+    write(old_root_, 'lib64/libfoo.so', 'canonical')
+    os.symlink('libfoo.so', os.path.join(old_root_, 'lib64/libfoo-copy.so'))
+    write(new_root_, 'lib64/libfoo.so', 'canonical')
+    write(new_root_, 'lib64/libfoo-copy.so', 'changed copy')
+
+    old_ = {'version': '1', 'files': release_manifest(old_root_)}
+    new_ = {'version': '2', 'files': release_manifest(new_root_)}
+    delta_dir_ = str(tmp_path / 'delta')
+    target_ = str(tmp_path / 'installed')
+    DeltaPackage(new_root_, old_, new_).stage(delta_dir_, target_)
+
+    shutil.copytree(old_root_, target_, symlinks=True)
+    write(target_, RELEASE_FILE, '1\n')
+    subprocess.check_call([os.path.join(delta_dir_, 'ta-apply-delta.sh')], stdout=subprocess.DEVNULL)
+    assert not os.path.islink(os.path.join(target_, 'lib64/libfoo-copy.so'))
+    with open(os.path.join(target_, 'lib64/libfoo.so'), encoding='utf-8') as lf:
+        assert lf.read() == 'canonical'
+    assert release_manifest(target_) == release_manifest(new_root_)
@@ -0,0 +1,25 @@
+"""Tests for `terrarium_assembler.elfdeps`."""
+
+import os
+
+import pytest
+
+from terrarium_assembler.elfdeps import elf_dynamic
+
+
+@pytest.mark.skipif(not os.path.exists('/bin/ls'), reason='no /bin/ls')
+def test_bin_ls():
+    dyn_ = elf_dynamic('/bin/ls')
+    assert dyn_ is not None
+    assert any(n_.startswith('libc.so') for n_ in dyn_['needed'])
+    assert dyn_['interp'] and 'ld-' in dyn_['interp']
+    assert dyn_['soname'] is None
+
+
+def test_not_elf(tmp_path):
+    text_ = tmp_path / 'script.sh'
+    text_.write_text('#!/bin/sh\necho hello, this is not ELF at all, but long enough to be read\n')
+    assert elf_dynamic(str(text_)) is None
+    broken_ = tmp_path / 'broken.so'
+    broken_.write_bytes(b'\x7fELF' + b'\xff' * 100)
+    assert elf_dynamic(str(broken_)) is None
@@ -0,0 +1,59 @@
+"""Tests for `terrarium_assembler.packmanifest`."""
+
+import os
+import collections
+
+from terrarium_assembler.packmanifest import PackManifest
+
+Op = collections.namedtuple('Op', 'kind path relname source')
+
+
+def pack(manifest, op, dst):
+    '''
+    What incremental packing does: keep unchanged file or copy it and record entry.
+    '''
+    entry_ = manifest.entry(op, op.kind)
+    kept_ = manifest.unchanged(op.relname, entry_, dst)
+    if not kept_:
+        with open(op.path, 'rb') as src_, open(dst, 'wb') as lf:
+            lf.write(src_.read())
+    manifest.record(op.relname, entry_)
+    manifest.save()
+    return kept_
+
+
+def test_touched_source_is_kept(tmp_path):
+    src_ = tmp_path / 'lib.so'
+    src_.write_bytes(b'content')
+    dst_ = tmp_path / 'out-lib.so'
+    mpath_ = str(tmp_path / 'pack-manifest.json')
+    op_ = Op('copy', str(src_), 'lib64/lib.so', 'pkg')
+
+    assert not pack(PackManifest(mpath_), op_, str(dst_))
+    # hash is recorded for copied file, not only when stat differs
+    assert PackManifest(mpath_).old['lib64/lib.so']['hash'] is not None
+
+    # rebuilt with the same bytes: new mtime, same content
+    st_ = os.stat(src_)
+    os.utime(src_, ns=(st_.st_atime_ns, st_.st_mtime_ns + 10**9))
+    assert pack(PackManifest(mpath_), op_, str(dst_))
+
+    src_.write_bytes(b'CONTENT')
+    assert not pack(PackManifest(mpath_), op_, str(dst_))
+    assert dst_.read_bytes() == b'CONTENT'
+
+
+def test_transform_and_stale(tmp_path):
+    src_ = tmp_path / 'bin'
+    src_.write_bytes(b'elf')
+    dst_ = tmp_path / 'out-bin'
+    mpath_ = str(tmp_path / 'pack-manifest.json')
+    pack(PackManifest(mpath_), Op('copy', str(src_), 'bin/x', 'pkg'), str(dst_))
+
+    manifest_ = PackManifest(mpath_)
+    # same source, other transform — file must be redone
+    assert not pack(manifest_, Op('patch_binary', str(src_), 'bin/x', 'pkg'), str(dst_))
+
+    manifest_ = PackManifest(mpath_)
+    manifest_.record('bin/y', manifest_.entry(Op('copy', str(src_), 'bin/y', 'pkg'), 'copy'))
+    assert manifest_.stale() == ['bin/x']
@@ -0,0 +1,41 @@
+"""Tests for `terrarium_assembler.packsched`."""
+
+import os
+import tempfile
+
+import pytest
+
+from terrarium_assembler.packsched import hardlink_tree
+
+
+def make_tree(root):
+    os.makedirs(os.path.join(root, 'bin'))
+    with open(os.path.join(root, 'bin', 'tool'), 'w') as lf:
+        lf.write('tool')
+    os.symlink('tool', os.path.join(root, 'bin', 'tool-link'))
+
+
+def test_hardlink_tree(tmp_path):
+    src_ = str(tmp_path / 'out')
+    make_tree(src_)
+    dst_ = str(tmp_path / 'staging' / 'label')
+    hardlink_tree(src_, dst_)
+    # second call replaces previous staging
+    hardlink_tree(src_, dst_)
+    assert os.path.samefile(os.path.join(src_, 'bin', 'tool'), os.path.join(dst_, 'bin', 'tool'))
+    assert os.readlink(os.path.join(dst_, 'bin', 'tool-link')) == 'tool'
+
+
+@pytest.mark.skipif(not os.path.isdir('/dev/shm') or os.stat('/dev/shm').st_dev == os.stat(tempfile.gettempdir()).st_dev,
+                    reason='no other filesystem')
+def test_hardlink_tree_other_fs(tmp_path):
+    # «out» on other filesystem (f.e. symlink to other disk) — tree is copied
+    with tempfile.TemporaryDirectory(dir='/dev/shm') as other_:
+        src_ = os.path.join(other_, 'out')
+        make_tree(src_)
+        dst_ = str(tmp_path / 'staging' / 'label')
+        hardlink_tree(src_, dst_)
+        with open(os.path.join(dst_, 'bin', 'tool')) as lf:
+            assert lf.read() == 'tool'
+        assert not os.path.samefile(os.path.join(src_, 'bin', 'tool'), os.path.join(dst_, 'bin', 'tool'))
+        assert os.readlink(os.path.join(dst_, 'bin', 'tool-link')) == 'tool'
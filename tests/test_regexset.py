@@ -0,0 +1,54 @@
+"""Tests for `terrarium_assembler.regexset`."""
+
+import re
+
+from terrarium_assembler.regexset import RegexSet
+
+PATTERNS = [
+    r'/usr/lib64/libQt5.*\.so.*$',
+    r'.*\.pyc$',
+    r'/usr/bin/python3$',
+    r'.*/site-packages/.*\.so$',
+    r'(?i).*\.TXT$',
+    r'/usr/(bin|sbin)/(\w+)-\2$',
+    r'/opt/(?P<name>\w+)/bin/.*$',
+    r'[/]etc/.*\.conf$',
+    r'/usr/lib64/libQt5Core\.so\.5$',
+    r'.*$',
+]
+
+FILES = [
+    '/usr/lib64/libQt5Core.so.5',
+    '/usr/lib64/libQt5Gui.so.5.15',
+    '/usr/lib/python3.10/__pycache__/os.cpython-310.pyc',
+    '/usr/bin/python3',
+    '/usr/bin/python3.10',
+    '/usr/lib64/python3.10/site-packages/numpy/core/_multiarray.so',
+    '/usr/share/doc/readme.txt',
+    '/usr/bin/foo-foo',
+    '/usr/sbin/foo-bar',
+    '/opt/app/bin/run',
+    '/etc/ld.so.conf',
+    '/var/empty',
+    '',
+]
+
+
+def test_same_as_sequential_loop():
+    set_ = RegexSet([re.compile(p_) for p_ in PATTERNS])
+    for f_ in FILES:
+        assert set_.match_index(f_) == set_.match_index_loop(f_), f_
+    assert set_.residual
+
+
+def test_first_pattern_wins():
+    set_ = RegexSet([re.compile(p_) for p_ in PATTERNS])
+    assert set_.match_index('/usr/lib64/libQt5Core.so.5') == 0
+    assert set_.match('/usr/bin/foo-foo').pattern == PATTERNS[5]
+    assert set_.match_index('/usr/sbin/foo-bar') == len(PATTERNS) - 1
+
+
+def test_no_match():
+    set_ = RegexSet([re.compile(r'/usr/bin/.*$'), re.compile(r'.*\.so$')])
+    assert set_.match('/etc/passwd') is None
+    assert RegexSet([]).match_index('/usr/bin/ls') is None
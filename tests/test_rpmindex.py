@@ -0,0 +1,52 @@
+"""Tests for `terrarium_assembler.rpmindex`."""
+
+from terrarium_assembler.rpmindex import RpmFileIndex, build_rpm_index, ROW_SPLIT
+
+
+def pkg_line(name, filename):
+    return ROW_SPLIT.join([name, '1.0', '1.fc36', '0', 'host', filename]) + '\n'
+
+
+def make_index(tmp_path, lines):
+    txt_ = tmp_path / 'file-package-list.txt'
+    txt_.write_text(''.join(lines), encoding='utf-8')
+    index_ = tmp_path / 'rpm-file-index.bin'
+    build_rpm_index(str(txt_), str(index_))
+    return RpmFileIndex(str(index_))
+
+
+def test_two_owners(tmp_path):
+    index_ = make_index(tmp_path, [
+        pkg_line('filesystem', '/usr/share/doc'),
+        pkg_line('bash', '/usr/bin/bash'),
+        pkg_line('bash', '/usr/share/doc'),
+        pkg_line('glibc', '/usr/lib64/libc.so.6'),
+    ])
+    assert len(index_) == 4
+    # last owner wins for lookups
+    assert index_['/usr/share/doc'][0] == 'bash'
+    assert [r_[0] for r_ in index_.owners('/usr/share/doc')] == ['filesystem', 'bash']
+    assert list(index_.paths()) == ['/usr/bin/bash', '/usr/lib64/libc.so.6', '/usr/share/doc']
+    # rows keep every owner in file order
+    assert [(r_[0], r_[5]) for r_ in index_.rows()] == [
+        ('filesystem', '/usr/share/doc'),
+        ('bash', '/usr/bin/bash'),
+        ('bash', '/usr/share/doc'),
+        ('glibc', '/usr/lib64/libc.so.6'),
+    ]
+    # path owned by closure package and later non-closure package is kept
+    assert [r_[5] for r_ in index_.rows(packages={'filesystem', 'glibc'})] == [
+        '/usr/share/doc', '/usr/lib64/libc.so.6']
+    index_.close()
+
+
+def test_lookup(tmp_path):
+    index_ = make_index(tmp_path, [
+        pkg_line('glibc', '/lib64/libc.so.6'),
+        'broken line\n',
+    ])
+    assert '/usr/lib64/libc.so.6' in index_
+    assert index_.get('/usr/bin/nothing') is None
+    assert index_.owners('/usr/bin/nothing') == []
+    assert index_.find('/a') == -1
+    index_.close()
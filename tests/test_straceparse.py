@@ -0,0 +1,75 @@
+"""Tests for `terrarium_assembler.straceparse`."""
+
+import gzip
+import shutil
+import subprocess
+
+import pytest
+
+from terrarium_assembler import straceparse
+from terrarium_assembler.straceparse import trace_filenames
+
+LOG = b'''1234 openat(AT_FDCWD, "/usr/lib64/libc.so.6", O_RDONLY|O_CLOEXEC) = 3
+1234 openat(AT_FDCWD, "/usr/lib64/libmissing.so", O_RDONLY|O_CLOEXEC) = -1 ENOENT (No such file or directory)
+1234 execve("/usr/bin/python3", ["python3"], 0x7ffd /* 20 vars */) = 0
+1234 close(3) = 0
+'''
+
+
+def test_plain_and_gz(tmp_path):
+    plain_ = tmp_path / 'trace.log'
+    plain_.write_bytes(LOG)
+    gz_ = tmp_path / 'trace.log.gz'
+    gz_.write_bytes(gzip.compress(LOG))
+    expected_ = ['/usr/bin/python3', '/usr/lib64/libc.so.6']
+    assert trace_filenames(str(plain_)) == expected_
+    assert trace_filenames(str(gz_)) == expected_
+
+
+@pytest.mark.skipif(not shutil.which('zstd'), reason='no zstd')
+def test_zstd_process(tmp_path, monkeypatch):
+    monkeypatch.setattr(straceparse, 'zstandard', None)
+    plain_ = tmp_path / 'trace.log'
+    plain_.write_bytes(LOG)
+    subprocess.check_call(['zstd', '-q', str(plain_), '-o', str(tmp_path / 'trace.log.zst')])
+    assert trace_filenames(str(tmp_path / 'trace.log.zst')) == ['/usr/bin/python3', '/usr/lib64/libc.so.6']
+
+    corrupt_ = tmp_path / 'corrupt.log.zst'
+    corrupt_.write_bytes((tmp_path / 'trace.log.zst').read_bytes()[:-8] + b'garbage!')
+    with pytest.raises(IOError):
+        trace_filenames(str(corrupt_))
+
+    with straceparse.open_trace(str(tmp_path / 'trace.log.zst')) as lf:
+        lf.read(10)
+        proc_ = lf.proc
+    # process is reaped, not left as zombie
+    assert proc_.returncode is not None
+
+
+def write_two_frames(tmp_path):
+    # every half of log is separate zstd frame, as after «cat a.zst b.zst»
+    half_ = LOG.index(b'1234 execve')
+    frames_ = b''
+    for i_, part_ in enumerate([LOG[:half_], LOG[half_:]]):
+        (tmp_path / f'part{i_}').write_bytes(part_)
+        subprocess.check_call(['zstd', '-q', str(tmp_path / f'part{i_}'), '-o', str(tmp_path / f'part{i_}.zst')])
+        frames_ += (tmp_path / f'part{i_}.zst').read_bytes()
+    zst_ = tmp_path / 'frames.log.zst'
+    zst_.write_bytes(frames_)
+    return str(zst_)
+
+
+@pytest.mark.skipif(not shutil.which('zstd'), reason='no zstd')
+def test_zstd_two_frames_process(tmp_path, monkeypatch):
+    monkeypatch.setattr(straceparse, 'zstandard', None)
+    assert trace_filenames(write_two_frames(tmp_path)) == ['/usr/bin/python3', '/usr/lib64/libc.so.6']
+
+
+@pytest.mark.skipif(not shutil.which('zstd'), reason='no zstd')
+def test_zstd_two_frames_module(tmp_path):
+    pytest.importorskip('zstandard')
+    zst_ = write_two_frames(tmp_path)
+    # read does not stop at the end of the first frame
+    with straceparse.open_trace(zst_) as lf:
+        assert lf.read(straceparse.CHUNK) == LOG
+    assert trace_filenames(zst_) == ['/usr/bin/python3', '/usr/lib64/libc.so.6']